@@ -17,6 +17,36 @@ class Config(object):
     # screenshots
     SCREENSHOTS_DIR = env.str("SCREENSHOTS_DIR", default=os.sep.join([BASEDIR, "screenshots"]))
 
+    SCREENSHOTS_WORKERS = env.int("SCREENSHOTS_WORKERS", default=2)
+    SCREENSHOTS_QUEUE_SIZE = env.int("SCREENSHOTS_QUEUE_SIZE", default=100)
+    # "drop" drops screenshot if queue is full, "wait" waits SCREENSHOTS_QUEUE_TIMEOUT seconds before dropping
+    SCREENSHOTS_QUEUE_POLICY = env.str("SCREENSHOTS_QUEUE_POLICY", default="drop")
+    SCREENSHOTS_QUEUE_TIMEOUT = env.float("SCREENSHOTS_QUEUE_TIMEOUT", default=1)
+
+    # step bodies longer than threshold (bytes) are compressed with zlib, 0 is disabled
+    STEP_BODY_COMPRESS_THRESHOLD = env.int("STEP_BODY_COMPRESS_THRESHOLD", default=0)
+    STEP_BODY_COMPRESS_LEVEL = env.int("STEP_BODY_COMPRESS_LEVEL", default=6)
+    # step bodies longer than threshold (bytes, after compression) are written to SCREENSHOTS_DIR/steps/<session>/
+    STEP_BODY_SPILL_THRESHOLD = env.int("STEP_BODY_SPILL_THRESHOLD", default=0)
+
+    # cleanup
+    CLEANUP_BATCH_SIZE = env.int("CLEANUP_BATCH_SIZE", default=1000)
+    # seconds between batches to lower database load
+    CLEANUP_BATCH_SLEEP = env.float("CLEANUP_BATCH_SLEEP", default=0)
+    # seconds, run is stopped after it and resumed from checkpoint next time, 0 is unlimited
+    CLEANUP_MAX_DURATION = env.int("CLEANUP_MAX_DURATION", default=0)
+    CLEANUP_RMTREE_THREADS = env.int("CLEANUP_RMTREE_THREADS", default=8)
+    # bytes, cleanup deletes least recently modified session dirs from SCREENSHOTS_DIR above it, 0 is disabled
+    SCREENSHOTS_DIR_BUDGET = env.int("SCREENSHOTS_DIR_BUDGET", default=0)
+    CLEANUP_CHECKPOINT_FILE = env.str(
+        "CLEANUP_CHECKPOINT_FILE", default=os.sep.join([BASEDIR, "cleanup_checkpoint.json"])
+    )
+    # steps and sub steps older than months are deleted, keep forever and active sessions are kept, 0 is disabled
+    STEPS_RETENTION_MONTHS = env.int("STEPS_RETENTION_MONTHS", default=0)
+    # months of steps partitions created ahead by cleanup, if steps tables were partitioned
+    # by manage.py partition_steps (PostgreSQL 11+), retention drops whole partitions then
+    STEPS_PARTITIONS_AHEAD = env.int("STEPS_PARTITIONS_AHEAD", default=2)
+
     # logging
     LOG_TYPE = env.str("LOG_TYPE", default="logstash")
     LOG_LEVEL = env.str("LOG_LEVEL", default="DEBUG")
@@ -91,7 +121,26 @@ class Config(object):
     # vm pool
     GET_VM_TIMEOUT = env.int("GET_VM_TIMEOUT", default=180)
     MAKE_REQUEST_ATTEMPTS_AMOUNT = env.int("MAKE_REQUEST_ATTEMPTS_AMOUNT", default=5)
+    REQUEST_THREAD_POOL_MAX = env.int("REQUEST_THREAD_POOL_MAX", default=200)
+    ENDPOINT_CONNECTIONS_MAX = env.int("ENDPOINT_CONNECTIONS_MAX", default=10)
+    # seconds, client connection and session are checked once per interval while request to endpoint is made
+    REQUEST_WATCH_INTERVAL = env.float("REQUEST_WATCH_INTERVAL", default=0.5)
     WAIT_ACTIVE_SESSIONS = env.bool("WAIT_ACTIVE_SESSIONS", default=False)
+    # queued tasks are written when there are DATABASE_QUEUE_BATCH_SIZE of them
+    # or the oldest one has waited for DATABASE_QUEUE_MAX_LATENCY seconds
+    DATABASE_QUEUE_BATCH_SIZE = env.int("DATABASE_QUEUE_BATCH_SIZE", default=100)
+    DATABASE_QUEUE_MAX_LATENCY = env.float("DATABASE_QUEUE_MAX_LATENCY", default=0.1)
+    SESSION_CACHE_SIZE = env.int("SESSION_CACHE_SIZE", default=1000)
+    # seconds since last access
+    SESSION_CACHE_TTL = env.int("SESSION_CACHE_TTL", default=3600)
+    ACTIVE_SESSIONS_RECONCILE_INTERVAL = env.int("ACTIVE_SESSIONS_RECONCILE_INTERVAL", default=60)
+    USER_TOKEN_CACHE_SIZE = env.int("USER_TOKEN_CACHE_SIZE", default=1000)
+    USER_TOKEN_CACHE_TTL = env.int("USER_TOKEN_CACHE_TTL", default=60)
+    # items per page of /api/session/<id>/steps, /api/sessions and /api/queue when cursor is passed without limit
+    API_PAGE_SIZE = env.int("API_PAGE_SIZE", default=100)
+    API_PAGE_SIZE_MAX = env.int("API_PAGE_SIZE_MAX", default=1000)
+    # serve proxied webdriver commands in reactor instead of flask threads
+    WEBDRIVER_ASYNC_PROXY = env.bool("WEBDRIVER_ASYNC_PROXY", default=False)
 
     #############################################################################################################
     #                                              PROVIDER CONFIG                                              #
@@ -129,6 +178,8 @@ class Config(object):
     BIND_LOCALHOST_PORTS = env.bool("BIND_LOCALHOST_PORTS", default=True)
     DOCKER_MAX_COUNT = env.int("DOCKER_MAX_COUNT", default=3)
     DOCKER_PRELOADED = env.json("DOCKER_PRELOADED", default={})
+    # booted and paused containers by platform, they are unpaused instead of cold start of new endpoint
+    DOCKER_PAUSED = env.json("DOCKER_PAUSED", default={})
     DOCKER_BASE_URL = env.str("DOCKER_BASE_URL", default='unix://var/run/docker.sock')
     DOCKER_TIMEOUT = env.int("DOCKER_TIMEOUT", default=120)
     DOCKER_NUM_POOLS = env.int("DOCKER_NUM_POOLS", default=100)
@@ -136,6 +187,11 @@ class Config(object):
     DOCKER_SUBNET = env.str("DOCKER_SUBNET", default="192.168.1.0/24")
     DOCKER_GATEWAY = env.str("DOCKER_GATEWAY", default="192.168.1.254")
     DOCKER_IMAGE_NAME_PREFIX = env.str("DOCKER_IMAGE_NAME_PREFIX", default="")
+    # images of platforms are pulled in parallel on start, progress is logged every interval seconds
+    DOCKER_PULL_CONCURRENCY = env.int("DOCKER_PULL_CONCURRENCY", default=4)
+    DOCKER_PULL_PROGRESS_INTERVAL = env.int("DOCKER_PULL_PROGRESS_INTERVAL", default=5)
+    # seconds, images are refreshed on docker image events, stream of events is reopened every interval
+    DOCKER_IMAGES_REFRESH_INTERVAL = env.int("DOCKER_IMAGES_REFRESH_INTERVAL", default=60)
     DOCKER_CONTAINER_MEMORY_LIMIT = env.str("DOCKER_CONTAINER_MEMORY_LIMIT", default="1g")
     DOCKER_CONTAINER_CPU_PERIOD = env.int("DOCKER_CONTAINER_CPU_PERIOD", default=100000)
     DOCKER_CONTAINER_CPU_QUOTA = env.int("DOCKER_CONTAINER_CPU_QUOTA", default=50000)
@@ -143,6 +199,13 @@ class Config(object):
         "/dev/shm": {"bind": "/dev/shm", "mode": "rw"},
     })
     DOCKER_CONTAINER_ENVIRONMENT = env.dict("DOCKER_CONTAINER_ENVIRONMENT", default={})
+    # seconds, container readiness is probed with exponential backoff between them
+    DOCKER_PROBE_MIN_DELAY = env.float("DOCKER_PROBE_MIN_DELAY", default=0.1)
+    DOCKER_PROBE_MAX_DELAY = env.float("DOCKER_PROBE_MAX_DELAY", default=2)
+    # preloaded container is reset by DOCKER_RECYCLE_SCRIPT through agent after session instead of restart,
+    # it's restarted if script fails or selenium isn't ready in DOCKER_RECYCLE_TIMEOUT seconds
+    DOCKER_RECYCLE = env.bool("DOCKER_RECYCLE", default=False)
+    DOCKER_RECYCLE_TIMEOUT = env.int("DOCKER_RECYCLE_TIMEOUT", default=30)
     DNS_LIST = env.list("DNS_LIST", default=[])
     DNS_SEARCH_LIST = env.list("DNS_SEARCH_LIST", default=[])
 
@@ -150,5 +213,14 @@ class Config(object):
     VM_CREATE_CHECK_PAUSE = env.int("VM_CREATE_CHECK_PAUSE", default=5)
     VM_CREATE_CHECK_ATTEMPTS = env.int("VM_CREATE_CHECK_ATTEMPTS", default=1000)
     PRELOADER_FREQUENCY = env.int("PRELOADER_FREQUENCY", default=3)
+    # endpoints created by preloader at once
+    PRELOADER_CONCURRENCY = env.int("PRELOADER_CONCURRENCY", default=4)
+    # seconds, preload target of platform is raised to amount of get_vm calls for it during window, 0 is disabled
+    PRELOADER_DEMAND_WINDOW = env.int("PRELOADER_DEMAND_WINDOW", default=0)
+    PRELOADER_DEMAND_MAX_TARGET = env.int("PRELOADER_DEMAND_MAX_TARGET", default=10)
+    # seconds, in memory list of free endpoints is reloaded from db after it
+    FREE_ENDPOINTS_RECONCILE_INTERVAL = env.int("FREE_ENDPOINTS_RECONCILE_INTERVAL", default=30)
     SESSION_TIMEOUT = env.int("SESSION_TIMEOUT", default=360)
     PING_TIMEOUT = env.int("PING_TIMEOUT", default=180)
+    # seconds, successful ping of endpoint is trusted for it, 0 is disabled
+    PING_CACHE_TTL = env.int("PING_CACHE_TTL", default=5)
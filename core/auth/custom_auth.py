@@ -1,16 +1,71 @@
 # coding: utf-8
 
+import time
+from collections import OrderedDict
+from threading import Lock
+
 from flask.ext.httpauth import HTTPBasicAuth
 from functools import wraps
 from flask import request, make_response, current_app
-from json import loads, dumps
+from json import dumps
 from werkzeug.datastructures import Authorization
 
+from core import constants
+from core.config import config
+from core.utils import get_request_json, set_request_json
+
 anonymous = Authorization('basic', {'username': 'anonymous', 'password': None})
 
 
+class UserTokenCache(object):
+    """
+    Bounded LRU cache of users by token,
+    users loaded more than ttl seconds ago are loaded again
+    """
+    def __init__(self):
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def max_size(self):
+        return getattr(config, "USER_TOKEN_CACHE_SIZE", constants.USER_TOKEN_CACHE_SIZE)
+
+    @property
+    def ttl(self):
+        return getattr(config, "USER_TOKEN_CACHE_TTL", constants.USER_TOKEN_CACHE_TTL)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get_user(self, token):
+        with self._lock:
+            user, loaded = self._cache.pop(token, (None, None))
+            if user and time.time() - loaded <= self.ttl:
+                self._cache[token] = (user, loaded)
+                return user
+
+        user = current_app.database.get_user(token=token)
+        if user:
+            with self._lock:
+                self._cache[token] = (user, time.time())
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return user
+
+    def invalidate(self, token):
+        with self._lock:
+            self._cache.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+user_tokens = UserTokenCache()
+
+
 def user_exists(token):
-    return current_app.database.get_user(token=token)
+    return user_tokens.get_user(token)
 
 
 def user_not_found():
@@ -38,7 +93,7 @@ def authentificate_failed():
 class DesiredCapabilitiesAuth(HTTPBasicAuth):
     def get_token_from_caps(self):
         try:
-            body = loads(request.data)
+            body = get_request_json(request)
         except ValueError:
             return None
         try:
@@ -48,24 +103,21 @@ class DesiredCapabilitiesAuth(HTTPBasicAuth):
 
         return caps.get("token", None)
 
-    def _restore_username(self):
-        body = loads(request.data)
-        desired_capabilities = body["desiredCapabilities"]
-
-        username = current_app.database.get_user(token=desired_capabilities["token"]).username
-        desired_capabilities["user"] = username
-        body["desiredCapabilities"] = desired_capabilities
+    def _restore_username(self, user):
+        body = get_request_json(request)
+        body["desiredCapabilities"]["user"] = user.username
 
-        request.data = dumps(body)
+        set_request_json(request, body)
 
     def login_required(self, f):
         @wraps(f)
         def decorated(*args, **kwargs):
             _token = self.get_token_from_caps()
             if _token:
-                if not user_exists(_token):
+                user = user_exists(_token)
+                if not user:
                     return user_not_found()
-                self._restore_username()
+                self._restore_username(user)
             return f(*args, **kwargs)
         return decorated
 
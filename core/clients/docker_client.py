@@ -35,6 +35,14 @@ class DockerContainer:
     def status(self):
         return self.origin.status
 
+    @property
+    @exception_handler(return_on_exc=None)
+    def health(self):
+        """
+        :return: "starting", "healthy", "unhealthy" or None if image hasn't healthcheck
+        """
+        return self.origin.attrs["State"].get("Health", {}).get("Status")
+
     @property
     def ip(self):
         if config.BIND_LOCALHOST_PORTS:
@@ -79,10 +87,6 @@ class DockerContainer:
         kwargs["force"] = True
         return self.origin.remove(**kwargs)
 
-    @exception_handler()
-    def rename(self):
-        raise NotImplementedError
-
     @exception_handler()
     def restart(self, **kwargs):
         return self.origin.restart(**kwargs)
@@ -93,11 +97,11 @@ class DockerContainer:
 
     @exception_handler()
     def pause(self):
-        raise NotImplementedError
+        return self.origin.pause()
 
     @exception_handler()
     def unpause(self):
-        raise NotImplementedError
+        return self.origin.unpause()
 
 
 class DockerManageClient:
@@ -173,11 +177,27 @@ class DockerManageClient:
         ]
 
     @exception_handler()
-    def pull_image(self, name=None, tag=None):
-        self.client.images.pull(
-            name=name,
-            tag=tag
-        )
+    def pull_image(self, name=None, tag=None, progress=None):
+        """
+        :param progress: callable, it's called with every status of pull stream
+        """
+        if progress is None:
+            self.client.images.pull(
+                name=name,
+                tag=tag
+            )
+            return
+
+        for status in self.client.api.pull(name, tag=tag, stream=True, decode=True):
+            if "error" in status:
+                raise Exception("Pull {}:{} was failed: {}".format(name, tag, status["error"]))
+            progress(status)
+
+    def image_events(self, since=None, until=None):
+        """
+        :return: generator of image events, it ends at until
+        """
+        return self.client.events(since=since, until=until, filters={"type": "image"}, decode=True)
 
     def create_network(self, network_name):
         """
@@ -7,12 +7,77 @@ REQUEST_TIMEOUT = 60
 MAKE_REQUEST_ATTEMPTS_AMOUNT = 3
 REQUEST_SLEEP_BASE_TIME = 5
 REQUEST_TIMEOUT_ON_CREATE_ENDPOINT = 60
+REQUEST_THREAD_POOL_MAX = 200
+ENDPOINT_CONNECTIONS_MAX = 10
+REQUEST_WATCH_INTERVAL = 0.5
+PING_CACHE_TTL = 5
 
 ANY = u'ANY'
 GET_SESSION_SLEEP_TIME = 2
+SESSION_CACHE_SIZE = 1000
+SESSION_CACHE_TTL = 3600
+ACTIVE_SESSIONS_RECONCILE_INTERVAL = 60
+USER_TOKEN_CACHE_SIZE = 1000
+USER_TOKEN_CACHE_TTL = 60
+API_PAGE_SIZE = 100
+API_PAGE_SIZE_MAX = 1000
 
 # EndpointRemover #
 ER_SLEEP_TIME = 2
 
 # EndpointPreparer #
 EP_SLEEP_TIME = 2
+
+# VirtualMachinesPoolPreloader, 0 window is disabled #
+PRELOADER_CONCURRENCY = 4
+PRELOADER_DEMAND_WINDOW = 0
+PRELOADER_DEMAND_MAX_TARGET = 10
+
+# DockerClone readiness probe backoff, seconds #
+DOCKER_PROBE_MIN_DELAY = 0.1
+DOCKER_PROBE_MAX_DELAY = 2
+
+# DockerPlatforms #
+DOCKER_PULL_CONCURRENCY = 4
+DOCKER_PULL_PROGRESS_INTERVAL = 5
+DOCKER_IMAGES_REFRESH_INTERVAL = 60
+
+# Amount of paused docker containers by platform #
+DOCKER_PAUSED = {}
+
+# DockerClone recycle through agent instead of restart #
+DOCKER_RECYCLE = False
+DOCKER_RECYCLE_TIMEOUT = 30
+# browsers are killed, tmp with webdriver profiles is wiped (X server sockets are kept), selenium is restarted
+DOCKER_RECYCLE_SCRIPT = (
+    "pkill -9 -f 'chrome|chromium|firefox|geckodriver|opera|operadriver' || true\n"
+    "find /tmp -mindepth 1 -maxdepth 1 ! -name '.X*' -exec rm -rf {} +\n"
+    "supervisorctl restart selenium"
+)
+
+# VirtualMachinesPool #
+FREE_ENDPOINTS_RECONCILE_INTERVAL = 30
+
+# Step bodies storage, 0 is disabled #
+STEP_BODY_COMPRESS_THRESHOLD = 0
+STEP_BODY_COMPRESS_LEVEL = 6
+STEP_BODY_SPILL_THRESHOLD = 0
+
+# Cleanup #
+CLEANUP_BATCH_SIZE = 1000
+CLEANUP_BATCH_SLEEP = 0
+CLEANUP_MAX_DURATION = 0
+CLEANUP_RMTREE_THREADS = 8
+STEPS_RETENTION_MONTHS = 0
+STEPS_PARTITIONS_AHEAD = 2
+SCREENSHOTS_DIR_BUDGET = 0
+
+# ScreenshotsPool #
+SCREENSHOTS_WORKERS = 2
+SCREENSHOTS_QUEUE_SIZE = 100
+SCREENSHOTS_QUEUE_POLICY = "drop"
+SCREENSHOTS_QUEUE_TIMEOUT = 1
+
+# DatabaseQueueWorker #
+DATABASE_QUEUE_BATCH_SIZE = 100
+DATABASE_QUEUE_MAX_LATENCY = 0.1
@@ -2,14 +2,23 @@
 
 import time
 import logging
+from copy import copy
 from functools import wraps
-from threading import Lock, Thread
-
-from sqlalchemy import create_engine, asc, desc
-from sqlalchemy.orm import sessionmaker, scoped_session
-
-from core.db.models import Session, SessionLogStep, User, Platform, Provider, Endpoint
+from threading import Thread, Condition
+from collections import deque
+from itertools import groupby
+
+from sqlalchemy import create_engine, asc, desc, inspect, func, or_, and_, select, Sequence
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import sessionmaker, scoped_session, make_transient_to_detached, ColumnProperty
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from core import constants
+from core.db.models import Session, SessionLogStep, SessionLogSubStep, User, Platform, Provider, Endpoint, \
+    StepBodyMixin
 from core.config import config
+from core.profiler import profiler
 
 log = logging.getLogger(__name__)
 
@@ -33,40 +42,133 @@ def transaction(func):
     return wrapper
 
 
+class DatabaseTaskQueue(deque):
+    """
+    deque of (task, params) which remembers when tasks were queued
+    and wakes up DatabaseQueueWorker waiting for them
+    """
+    def __init__(self):
+        super(DatabaseTaskQueue, self).__init__()
+        self.queued_times = deque()
+        self.changed = Condition()
+
+    def append(self, task):
+        with self.changed:
+            super(DatabaseTaskQueue, self).append(task)
+            self.queued_times.append(time.time())
+            self.changed.notify()
+
+    def extend(self, tasks):
+        for task in tasks:
+            self.append(task)
+
+    def popleft(self):
+        with self.changed:
+            self.queued_times.popleft()
+            return super(DatabaseTaskQueue, self).popleft()
+
+    def oldest_task_age(self):
+        """
+        :return: seconds the oldest task has been waiting for, None if queue is empty
+        """
+        with self.changed:
+            return time.time() - self.queued_times[0] if self.queued_times else None
+
+
 class DatabaseQueueWorker(Thread):
-    def __init__(self, task_queue):
+    def __init__(self, task_queue, database=None):
         """
-        :param task_queue: collections.deque
+        :param task_queue: DatabaseTaskQueue
+        :param database: Database, consecutive database.add tasks are written in one transaction
         """
         super(DatabaseQueueWorker, self).__init__()
         self.running = True
         self.daemon = True
         self.task_queue = task_queue
+        self.database = database
+        self.batch_size = getattr(config, "DATABASE_QUEUE_BATCH_SIZE", constants.DATABASE_QUEUE_BATCH_SIZE)
+        self.max_latency = getattr(config, "DATABASE_QUEUE_MAX_LATENCY", constants.DATABASE_QUEUE_MAX_LATENCY)
 
-    def _poll_and_execute(self):
-        while self.task_queue:
-            task, params = self.task_queue.popleft()
+    def _is_add_task(self, task):
+        return self.database is not None and task == self.database.add
+
+    @staticmethod
+    def _encode_bodies(objects):
+        for obj in objects:
+            if isinstance(obj, StepBodyMixin):
+                try:
+                    obj.encode_body()
+                except:
+                    log.exception('Error encoding body of {}, it is stored as is'.format(obj))
+
+    def _add_objects(self, objects):
+        if not objects:
+            return
+        log.debug('Adding {} objects from DatabaseQueue'.format(len(objects)))
+        self._encode_bodies(objects)
+        try:
+            self.database.add_all(objects)
+        except:
+            log.exception('Error adding {} objects, trying to add them one by one'.format(len(objects)))
+            for obj in objects:
+                try:
+                    self.database.add(obj)
+                except:
+                    log.exception('Error executing task: ({}, {})'.format('add', obj))
+
+    def _execute_batch(self, batch):
+        objects = []
+        for task, params in batch:
+            if self._is_add_task(task):
+                objects.extend(params)
+                continue
+
+            self._add_objects(objects)
+            objects = []
             log.debug('Executing task from DatabaseQueue: {}, {}'.format(task.__name__, params))
             try:
                 task(*params)
             except:
                 log.exception('Error executing task: ({}, {})'.format(task.__name__, params))
+        self._add_objects(objects)
+
+    def _poll_and_execute(self):
+        while self.task_queue:
+            profiler.register_database_queue_size(len(self.task_queue))
+            batch = []
+            while self.task_queue and len(batch) < self.batch_size:
+                batch.append(self.task_queue.popleft())
+
+            with profiler.database_flush_duration():
+                self._execute_batch(batch)
+        profiler.register_database_queue_size(len(self.task_queue))
+
+    def _wait_for_flush(self):
+        """
+        Wait until batch is full or the oldest task has waited for max_latency
+        """
+        with self.task_queue.changed:
+            while self.running and len(self.task_queue) < self.batch_size:
+                age = self.task_queue.oldest_task_age()
+                if age is not None and age >= self.max_latency:
+                    return
+                self.task_queue.changed.wait(None if age is None else self.max_latency - age)
 
     def run(self):
         log.info('DatabaseQueueWorker started')
         while self.running:
+            self._wait_for_flush()
             self._poll_and_execute()
-            time.sleep(0.1)
 
     def stop(self):
-        self.running = False
+        with self.task_queue.changed:
+            self.running = False
+            self.task_queue.changed.notify()
         self.join(1)
         log.info("DatabaseQueueWorker stopped")
 
 
 class Database(object):
-    lock = Lock()
-
     def __init__(self, connection_string=None, sqlite=False):
         if not connection_string:
             connection_string = config.DATABASE
@@ -102,6 +204,13 @@ class Database(object):
             query = query.filter_by(provider_id=provider_id)
         return query.filter(Session.closed.is_(False)).all()
 
+    @transaction
+    def get_active_sessions_ids(self, dbsession=None):
+        """
+        :return: list of (session id, provider id) of active sessions
+        """
+        return dbsession.query(Session.id, Session.provider_id).filter(Session.closed.is_(False)).all()
+
     @transaction
     def get_last_session_step(self, session_id, dbsession=None):
         return dbsession.query(SessionLogStep).filter_by(
@@ -118,6 +227,74 @@ class Database(object):
     def get_step_by_id(self, log_step_id, dbsession=None):
         return dbsession.query(SessionLogStep).get(log_step_id)
 
+    @transaction
+    def get_sub_steps(self, log_step_id, dbsession=None):
+        return dbsession.query(SessionLogSubStep).filter_by(
+            session_log_step_id=log_step_id).order_by(
+                asc(SessionLogSubStep.id)).all()
+
+    @transaction
+    def get_sessions_page(self, statuses=None, provider_id=None, user_id=None, created_from=None, created_to=None,
+                          after_id=None, limit=constants.API_PAGE_SIZE, dbsession=None):
+        """
+        :param limit: max amount of sessions, no limit if None
+        :return: active sessions with id greater than after_id ordered by id
+        """
+        query = dbsession.query(Session).filter(Session.closed.is_(False))
+        if statuses:
+            query = query.filter(Session.status.in_(statuses))
+        if provider_id:
+            query = query.filter(Session.provider_id == provider_id)
+        if user_id:
+            query = query.filter(Session.user_id == user_id)
+        if created_from:
+            query = query.filter(Session.created >= created_from)
+        if created_to:
+            query = query.filter(Session.created < created_to)
+        if after_id:
+            query = query.filter(Session.id > after_id)
+        return query.order_by(asc(Session.id)).limit(limit).all()
+
+    @transaction
+    def get_log_steps_page(self, session_id, after_id=None, before_id=None, limit=constants.API_PAGE_SIZE,
+                           dbsession=None):
+        """
+        :return: session steps with id in (after_id, before_id) ordered by id
+        """
+        query = dbsession.query(SessionLogStep).filter(SessionLogStep.session_id == session_id)
+        if after_id:
+            query = query.filter(SessionLogStep.id > after_id)
+        if before_id:
+            query = query.filter(SessionLogStep.id < before_id)
+        return query.order_by(asc(SessionLogStep.id)).limit(limit).all()
+
+    @transaction
+    def get_screenshots(self, session_id, from_id=None, to_id=None, dbsession=None):
+        """
+        :return: screenshots of session steps with id in [from_id, to_id) ordered by step id
+        """
+        query = dbsession.query(SessionLogStep.screenshot).filter(
+            SessionLogStep.session_id == session_id, SessionLogStep.screenshot.isnot(None)
+        )
+        if from_id:
+            query = query.filter(SessionLogStep.id >= from_id)
+        if to_id:
+            query = query.filter(SessionLogStep.id < to_id)
+        return [screenshot for screenshot, in query.order_by(asc(SessionLogStep.id))]
+
+    @transaction
+    def get_next_label_step_id(self, session_id, after_id=None, dbsession=None):
+        query = dbsession.query(SessionLogStep.id).filter(
+            SessionLogStep.session_id == session_id,
+            or_(
+                SessionLogStep.control_line.like("POST %/vmmasterLabel"),
+                SessionLogStep.control_line.like("POST %/vmmasterLabel %")
+            )
+        )
+        if after_id:
+            query = query.filter(SessionLogStep.id > after_id)
+        return query.order_by(asc(SessionLogStep.id)).limit(1).scalar()
+
     @transaction
     def get_user(self, username=None, user_id=None, token=None, dbsession=None):
         if user_id:
@@ -168,6 +345,20 @@ class Database(object):
     def get_active_providers(self, dbsession=None):
         return dbsession.query(Provider).filter_by(active=True).all()
 
+    @transaction
+    def get_platforms_fingerprint(self, dbsession=None):
+        """
+        State of active providers (limits and configs) and names of their platforms,
+        it changes whenever anything platforms index is built from changes
+        """
+        providers = dbsession.query(Provider.id, Provider.max_limit, Provider.config).filter(
+            Provider.active.is_(True)
+        ).order_by(asc(Provider.id)).all()
+        platforms = dbsession.query(Platform.provider_id, Platform.name).join(Provider).filter(
+            Provider.active.is_(True)
+        ).order_by(asc(Platform.provider_id), asc(Platform.name)).all()
+        return [tuple(provider) for provider in providers], [tuple(platform) for platform in platforms]
+
     @transaction
     def get_platforms(self, provider_id, dbsession=None):
         db_platforms = dbsession.query(Platform).filter_by(provider_id=provider_id).all()
@@ -255,6 +446,24 @@ class Database(object):
             platform.provider = provider
             self.add(platform)
 
+    @transaction
+    def update_platforms(self, provider_id, platforms, dbsession=None):
+        """
+        Replace platforms of provider in one transaction: platforms which
+        have gone are deleted, new ones are added
+        """
+        registered = {name for name, in dbsession.query(Platform.name).filter_by(provider_id=provider_id)}
+        if set(platforms) == registered:
+            return
+        dbsession.query(Platform).filter(
+            Platform.provider_id == provider_id, ~Platform.name.in_(platforms)
+        ).delete(synchronize_session=False)
+        for name in set(platforms) - registered:
+            platform = Platform(name)
+            platform.provider_id = provider_id
+            dbsession.add(platform)
+        dbsession.commit()
+
     @transaction
     def unregister_platforms(self, provider, dbsession=None):
         dbsession.query(Platform).filter_by(provider=provider).delete()
@@ -270,51 +479,223 @@ class Database(object):
             provider.max_limit = max_limit
         else:
             provider = Provider(name=name, url=url, config=platforms, max_limit=max_limit)
-        self.add(provider)
+            dbsession.add(provider)
+        dbsession.commit()
         return provider
 
     @transaction
     def unregister_provider(self, provider_id, dbsession=None):
-        provider = dbsession.query(Provider).get(provider_id)
-        provider.active = False
-        self.update(provider)
+        dbsession.query(Provider).filter_by(id=provider_id).update({"active": False}, synchronize_session=False)
+        dbsession.commit()
+
+    @staticmethod
+    def _load_state(obj, loaded):
+        """
+        Set obj attributes from loaded copy of the same row
+        without attaching obj to DB session
+        """
+        if obj is loaded:
+            return
+        for attr in inspect(loaded).mapper.attrs:
+            if isinstance(attr, ColumnProperty) or attr.key in loaded.__dict__:
+                set_committed_value(obj, attr.key, getattr(loaded, attr.key))
+
+    @staticmethod
+    def _load_row(obj, row):
+        """
+        Set obj attributes from written row values, obj becomes detached if it was new
+        """
+        state = inspect(obj)
+
+        def load_columns():
+            for prop in state.mapper.column_attrs:
+                if prop.columns[0].key in row:
+                    set_committed_value(obj, prop.key, row[prop.columns[0].key])
+
+        load_columns()
+        if state.transient:
+            related = {}
+            for prop in state.mapper.relationships:
+                if prop.key in obj.__dict__:
+                    related[prop.key] = obj.__dict__[prop.key]
+                elif prop.direction is MANYTOONE and all(row.get(column.key) is None for column in prop.local_columns):
+                    # new row refers to nothing, so detached object is never lazy loaded on assignment
+                    related[prop.key] = None
+            # identity key is built from primary key loaded above, but all attributes get expired
+            make_transient_to_detached(obj)
+            load_columns()
+            for key, value in related.items():
+                set_committed_value(obj, key, value)
+
+    @staticmethod
+    def _column_default(column):
+        default = column.default
+        if default is None or isinstance(default, Sequence):
+            return None
+        if default.is_callable:
+            return default.arg(None)
+        return copy(default.arg)
+
+    def _row_values(self, obj, changed_only=False, written=None):
+        """
+        Column values of obj keyed by column keys. Foreign keys of many-to-one
+        relationships are taken from related objects or from rows written for them
+        """
+        state = inspect(obj)
+        values = {}
+        for prop in state.mapper.column_attrs:
+            history = state.attrs[prop.key].history
+            if history.added:
+                values[prop.columns[0].key] = history.added[0]
+            elif history.unchanged and not changed_only:
+                values[prop.columns[0].key] = history.unchanged[0]
+
+        for prop in state.mapper.relationships:
+            if prop.direction is not MANYTOONE:
+                continue
+            history = state.attrs[prop.key].history
+            if not history.added:
+                continue
+            related = history.added[0]
+            for local, remote in prop.local_remote_pairs:
+                value = None
+                if written and related in written:
+                    value = written[related][remote.key]
+                elif related is not None:
+                    value = getattr(related, prop.mapper.get_property_by_column(remote).key)
+                    if value is None:
+                        raise InvalidRequestError("{} refers to {} which isn't added to DB".format(obj, related))
+                values[local.key] = value
+
+        if not changed_only:
+            for column in state.mapper.local_table.columns:
+                if column.key not in values and not column.primary_key:
+                    values[column.key] = self._column_default(column)
+        return values
+
+    @staticmethod
+    def _primary_key_clause(obj):
+        mapper = inspect(obj).mapper
+        return and_(*[
+            column == value for column, value in zip(mapper.primary_key, mapper.primary_key_from_instance(obj))
+        ])
+
+    def _insert_related(self, obj, dbsession, written):
+        for prop in inspect(obj).mapper.relationships:
+            related = obj.__dict__.get(prop.key)
+            if prop.direction is MANYTOONE and related is not None and inspect(related).transient \
+                    and related not in written:
+                self._insert(related, dbsession, written)
+
+    def _insert(self, obj, dbsession, written):
+        """
+        Insert row of new object after rows of its new many-to-one related objects,
+        related objects which are in DB already aren't written
+        :param written: dict of rows inserted in current transaction by their objects
+        """
+        self._insert_related(obj, dbsession, written)
+        table = inspect(obj).mapper.local_table
+        row = self._row_values(obj, written=written)
+        result = dbsession.execute(table.insert().values(row))
+        row.update(zip([column.key for column in table.primary_key], result.inserted_primary_key))
+        written[obj] = row
+
+    @staticmethod
+    def _next_ids(table, count, dbsession):
+        """
+        :return: ids taken from sequence of table primary key, None if it has no sequence
+        """
+        primary_key = table.primary_key.columns.values()
+        sequence = primary_key[0].default if len(primary_key) == 1 else None
+        if not isinstance(sequence, Sequence) or not dbsession.bind.dialect.supports_sequences:
+            return None
+        ids = select([sequence.next_value()]).select_from(func.generate_series(1, count))
+        return [row_id for row_id, in dbsession.execute(ids)]
+
+    def _insert_many(self, objects, dbsession, written):
+        """
+        Rows of new objects of one table are inserted by one statement if
+        their ids can be taken beforehand, otherwise they are inserted one by one
+        """
+        objects = [obj for obj in objects if obj not in written]
+        table = inspect(objects[0]).mapper.local_table if objects else None
+        ids = self._next_ids(table, len(objects), dbsession) if len(objects) > 1 else None
+        if ids is None:
+            for obj in objects:
+                self._insert(obj, dbsession, written)
+            return
+
+        for obj in objects:
+            self._insert_related(obj, dbsession, written)
+        rows = []
+        for obj, row_id in zip(objects, ids):
+            row = self._row_values(obj, written=written)
+            row[table.primary_key.columns.values()[0].key] = row_id
+            rows.append(row)
+        dbsession.execute(table.insert().values(rows))
+        written.update(zip(objects, rows))
+
+    def _add_objects(self, objects, dbsession):
+        written = {}
+        for obj in objects:
+            if inspect(obj).key is not None:
+                raise InvalidRequestError("{} is in DB already".format(obj))
+        for _, group in groupby(objects, key=lambda obj: inspect(obj).mapper.local_table):
+            self._insert_many(list(group), dbsession, written)
+        dbsession.commit()
+        for obj, row in written.items():
+            self._load_row(obj, row)
 
     @transaction
     def add(self, obj, dbsession):
         """
         Add new object to DB
         """
-        with self.lock:
-            dbsession.add(obj)
-            dbsession.commit()
-            dbsession.expunge_all()
+        if inspect(obj).key is not None:
+            return self.update(obj, dbsession=dbsession)
+        self._add_objects([obj], dbsession)
+
+    @transaction
+    def add_all(self, objects, dbsession):
+        """
+        Add new objects to DB in one transaction, rows of consecutive
+        objects of one table are inserted by one statement
+        """
+        self._add_objects(objects, dbsession)
 
     @transaction
     def update(self, obj, dbsession):
         """
-        Upload local object state to DB
+        Upload changed columns of local object to DB, other columns
+        and related objects aren't written, so concurrent changes of them are kept
         """
-        with self.lock:
-            dbsession.merge(obj)
-            dbsession.commit()
-            dbsession.expunge_all()
+        if inspect(obj).key is None:
+            return self.add(obj, dbsession=dbsession)
+        values = self._row_values(obj, changed_only=True)
+        if not values:
+            return
+        table = inspect(obj).mapper.local_table
+        dbsession.execute(table.update().where(self._primary_key_clause(obj)).values(values))
+        dbsession.commit()
+        self._load_row(obj, values)
 
     @transaction
     def refresh(self, obj, dbsession):
         """
         Refresh object state from DB
         """
-        with self.lock:
-            dbsession.add(obj)
-            dbsession.refresh(obj)
-            dbsession.expunge_all()
+        mapper = inspect(obj).mapper
+        loaded = dbsession.query(mapper).populate_existing().get(mapper.primary_key_from_instance(obj))
+        if loaded is None:
+            raise InvalidRequestError("Could not refresh instance '{}'".format(obj))
+        self._load_state(obj, loaded)
+        dbsession.expunge_all()
 
     @transaction
     def delete(self, obj, dbsession):
         """
-        Delete object from DB
+        Delete object row from DB, dependent rows are deleted by foreign keys
         """
-        with self.lock:
-            dbsession.delete(obj)
-            dbsession.commit()
-            dbsession.expunge_all()
+        table = inspect(obj).mapper.local_table
+        dbsession.execute(table.delete().where(self._primary_key_clause(obj)))
+        dbsession.commit()
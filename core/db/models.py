@@ -3,21 +3,25 @@
 import os
 import time
 import json
+import zlib
 import logging
-from functools import partial, wraps
+from functools import wraps
 from uuid import uuid4
 from datetime import datetime
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, Sequence, String, Enum, ForeignKey, DateTime, Boolean, JSON
+from sqlalchemy import Column, Integer, Sequence, String, Enum, ForeignKey, DateTime, Boolean, JSON, Index, \
+    LargeBinary
 from sqlalchemy.orm import relationship, backref
 
-from flask import current_app
+from flask import current_app, has_app_context
 
 from core.config import config
 from core import constants
+from core.profiler import profiler
+from core.auth.custom_auth import user_tokens
 from core.exceptions import CreationException
-from core.utils import network_utils, exception_handler, kill_process
+from core.utils import network_utils, exception_handler, kill_process, write_file
 
 log = logging.getLogger(__name__)
 Base = declarative_base()
@@ -37,7 +41,95 @@ class FeaturesMixin(object):
         current_app.database.delete(self)
 
 
-class SessionLogSubStep(Base, FeaturesMixin):
+def step_body_min_encoded_length():
+    """
+    :return: length of the shortest body which isn't stored as is, None if bodies are always stored as is
+    """
+    thresholds = [
+        getattr(config, "STEP_BODY_COMPRESS_THRESHOLD", constants.STEP_BODY_COMPRESS_THRESHOLD),
+        getattr(config, "STEP_BODY_SPILL_THRESHOLD", constants.STEP_BODY_SPILL_THRESHOLD)
+    ]
+    thresholds = [threshold for threshold in thresholds if threshold]
+    return min(thresholds) + 1 if thresholds else None
+
+
+def step_bodies_dir(session_id):
+    """
+    Bodies are kept out of session directory, so they aren't deleted with screenshots
+    """
+    return os.path.join(config.SCREENSHOTS_DIR, "steps", str(session_id))
+
+
+def encode_step_body(body, session_id=None):
+    """
+    Body longer than STEP_BODY_COMPRESS_THRESHOLD is compressed with zlib,
+    body (or compressed body) longer than STEP_BODY_SPILL_THRESHOLD is written
+    to SCREENSHOTS_DIR/steps/<session_id>/
+    :return: (body, compressed body, body file path) to store
+    """
+    min_length = step_body_min_encoded_length()
+    if not body or not min_length or len(body) < min_length:
+        return body, None, None
+
+    compress_threshold = getattr(config, "STEP_BODY_COMPRESS_THRESHOLD", constants.STEP_BODY_COMPRESS_THRESHOLD)
+    spill_threshold = getattr(config, "STEP_BODY_SPILL_THRESHOLD", constants.STEP_BODY_SPILL_THRESHOLD)
+
+    data = body.encode("utf-8") if isinstance(body, unicode) else body
+    compressed = bool(compress_threshold) and len(data) > compress_threshold
+    if compressed:
+        data = zlib.compress(data, getattr(config, "STEP_BODY_COMPRESS_LEVEL", constants.STEP_BODY_COMPRESS_LEVEL))
+
+    if spill_threshold and session_id and len(data) > spill_threshold:
+        path = os.path.join(step_bodies_dir(session_id), "%s%s" % (uuid4().hex, ".z" if compressed else ".txt"))
+        write_file(path, data)
+        return None, None, path
+
+    if compressed:
+        return None, data, None
+    return body, None, None
+
+
+def decode_step_body(body, body_zlib=None, body_file=None):
+    if body_file:
+        try:
+            with open(body_file, "rb") as f:
+                data = f.read()
+        except IOError:
+            log.warning("Step body file %s not found" % body_file)
+            return None
+        if body_file.endswith(".z"):
+            data = zlib.decompress(data)
+        return data.decode("utf-8", "replace")
+
+    if body_zlib is not None:
+        return zlib.decompress(body_zlib).decode("utf-8", "replace")
+
+    return body
+
+
+class StepBodyMixin(object):
+    """
+    Body of step is stored as is, compressed or in file, see encode_step_body.
+    It's encoded by encode_body before writing to DB, not by thread which sets it
+    """
+    _body = Column("body", String)
+    body_zlib = Column(LargeBinary)
+    body_file = Column(String)
+
+    @property
+    def body(self):
+        return decode_step_body(self._body, self.body_zlib, self.body_file)
+
+    @body.setter
+    def body(self, value):
+        self._body, self.body_zlib, self.body_file = value, None, None
+
+    def encode_body(self):
+        if self._body is not None:
+            self._body, self.body_zlib, self.body_file = encode_step_body(self._body, self._body_session_id)
+
+
+class SessionLogSubStep(Base, FeaturesMixin, StepBodyMixin):
     __tablename__ = 'sub_steps'
 
     id = Column(Integer, Sequence('sub_steps_id_seq'), primary_key=True)
@@ -47,18 +139,28 @@ class SessionLogSubStep(Base, FeaturesMixin):
         index=True
     )
     control_line = Column(String)
-    body = Column(String)
     created = Column(DateTime, default=datetime.now)
 
-    def __init__(self, control_line, body=None, parent_id=None):
+    # session of parent step, it's used for body files path only
+    _session_id = None
+
+    @property
+    def _body_session_id(self):
+        return self._session_id
+
+    def __init__(self, control_line, body=None, parent_id=None, session_id=None):
         self.control_line = control_line
+        self._session_id = session_id
         self.body = body
         self.session_log_step_id = parent_id
         current_app.database_task_queue.append((current_app.database.add, (self,)))
 
 
-class SessionLogStep(Base, FeaturesMixin):
+class SessionLogStep(Base, FeaturesMixin, StepBodyMixin):
     __tablename__ = 'session_log_steps'
+    __table_args__ = (
+        Index('ix_session_log_steps_session_id_id', 'session_id', 'id'),
+    )
 
     id = Column(Integer, Sequence('session_log_steps_id_seq'),
                 primary_key=True)
@@ -66,7 +168,6 @@ class SessionLogStep(Base, FeaturesMixin):
         Integer, ForeignKey('sessions.id', ondelete='CASCADE'), index=True
     )
     control_line = Column(String)
-    body = Column(String)
     screenshot = Column(String)
     created = Column(DateTime, default=datetime.now)
 
@@ -81,25 +182,43 @@ class SessionLogStep(Base, FeaturesMixin):
         )
     )
 
+    @property
+    def _body_session_id(self):
+        return self.session_id
+
     def __init__(self, control_line, body=None, session_id=None, created=None):
         self.control_line = control_line
-        self.body = body
         if session_id:
             self.session_id = session_id
+        self.body = body
         if created:
             self.created = created
         current_app.database_task_queue.append((current_app.database.add, (self,)))
 
+    @property
+    def info(self):
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "control_line": self.control_line,
+            "screenshot": self.screenshot,
+            "created": str(self.created) if self.created else None
+        }
+
     def add_sub_step_to_step(self, control_line, body):
         SessionLogSubStep(
             control_line=control_line,
             body=body,
-            parent_id=self.id
+            parent_id=self.id,
+            session_id=self.session_id
         )
 
 
 class Session(Base, FeaturesMixin):
     __tablename__ = 'sessions'
+    __table_args__ = (
+        Index('ix_sessions_closed_id', 'closed', 'id'),
+    )
 
     id = Column(Integer, Sequence('session_id_seq'), primary_key=True)
     user_id = Column(ForeignKey('users.id', ondelete='SET NULL'), default=1)
@@ -129,12 +248,13 @@ class Session(Base, FeaturesMixin):
     keep_forever = Column(Boolean, default=False)
 
     is_active = True
+    # latest step added through this object, it's written by DatabaseQueueWorker later
+    _last_log_step = None
 
     # Relationships
     session_steps = relationship(
         SessionLogStep,
         cascade="all, delete",
-        lazy='subquery',
         backref=backref(
             "session",
             enable_typechecks=False,
@@ -165,7 +285,7 @@ class Session(Base, FeaturesMixin):
                 self.name = dc["name"]
 
             if dc.get("user", None):
-                self.set_user(dc["user"])
+                self.set_user(dc["user"], token=dc.get("token", None))
 
             if dc.get("takeScreenshot", None):
                 self.take_screenshot = True
@@ -177,6 +297,7 @@ class Session(Base, FeaturesMixin):
                 self.run_script = json.dumps(dc["runScript"])
 
         self.add()
+        current_app.sessions.register_active(self)
 
         if not self.name:
             self.name = "Unnamed session " + str(self.id)
@@ -218,11 +339,13 @@ class Session(Base, FeaturesMixin):
 
     @property
     def current_log_step(self):
-        self.refresh()
-        return self.session_steps[-1] if self.session_steps else None
+        log_step = self._last_log_step
+        if log_step is not None and log_step.id:
+            return log_step
+        return current_app.database.get_last_session_step(self.id)
 
     def add_session_step(self, control_line, body=None, created=None):
-        SessionLogStep(
+        self._last_log_step = SessionLogStep(
             control_line=control_line,
             body=body,
             session_id=self.id,
@@ -249,9 +372,11 @@ class Session(Base, FeaturesMixin):
     def start_timer(self):
         self.modified = datetime.now()
         self.is_active = False
+        current_app.sessions.start_timer(self)
 
     def stop_timer(self):
         self.is_active = True
+        current_app.sessions.stop_timer(self)
 
     def stop_vnc_proxy(self):
         if self.vnc_proxy_pid:
@@ -263,6 +388,8 @@ class Session(Base, FeaturesMixin):
             self.reason = "%s" % reason
         self.deleted = datetime.now()
         self.save()
+        current_app.sessions.evict(self)
+        current_app.sessions.unregister_active(self)
 
         if self.stop_vnc_proxy():
             log.info("VNC Proxy was stopped for {}".format(self))
@@ -271,6 +398,7 @@ class Session(Base, FeaturesMixin):
             self.ws.close()
 
         if getattr(self, "endpoint", None) and getattr(self.endpoint, "send_to_service", None):
+            self.endpoint.close_connections()
             self.endpoint.send_to_service()
 
         log.info("Session %s closed. %s" % (self.id, self.reason))
@@ -312,19 +440,28 @@ class Session(Base, FeaturesMixin):
         self.timeouted = True
         self.failed(reason="Session timeout. No activity since %s" % str(self.modified))
 
-    def set_user(self, username):
-        self.user = current_app.database.get_user(username=username)
+    def set_user(self, username, token=None):
+        user = user_tokens.get_user(token) if token else None
+        if not user or user.username != username:
+            user = current_app.database.get_user(username=username)
+        # cached users are shared between sessions, so only foreign key is set
+        if user:
+            self.user_id = user.id
 
-    def _add_sub_step(self, control_line, body, context):
+    def _add_sub_step(self, control_line, body, context, log_step=None):
         with context():
-            _log_step = self.current_log_step
-            if _log_step:
-                _log_step.add_sub_step_to_step(control_line, body)
+            # log_step was queued before this task, so it's written already
+            if log_step is None or not log_step.id:
+                log_step = current_app.database.get_last_session_step(self.id)
+            if log_step:
+                log_step.add_sub_step_to_step(control_line, body)
             else:
                 log.warning('No log steps found for session {}. Skip adding sub step'.format(self))
 
     def add_sub_step(self, control_line, body=None):
-        current_app.database_task_queue.append((self._add_sub_step, (control_line, body, current_app.app_context)))
+        current_app.database_task_queue.append(
+            (self._add_sub_step, (control_line, body, current_app.app_context, self._last_log_step))
+        )
 
     def make_request(self, port, request,
                      timeout=getattr(config, "REQUEST_TIMEOUT", constants.REQUEST_TIMEOUT)):
@@ -379,6 +516,8 @@ class Endpoint(Base, FeaturesMixin):
         self.deleted_time = datetime.now()
         self.deleted = True
         self.save()
+        self.update_free_endpoints()
+        self.close_connections()
         log.info("Deleted {}".format(self.name))
 
     def create(self):
@@ -427,6 +566,12 @@ class Endpoint(Base, FeaturesMixin):
     def agent_ws_url(self):
         return "{}:{}".format(self.ip, self.agent_port)
 
+    def close_connections(self):
+        if self.ip and self.ports:
+            network_utils.connection_pools.close(self.ip, self.bind_ports)
+        if self.ip:
+            network_utils.ping_results.forget(self.ip)
+
     def service_mode_on(self):
         self.set_mode("service")
 
@@ -446,17 +591,30 @@ class Endpoint(Base, FeaturesMixin):
     def set_ready(self, value):
         self.ready = value
         self.save()
+        if not value and self.ip:
+            network_utils.ping_results.forget(self.ip)
+        self.update_free_endpoints()
 
     def set_in_use(self, value):
         if not value:
             self.used_time = datetime.now()
         self.in_use = value
         self.save()
+        self.update_free_endpoints()
+
+    def update_free_endpoints(self):
+        """
+        Endpoints pool of provider keeps ready endpoints which are not in use in memory
+        """
+        pool = getattr(current_app, "pool", None) if has_app_context() else None
+        if pool is not None:
+            pool.free_endpoints.update(self)
 
     def set_env_vars(self, env_vars):
         if not isinstance(env_vars, dict):
             return
-        self.environment_variables.update(env_vars)
+        # new dict is assigned, changes made in place aren't written by save
+        self.environment_variables = dict(self.environment_variables or {}, **env_vars)
         self.save()
 
     @property
@@ -495,30 +653,39 @@ class Endpoint(Base, FeaturesMixin):
         return 'ondemand' in self.name
 
     def ping_vm(self):
+        """
+        All ports are probed at once every 100 ms, successful result is
+        trusted for PING_CACHE_TTL seconds
+        """
         ports = self.bind_ports
+        if network_utils.ping_results.is_recent(self.ip, ports):
+            log.info("Recent ping for {clone} with {ip}:{ports} was successful".format(
+                clone=self.name, ip=self.ip, ports=ports))
+            return True
+
         timeout = config.PING_TIMEOUT
-        result = [False, False]
+        result = {port: False for port in ports}
 
         log.info("Starting ping vm {clone}: {ip}:{port}".format(
             clone=self.name, ip=self.ip, port=ports))
         start = time.time()
-        _ping = partial(network_utils.ping, self.ip)
         while time.time() - start < timeout:
-            result = map(_ping, ports)
-            if all(result):
+            result = network_utils.ping_ports(self.ip, ports)
+            if all(result.values()):
                 log.info(
                     "Successful ping for {clone} with {ip}:{ports}".format(
                         clone=self.name, ip=self.ip, ports=ports))
                 break
             time.sleep(0.1)
 
-        if not all(result):
-            fails = [port for port, res in zip(ports, result) if res is False]
+        if not all(result.values()):
+            fails = [port for port, res in result.items() if res is False]
             log.info("Failed ping for {clone} with {ip}:{ports}".format(
                 clone=self.name, ip=self.ip, ports=str(fails))
             )
             return False
 
+        network_utils.ping_results.add(self.ip, ports)
         return True
 
 
@@ -833,7 +1000,9 @@ class DockerClone(Endpoint):
         if config.BIND_LOCALHOST_PORTS:
             kwargs["ports"] = self.defined_ports_from_config.values()
 
+        start = time.time()
         self.__container = self.client.run_container(**kwargs)
+        profiler.register_endpoint_startup(self.platform_name, "container", time.time() - start)
 
         if config.BIND_LOCALHOST_PORTS:
             self.ports = self.__make_binded_ports()
@@ -848,6 +1017,23 @@ class DockerClone(Endpoint):
         self._wait_for_activated_service()
         super(DockerClone, self).create()
 
+    def pause(self):
+        """
+        Ready container is paused and kept not ready till it's taken by
+        VirtualMachinesPool.add_from_paused and unpaused instead of cold start
+        """
+        self.set_ready(False)
+        self.close_connections()
+        self.__container.pause()
+        log.info("Container {} was paused".format(self.name))
+
+    @clone_refresher
+    def unpause(self):
+        log.info("Unpausing container {}".format(self.name))
+        self.__container.unpause()
+        self._wait_for_activated_service()
+        super(DockerClone, self).create()
+
     @property
     def selenium_is_ready(self):
         for status, headers, body in network_utils.make_request(
@@ -859,33 +1045,59 @@ class DockerClone(Endpoint):
             pass
         return status == 200
 
-    def _wait_for_activated_service(self):
+    def _wait_for_activated_service(self, sleep=time.sleep):
+        """
+        Container is probed with exponential backoff from DOCKER_PROBE_MIN_DELAY
+        to DOCKER_PROBE_MAX_DELAY seconds, container is inspected once per probe,
+        endpoint isn't read from db. State of container is inspected after
+        the last action on it, so it's never stale, e.g. paused after unpause.
+        Selenium is requested when container is running with ip and it's healthy
+        or hasn't healthcheck
+        :param sleep: function waiting between probes
+        """
         ping_retry = 1
+        start = time.time()
+        delay = getattr(config, "DOCKER_PROBE_MIN_DELAY", constants.DOCKER_PROBE_MIN_DELAY)
+        max_delay = getattr(config, "DOCKER_PROBE_MAX_DELAY", constants.DOCKER_PROBE_MAX_DELAY)
 
         while not self.ready and not self.deleted:
-            self.refresh_endpoint()
-            if self.is_spawning:
+            self.__container = self.get_container()
+            status = self.__container.status.lower() if self.__container else None
+            if status in ('restarting', 'removing'):
                 log.info("Container {} is spawning...".format(self.name))
 
-            elif self.is_created:
+            elif status in ('created', 'running'):
+                health = self.__container.health
                 if not self.__container.ip:
                     log.info("Waiting ip for {}".format(self.name))
-                    continue
-                self.ip = self.__container.ip
-                if self.ping_vm() and self.selenium_is_ready:
-                    self.set_ready(True)
-                    break
-                if ping_retry > config.VM_PING_RETRY_COUNT:
+                elif health == "unhealthy":
+                    raise CreationException("Container {} is unhealthy.".format(self.name))
+                elif health == "starting":
+                    log.info("Waiting healthcheck for {}".format(self.name))
+                else:
+                    self.ip = self.__container.ip
+                    if config.BIND_LOCALHOST_PORTS:
+                        self.ports = self.__make_binded_ports()
+                    pinged = self.ping_vm()
+                    if pinged and self.selenium_is_ready:
+                        self.set_ready(True)
+                        break
+                    # selenium which is starting yet is probed again till the same timeout
                     p = config.VM_PING_RETRY_COUNT * config.PING_TIMEOUT
-                    log.info("Container {} pings more than {} seconds...".format(self.name, p))
-                    self.delete(try_to_rebuild=True)
-                    break
-                ping_retry += 1
-
-            elif self.is_broken or not self.status:
+                    if ping_retry > config.VM_PING_RETRY_COUNT or time.time() - start > p:
+                        log.info("Container {} pings more than {} seconds...".format(self.name, p))
+                        self.delete(try_to_rebuild=True)
+                        break
+                    if not pinged:
+                        ping_retry += 1
+
+            elif status in ('paused', 'exited', 'dead') or not status:
                 raise CreationException("Container {} has not been created.".format(self.name))
             else:
-                log.warning("Unknown status {} for container {}".format(self.status, self.name))
+                log.warning("Unknown status {} for container {}".format(status, self.name))
+
+            sleep(delay)
+            delay = min(delay * 2, max_delay)
         return self.ready
 
     @clone_refresher
@@ -907,15 +1119,75 @@ class DockerClone(Endpoint):
                 super(DockerClone, self).delete()
             return self.deleted
 
+    def recycle(self):
+        """
+        Browsers state is reset by DOCKER_RECYCLE_SCRIPT through agent and
+        container is kept running, script restarts selenium
+        :return: True if selenium is ready after script in DOCKER_RECYCLE_TIMEOUT seconds
+        """
+        timeout = getattr(config, "DOCKER_RECYCLE_TIMEOUT", constants.DOCKER_RECYCLE_TIMEOUT)
+        script = getattr(config, "DOCKER_RECYCLE_SCRIPT", constants.DOCKER_RECYCLE_SCRIPT)
+        marker = "vmmaster-recycled-%s" % uuid4().hex[:8]
+        start = time.time()
+
+        log.info("Recycling container {}".format(self.name))
+        try:
+            output = network_utils.run_agent_script(
+                self.ip, self.agent_port, "set -e\n%s\necho %s" % (script, marker), timeout
+            )
+        except Exception as e:
+            log.warning("Recycle script of {} was failed: {}".format(self.name, e))
+            return False
+        if marker not in output:
+            log.warning("Recycle script of {} was failed: {}".format(self.name, output[-1000:]))
+            return False
+
+        delay = getattr(config, "DOCKER_PROBE_MIN_DELAY", constants.DOCKER_PROBE_MIN_DELAY)
+        max_delay = getattr(config, "DOCKER_PROBE_MAX_DELAY", constants.DOCKER_PROBE_MAX_DELAY)
+        while time.time() - start < timeout:
+            try:
+                if all(network_utils.ping_ports(self.ip, self.bind_ports).values()) and self.selenium_is_ready:
+                    self.set_ready(True)
+                    return True
+            except Exception as e:
+                log.debug("Selenium of {} isn't ready yet: {}".format(self.name, e))
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+        log.warning("Selenium of {} isn't ready in {} seconds after recycle".format(self.name, timeout))
+        return False
+
+    @property
+    def can_be_recycled(self):
+        return bool(
+            getattr(config, "DOCKER_RECYCLE", constants.DOCKER_RECYCLE) and
+            self.agent_port and self.ip and self.status == "running"
+        )
+
     @clone_refresher
     def rebuild(self):
+        """
+        Preloaded container is recycled if DOCKER_RECYCLE is on,
+        it's restarted if it can't be recycled or recycle fails
+        """
         log.info("Rebuilding container {}".format(self.name))
         self.set_ready(False)
 
         try:
             if self.__container:
+                if self.can_be_recycled:
+                    start = time.time()
+                    recycled = self.recycle()
+                    profiler.register_endpoint_rebuild(self.platform_name, "recycle", recycled, time.time() - start)
+                    if recycled:
+                        log.info("Container {} was recycled".format(self.name))
+                        return self.ready
+                    log.info("Restarting container {} after failed recycle".format(self.name))
+
+                start = time.time()
                 self.__container.restart()
                 self._wait_for_activated_service()
+                profiler.register_endpoint_rebuild(self.platform_name, "restart", self.ready, time.time() - start)
         except:
             log.exception("Rebuild {} was failed".format(self.name))
             return self.delete()
@@ -932,6 +1204,7 @@ class User(Base, FeaturesMixin):
         return str(uuid4())
 
     def regenerate_token(self):
+        user_tokens.invalidate(self.token)
         self.token = User.generate_token()
         self.save()
         return self.token
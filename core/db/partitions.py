@@ -0,0 +1,305 @@
+# coding: utf-8
+
+"""
+Monthly range partitions of session_log_steps and sub_steps by created (PostgreSQL 11+).
+Tables are partitioned once by manage.py partition_steps, it isn't a migration: all rows
+are copied, so it's run in maintenance window. Cleanup creates partitions of coming months
+and drops whole partitions of old months then.
+"""
+
+import re
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+
+log = logging.getLogger(__name__)
+
+# sub steps go first: they reference steps and have to be rebuilt before them
+STEPS_TABLES = ("sub_steps", "session_log_steps")
+PARTITION_NAME = "%s_y%04dm%02d"
+PARTITION_NAME_RE = r"^%s_y(\d{4})m(\d{2})$"
+DEFAULT_PARTITION_NAME = "%s_default"
+# sub steps are deleted with steps by trigger, foreign key of partitioned sub steps can't do it
+DELETE_SUB_STEPS_FUNCTION = "delete_sub_steps_of_step"
+DELETE_SUB_STEPS_TRIGGER = "session_log_steps_delete_sub_steps"
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(month, months):
+    year, month_index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return datetime(year, month_index + 1, 1)
+
+
+def partition_name(table, month):
+    return PARTITION_NAME % (table, month.year, month.month)
+
+
+def statement(connection, sql, **identifiers):
+    """
+    Text statement with quoted identifiers put in {placeholders},
+    values are passed to execute as bound parameters
+    """
+    preparer = connection.dialect.identifier_preparer
+    return text(sql.format(**{key: preparer.quote(name) for key, name in identifiers.items()}))
+
+
+def is_partitioned(connection, table):
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(text(
+        "SELECT 1 FROM pg_class WHERE relname = :table AND relkind = 'p'"
+    ), table=table).scalar())
+
+
+def month_partitions(connection, table):
+    """
+    :return: list of (first day of month, partition name) ordered by month
+    """
+    rows = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = :table"
+    ), table=table)
+    partitions = []
+    for name, in rows:
+        match = re.match(PARTITION_NAME_RE % table, name)
+        if match:
+            partitions.append((datetime(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+def table_exists(connection, table):
+    return bool(connection.execute(text("SELECT to_regclass(:table)"), table=table).scalar())
+
+
+def create_month_partition(connection, table, month):
+    """
+    Create partition of month if it doesn't exist. PostgreSQL refuses to create
+    partition for rows which are in default partition already, so if partition
+    is created late, rows of month are moved from default partition to new table
+    and it's attached as partition then
+    """
+    name, default = partition_name(table, month), DEFAULT_PARTITION_NAME % table
+    if table_exists(connection, name):
+        return
+
+    # bounds are plain literals, PostgreSQL 11 doesn't accept expressions there
+    bounds = {"start": str(month.date()), "end": str(add_months(month, 1).date())}
+    if not table_exists(connection, default) or not connection.execute(statement(
+        connection, "SELECT 1 FROM {default} WHERE created >= :start AND created < :end LIMIT 1", default=default
+    ), **bounds).scalar():
+        connection.execute(statement(
+            connection, "CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (:start) TO (:end)",
+            name=name, table=table
+        ), **bounds)
+        return
+
+    connection.execute(statement(connection, "CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)",
+                                 name=name, table=table))
+    moved = connection.execute(statement(
+        connection,
+        "WITH moved AS (DELETE FROM {default} WHERE created >= :start AND created < :end RETURNING *) "
+        "INSERT INTO {name} SELECT * FROM moved",
+        default=default, name=name
+    ), **bounds).rowcount
+    connection.execute(statement(
+        connection, "ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (:start) TO (:end)",
+        table=table, name=name
+    ), **bounds)
+    log.warning(
+        "Partition %s of %s is created late, %s rows are moved to it from default partition" % (name, table, moved)
+    )
+
+
+def create_month_partitions(connection, table, first_month, last_month):
+    month = month_start(first_month)
+    while month <= last_month:
+        create_month_partition(connection, table, month)
+        month = add_months(month, 1)
+
+
+def ensure_month_partitions(connection, months_ahead):
+    """
+    Create partitions of current and months_ahead next months for every steps table,
+    it has to run before month begins, see create_month_partition
+    """
+    current_month = month_start(datetime.now())
+    for table in STEPS_TABLES:
+        create_month_partitions(connection, table, current_month, add_months(current_month, months_ahead))
+
+
+def drop_month_partition(connection, table, name, keep=None):
+    """
+    Detach partition, move rows matching keep condition back to table,
+    they get to default partition then, and drop partition.
+    Dropping rows doesn't fire delete trigger, so sub steps of dropped steps
+    are deleted explicitly, some of them may be in partition of the next month
+
+    :param keep: sql condition on rows of partition, it's not a place for values
+    """
+    connection.execute(statement(connection, "ALTER TABLE {table} DETACH PARTITION {name}", table=table, name=name))
+    if keep:
+        connection.execute(statement(
+            connection, "INSERT INTO {table} SELECT * FROM {name} WHERE " + keep, table=table, name=name
+        ))
+    if table == "session_log_steps":
+        connection.execute(statement(
+            connection,
+            "DELETE FROM sub_steps WHERE session_log_step_id IN "
+            "(SELECT id FROM {name} WHERE (" + (keep or "false") + ") IS NOT TRUE)",
+            name=name
+        ))
+    connection.execute(statement(connection, "DROP TABLE {name}", name=name))
+    log.info("Partition %s of %s dropped" % (name, table))
+
+
+def _constraints(connection, table, constraint_type):
+    """
+    :return: list of (name, definition) of table constraints of type,
+    foreign keys between steps tables are skipped
+    """
+    return connection.execute(text(
+        "SELECT constraint_.conname, pg_get_constraintdef(constraint_.oid) FROM pg_constraint constraint_ "
+        "JOIN pg_class source ON constraint_.conrelid = source.oid "
+        "LEFT JOIN pg_class target ON constraint_.confrelid = target.oid "
+        "WHERE source.relname = :table AND constraint_.contype = :constraint_type "
+        "AND (target.relname IS NULL OR target.relname NOT IN :steps_tables)"
+    ), table=table, constraint_type=constraint_type, steps_tables=STEPS_TABLES).fetchall()
+
+
+def _rebuild_table(connection, table, partitioned=False):
+    """
+    Create new table like existing one and keep definitions of existing one to restore them
+    when rows are copied, see _finish_rebuild: indexes, primary key and foreign keys to tables
+    other than steps. Partitioned table has primary key of id and created,
+    PostgreSQL requires partition key in it. Id sequence is kept.
+    """
+    source = "%s_old" % table
+    connection.execute(statement(connection, "ALTER TABLE {table} RENAME TO {source}", table=table, source=source))
+    indexes = [
+        indexdef for indexdef, in connection.execute(text(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = :table"
+        ), table=source) if not indexdef.startswith("CREATE UNIQUE")
+    ]
+    primary_key_name = _constraints(connection, source, "p")[0][0]
+    foreign_keys = _constraints(connection, source, "f")
+
+    if partitioned:
+        connection.execute(statement(connection, "UPDATE {source} SET created = now() WHERE created IS NULL",
+                                     source=source))
+        connection.execute(statement(
+            connection, "CREATE TABLE {table} (LIKE {source} INCLUDING DEFAULTS) PARTITION BY RANGE (created)",
+            table=table, source=source
+        ))
+        connection.execute(statement(connection, "ALTER TABLE {table} ALTER COLUMN created SET NOT NULL",
+                                     table=table))
+        primary_key = (primary_key_name, "PRIMARY KEY (id, created)")
+    else:
+        connection.execute(statement(connection, "CREATE TABLE {table} (LIKE {source} INCLUDING DEFAULTS)",
+                                     table=table, source=source))
+        connection.execute(statement(connection, "ALTER TABLE {table} ALTER COLUMN created DROP NOT NULL",
+                                     table=table))
+        primary_key = (primary_key_name, "PRIMARY KEY (id)")
+
+    sequence = connection.execute(text(
+        "SELECT sequence.relname FROM pg_class sequence "
+        "WHERE sequence.oid = pg_get_serial_sequence(:table, 'id')::regclass"
+    ), table=source).scalar()
+    if sequence:
+        connection.execute(statement(connection, "ALTER SEQUENCE {sequence} OWNED BY {table}.id",
+                                     sequence=sequence, table=table))
+    return source, indexes, [primary_key] + foreign_keys
+
+
+def _finish_rebuild(connection, table, source, indexes, constraints):
+    """
+    Copy rows of replaced table, drop it and restore its definitions, they are
+    created after copying, names are free then
+    """
+    connection.execute(statement(connection, "INSERT INTO {table} SELECT * FROM {source}",
+                                 table=table, source=source))
+    connection.execute(statement(connection, "DROP TABLE {source}", source=source))
+    for name, definition in constraints:
+        connection.execute(statement(
+            connection, "ALTER TABLE {table} ADD CONSTRAINT {name} " + definition, table=table, name=name
+        ))
+    quoted_table = connection.dialect.identifier_preparer.quote(table)
+    for indexdef in indexes:
+        connection.execute(text(re.sub(r" ON (ONLY )?(\S+\.)?%s " % source, " ON %s " % quoted_table, indexdef)))
+
+
+def create_delete_sub_steps_trigger(connection):
+    if connection.execute(text(
+        "SELECT 1 FROM pg_trigger WHERE tgname = :trigger"
+    ), trigger=DELETE_SUB_STEPS_TRIGGER).scalar():
+        return
+    connection.execute(statement(
+        connection,
+        "CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$ "
+        "BEGIN DELETE FROM sub_steps WHERE session_log_step_id = OLD.id; RETURN NULL; END; "
+        "$$ LANGUAGE plpgsql",
+        function=DELETE_SUB_STEPS_FUNCTION
+    ))
+    connection.execute(statement(
+        connection,
+        "CREATE TRIGGER {trigger} AFTER DELETE ON session_log_steps FOR EACH ROW EXECUTE PROCEDURE {function}()",
+        trigger=DELETE_SUB_STEPS_TRIGGER, function=DELETE_SUB_STEPS_FUNCTION
+    ))
+
+
+def partition_steps_tables(connection, months_ahead):
+    """
+    Replace steps tables with tables partitioned by month of created. Partitions
+    are created from the oldest stored month to months_ahead next months, rows
+    out of them get to default partition. Foreign key of sub steps to steps is
+    dropped: it can't reference partitioned table by id only, sub steps are
+    deleted with steps by trigger instead.
+    All rows are copied, so it's a job for maintenance window on big tables.
+    """
+    last_month = add_months(month_start(datetime.now()), months_ahead)
+    for table in STEPS_TABLES:
+        if is_partitioned(connection, table):
+            log.info("%s is partitioned already" % table)
+            continue
+
+        source, indexes, constraints = _rebuild_table(connection, table, partitioned=True)
+        first_month = connection.execute(statement(
+            connection, "SELECT min(created) FROM {source}", source=source
+        )).scalar() or last_month
+        create_month_partitions(connection, table, first_month, last_month)
+        connection.execute(statement(connection, "CREATE TABLE {default} PARTITION OF {table} DEFAULT",
+                                     default=DEFAULT_PARTITION_NAME % table, table=table))
+        _finish_rebuild(connection, table, source, indexes, constraints)
+        log.info("%s is partitioned by month of created" % table)
+    create_delete_sub_steps_trigger(connection)
+
+
+def unpartition_steps_tables(connection):
+    """
+    Replace partitioned steps tables with plain ones and restore foreign key of sub steps,
+    delete trigger is dropped with replaced steps table
+    """
+    partitioned = [table for table in reversed(STEPS_TABLES) if is_partitioned(connection, table)]
+    for table in partitioned:
+        source, indexes, constraints = _rebuild_table(connection, table)
+        _finish_rebuild(connection, table, source, indexes, constraints)
+        log.info("%s isn't partitioned anymore" % table)
+
+    if "session_log_steps" in partitioned:
+        connection.execute(statement(connection, "DROP FUNCTION IF EXISTS {function}()",
+                                     function=DELETE_SUB_STEPS_FUNCTION))
+
+    if "sub_steps" in partitioned:
+        connection.execute(text(
+            "DELETE FROM sub_steps WHERE session_log_step_id IS NOT NULL AND NOT EXISTS "
+            "(SELECT 1 FROM session_log_steps WHERE session_log_steps.id = sub_steps.session_log_step_id)"
+        ))
+        connection.execute(text(
+            "ALTER TABLE sub_steps ADD CONSTRAINT sub_step_to_parent_fkey FOREIGN KEY (session_log_step_id) "
+            "REFERENCES session_log_steps (id) ON DELETE CASCADE"
+        ))
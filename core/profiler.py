@@ -1,6 +1,6 @@
 # coding: utf-8
 import time
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 
 class Profiler(object):
@@ -29,6 +29,94 @@ class Profiler(object):
             "Number of attempts before success get endpoint",
             namespace=self.METRICS_NAMESPACE
         )
+        self._database_queue_size = Gauge(
+            "database_queue_size",
+            "Amount of tasks waiting in database queue",
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._database_flush_duration_seconds = Gauge(
+            "database_flush_duration_seconds",
+            "Duration of writing batch of tasks from database queue (seconds)",
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._session_cache_requests_total = Counter(
+            "session_cache_requests_total",
+            "Amount of session cache lookups",
+            labelnames=["result"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._session_cache_evictions_total = Counter(
+            "session_cache_evictions_total",
+            "Amount of sessions evicted from session cache",
+            labelnames=["reason"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._session_cache_size = Gauge(
+            "session_cache_size",
+            "Amount of sessions in session cache",
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._screenshots_queue_size = Gauge(
+            "screenshots_queue_size",
+            "Amount of screenshots waiting for processing",
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._screenshots_total = Counter(
+            "screenshots_total",
+            "Amount of processed screenshots",
+            labelnames=["result"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._screenshot_processing_duration_seconds = Gauge(
+            "screenshot_processing_duration_seconds",
+            "Duration of decoding, writing and thumbnailing of screenshot (seconds)",
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._preload_target_endpoints = Gauge(
+            "preload_target_endpoints",
+            "Target amount of preloaded endpoints",
+            labelnames=["platform"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._preloaded_endpoints = Gauge(
+            "preloaded_endpoints",
+            "Amount of preloaded endpoints",
+            labelnames=["platform"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._preload_fill_ratio = Gauge(
+            "preload_fill_ratio",
+            "Preloaded endpoints to target ratio",
+            labelnames=["platform"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._preloads_total = Counter(
+            "preloads_total",
+            "Amount of endpoint preloads",
+            labelnames=["platform", "result"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._preload_duration_seconds = Gauge(
+            "preload_duration_seconds",
+            "Duration of endpoint preload (seconds)",
+            labelnames=["platform"],
+            namespace=self.METRICS_NAMESPACE
+        )
+        self._endpoint_startup_seconds = Histogram(
+            "endpoint_startup_seconds",
+            "Duration of endpoint startup till stage: container is run, endpoint is ready "
+            "after cold start or paused container is unpaused (seconds)",
+            labelnames=["platform", "stage"],
+            namespace=self.METRICS_NAMESPACE,
+            buckets=(0.25, 0.5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, float("inf"))
+        )
+        self._endpoint_rebuild_seconds = Histogram(
+            "endpoint_rebuild_seconds",
+            "Duration of preloaded endpoint rebuild after session by recycle or restart (seconds)",
+            labelnames=["platform", "mode", "result"],
+            namespace=self.METRICS_NAMESPACE,
+            buckets=(0.5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, float("inf"))
+        )
         self._functions_duration_seconds = Gauge(
             "functions_duration_seconds",
             "Function duration (seconds)",
@@ -43,6 +131,12 @@ class Profiler(object):
         """
         return self._requests_duration_seconds.labels(command=command).time()
 
+    def requests_duration_manual(self, command):
+        """
+        Start and return timer with 'end()' function for manually call
+        """
+        return _GaugeTimer(self._requests_duration_seconds, command=command)
+
     def register_get_session_call(self):
         self._get_session_total.inc()
 
@@ -53,6 +147,61 @@ class Profiler(object):
     def register_fail_get_endpoint(self):
         self._get_endpoint_total.labels(status="fail").inc()
 
+    def register_database_queue_size(self, size):
+        self._database_queue_size.set(size)
+
+    def database_flush_duration(self):
+        """
+        Time writing of database queue batch, can be used as a context manager
+        """
+        return self._database_flush_duration_seconds.time()
+
+    def register_session_cache_hit(self):
+        self._session_cache_requests_total.labels(result="hit").inc()
+
+    def register_session_cache_miss(self):
+        self._session_cache_requests_total.labels(result="miss").inc()
+
+    def register_session_cache_eviction(self, reason):
+        self._session_cache_evictions_total.labels(reason=reason).inc()
+
+    def register_session_cache_size(self, size):
+        self._session_cache_size.set(size)
+
+    def register_screenshots_queue_size(self, size):
+        self._screenshots_queue_size.set(size)
+
+    def register_screenshot(self, result):
+        self._screenshots_total.labels(result=result).inc()
+
+    def screenshot_processing_duration(self):
+        """
+        Time processing of screenshot, can be used as a context manager
+        """
+        return self._screenshot_processing_duration_seconds.time()
+
+    def register_preload_fill(self, platform, target, preloaded):
+        self._preload_target_endpoints.labels(platform=platform).set(target)
+        self._preloaded_endpoints.labels(platform=platform).set(preloaded)
+        self._preload_fill_ratio.labels(platform=platform).set(float(preloaded) / target if target else 1)
+
+    def register_preload(self, platform, result):
+        self._preloads_total.labels(platform=platform, result=result).inc()
+
+    def preload_duration(self, platform):
+        """
+        Time endpoint preload, can be used as a context manager
+        """
+        return self._preload_duration_seconds.labels(platform=platform).time()
+
+    def register_endpoint_startup(self, platform, stage, duration):
+        self._endpoint_startup_seconds.labels(platform=platform, stage=stage).observe(duration)
+
+    def register_endpoint_rebuild(self, platform, mode, ready, duration):
+        self._endpoint_rebuild_seconds.labels(
+            platform=platform, mode=mode, result="ready" if ready else "failed"
+        ).observe(duration)
+
     def functions_duration_manual(self, name):
         """
         Start and return timer with 'end()' function for manually call
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+import io
+import os
+import base64
+import logging
+from errno import EEXIST
+from Queue import Queue, Full
+from threading import Thread
+
+from PIL import Image
+
+from core import constants
+from core.config import config
+from core.profiler import profiler
+
+log = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTH = 128
+
+
+def write_screenshot(path, content):
+    basedir = os.path.dirname(path)
+    try:
+        os.makedirs(basedir)
+        os.chmod(basedir, 0777)
+    except OSError as os_error:
+        if os_error.errno != EEXIST:
+            raise
+
+    with open(path, "wb") as f:
+        f.write(content)
+    os.chmod(path, 0777)
+
+
+def _reduce(img, factor):
+    if hasattr(img, "reduce"):
+        return img.reduce(factor)
+    return img.resize((img.size[0] // factor, img.size[1] // factor), Image.NEAREST)
+
+
+def screenshot_resize(screenshot_path, width, height=None, postfix=None, content=None):
+    """
+    Image is reduced by integer factor first and antialiased to the target size
+    after, it's much faster than antialiasing of full size image
+    """
+    try:
+        img = Image.open(io.BytesIO(content) if content else screenshot_path)
+
+        if height:
+            size = width, height
+        else:
+            wpercent = (width / float(img.size[0]))
+            size = width, int((float(img.size[1]) * float(wpercent)))
+
+        if postfix:
+            postfix = "%s.png" % postfix
+        else:
+            postfix = "%sx%s.png" % size
+
+        img.draft(img.mode, size)
+        factor = min(img.size[0] // size[0], img.size[1] // size[1]) // 2
+        if factor > 1:
+            img = _reduce(img, factor)
+
+        new_file_path = screenshot_path.split('.png')[0] + postfix
+        img = img.resize(size, Image.ANTIALIAS)
+        img.save(new_file_path, "PNG")
+    except IOError:
+        log.debug("Can\'t resize image '%s'" % screenshot_path)
+
+
+def make_thumbnail_for_screenshot(screenshot_path, content=None):
+    screenshot_resize(screenshot_path, THUMBNAIL_WIDTH, postfix="_thumb", content=content)
+
+
+def save_screenshot(session_id, log_step, screenshot):
+    content = base64.b64decode(screenshot)
+    path = os.sep.join([config.SCREENSHOTS_DIR, str(session_id), "%s.png" % log_step.id])
+    write_screenshot(path, content)
+    log_step.screenshot = path
+    log_step.save()
+    make_thumbnail_for_screenshot(path, content)
+
+
+class ScreenshotsWorker(Thread):
+    def __init__(self, tasks, context):
+        super(ScreenshotsWorker, self).__init__()
+        self.daemon = True
+        self.tasks = tasks
+        self.context = context
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            profiler.register_screenshots_queue_size(self.tasks.qsize())
+            try:
+                with self.context(), profiler.screenshot_processing_duration():
+                    save_screenshot(*task)
+                profiler.register_screenshot("saved")
+            except:
+                log.exception("Screenshot for session %s wasn't saved" % task[0])
+                profiler.register_screenshot("failed")
+
+
+class ScreenshotsPool(object):
+    """
+    Decodes, writes and thumbnails screenshots on dedicated workers.
+    Queue is bounded: when it's full a new screenshot is dropped at once with
+    'drop' policy or after waiting of SCREENSHOTS_QUEUE_TIMEOUT with 'wait' policy
+    """
+    def __init__(self, context, workers=None, queue_size=None, policy=None, timeout=None):
+        self.context = context
+        self.workers_count = workers or getattr(config, "SCREENSHOTS_WORKERS", constants.SCREENSHOTS_WORKERS)
+        self.policy = policy or getattr(config, "SCREENSHOTS_QUEUE_POLICY", constants.SCREENSHOTS_QUEUE_POLICY)
+        self.timeout = timeout if timeout is not None else getattr(
+            config, "SCREENSHOTS_QUEUE_TIMEOUT", constants.SCREENSHOTS_QUEUE_TIMEOUT
+        )
+        self.tasks = Queue(
+            maxsize=queue_size or getattr(config, "SCREENSHOTS_QUEUE_SIZE", constants.SCREENSHOTS_QUEUE_SIZE)
+        )
+        self.workers = []
+
+    def start(self):
+        for _ in range(self.workers_count):
+            worker = ScreenshotsWorker(self.tasks, self.context)
+            worker.start()
+            self.workers.append(worker)
+        log.info("ScreenshotsPool started with %s workers" % self.workers_count)
+
+    def stop(self):
+        """
+        Waits for queued screenshots and stops workers
+        """
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        log.info("ScreenshotsPool stopped")
+
+    def put(self, session_id, log_step, screenshot):
+        """
+        :return: False if screenshot was dropped
+        """
+        try:
+            if self.policy == "wait":
+                self.tasks.put((session_id, log_step, screenshot), timeout=self.timeout)
+            else:
+                self.tasks.put_nowait((session_id, log_step, screenshot))
+        except Full:
+            log.warning("Screenshots queue is full, screenshot for session %s was dropped" % session_id)
+            profiler.register_screenshot("dropped")
+            return False
+
+        profiler.register_screenshots_queue_size(self.tasks.qsize())
+        return True
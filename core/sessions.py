@@ -1,13 +1,16 @@
 # coding: utf-8
 
 import time
+import heapq
 import logging
 
 from collections import OrderedDict
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 
+from core import constants
 from core.config import config
 from core.exceptions import SessionException
+from core.profiler import profiler
 
 log = logging.getLogger(__name__)
 
@@ -15,6 +18,7 @@ log = logging.getLogger(__name__)
 def update_log_step(log_step, message=None, control_line=None):
     if message:
         log_step.body = message
+        log_step.encode_body()
     if control_line:
         log_step.control_line = control_line
     log_step.save()
@@ -27,6 +31,135 @@ class SimpleResponse:
         self.content = content
 
 
+class SessionTimer(object):
+    __slots__ = ("session", "deadline", "scheduled", "seq")
+
+    def __init__(self, session, deadline):
+        self.session = session
+        self.deadline = deadline
+        self.scheduled = None
+        self.seq = None
+
+
+class SessionTimers(object):
+    """
+    Inactivity deadlines of sessions kept in a heap,
+    every session has at most one live heap entry, so re-arming
+    a timer with a later deadline doesn't touch the heap
+    """
+    def __init__(self):
+        self._heap = []
+        self._timers = {}
+        self._seq = 0
+        self._condition = Condition()
+
+    def __len__(self):
+        return len([t for t in self._timers.values() if t.deadline is not None])
+
+    def _push(self, timer, deadline):
+        self._seq += 1
+        timer.seq = self._seq
+        timer.scheduled = deadline
+        heapq.heappush(self._heap, (deadline, timer.seq, timer.session.id))
+
+    def arm(self, session, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            timer = self._timers.get(session.id)
+            if timer is None:
+                timer = SessionTimer(session, deadline)
+                self._timers[session.id] = timer
+                self._push(timer, deadline)
+            else:
+                timer.session = session
+                timer.deadline = deadline
+                if deadline < timer.scheduled:
+                    self._push(timer, deadline)
+
+            if self._heap[0][1] == timer.seq:
+                self._condition.notify()
+
+    def disarm(self, session):
+        with self._condition:
+            timer = self._timers.get(session.id)
+            if timer:
+                timer.deadline = None
+
+    def pop_expired(self, now=None):
+        """
+        :return: sessions which deadlines passed, their timers are removed
+        """
+        now = now or time.time()
+        expired = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                _, seq, session_id = heapq.heappop(self._heap)
+                timer = self._timers.get(session_id)
+                if not timer or timer.seq != seq:
+                    continue
+                if timer.deadline is None:
+                    del self._timers[session_id]
+                elif timer.deadline > now:
+                    self._push(timer, timer.deadline)
+                else:
+                    del self._timers[session_id]
+                    expired.append(timer.session)
+        return expired
+
+    def wait(self, timeout=None):
+        """
+        Block until the earliest deadline, an earlier timer arming or timeout
+        """
+        with self._condition:
+            if self._heap:
+                delay = self._heap[0][0] - time.time()
+                if delay <= 0:
+                    return
+                timeout = min(delay, timeout) if timeout is not None else delay
+            self._condition.wait(timeout)
+
+    def notify(self):
+        with self._condition:
+            self._condition.notify()
+
+
+class ActiveSessionsCounters(object):
+    """
+    Ids of active sessions by provider kept in memory,
+    periodically replaced with active sessions from database
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = Lock()
+
+    def add(self, provider_id, session_id):
+        with self._lock:
+            self._sessions.setdefault(provider_id, set()).add(session_id)
+
+    def remove(self, provider_id, session_id):
+        with self._lock:
+            self._sessions.get(provider_id, set()).discard(session_id)
+
+    def count(self, provider_id):
+        return len(self._sessions.get(provider_id, ()))
+
+    def to_json(self):
+        with self._lock:
+            return {provider_id: len(ids) for provider_id, ids in self._sessions.items()}
+
+    def reconcile(self, get_active_sessions_ids):
+        """
+        :param get_active_sessions_ids: function returning (session id, provider id) pairs,
+               it's called under lock, so sessions added or removed meanwhile aren't lost
+        """
+        with self._lock:
+            sessions = {}
+            for session_id, provider_id in get_active_sessions_ids():
+                if provider_id:
+                    sessions.setdefault(provider_id, set()).add(session_id)
+            self._sessions = sessions
+
+
 class SessionWorker(Thread):
     def __init__(self, sessions, context):
         Thread.__init__(self)
@@ -34,49 +167,138 @@ class SessionWorker(Thread):
         self.daemon = True
         self.sessions = sessions
         self.context = context
+        self.reconcile_interval = getattr(
+            config, "ACTIVE_SESSIONS_RECONCILE_INTERVAL", constants.ACTIVE_SESSIONS_RECONCILE_INTERVAL
+        )
+        self._reconciled = 0
+
+    def reconcile_active_sessions(self):
+        if time.time() - self._reconciled < self.reconcile_interval:
+            return
+
+        try:
+            self.sessions.reconcile_active()
+        except Exception:
+            log.exception("Error while reconciling active sessions counters")
+        self._reconciled = time.time()
 
     def run(self):
         log.info("SessionWorker started")
         while self.running:
+            self.reconcile_active_sessions()
+            self.sessions.timers.wait(timeout=1)
+            expired = self.sessions.timers.pop_expired()
+            if not expired:
+                continue
+
             with self.context():
-                for session in self.sessions.running(cached=True):
-                    if not session.is_active and session.inactivity > config.SESSION_TIMEOUT:
-                        session.timeout()
-                time.sleep(1)
+                for session in expired:
+                    try:
+                        self.check_timeout(session)
+                    except Exception:
+                        log.exception("Error while checking timeout of session {}".format(session.id))
+
+    def check_timeout(self, session):
+        if session.is_active or session.closed:
+            return
+
+        remaining = config.SESSION_TIMEOUT - session.inactivity
+        if remaining > 0:
+            self.sessions.timers.arm(session, remaining)
+        else:
+            session.timeout()
 
     def stop(self):
         self.running = False
+        self.sessions.timers.notify()
         self.join(1)
         log.info("SessionWorker stopped")
 
 
-class SessionCache:
-    def __init__(self, max_size=100):
-        self._max_size = max_size
+class SessionCache(object):
+    """
+    Thread-safe LRU cache of sessions,
+    entries not accessed for ttl seconds are treated as missing
+    """
+    def __init__(self, max_size=None, ttl=None):
+        self._max_size = max_size or getattr(config, "SESSION_CACHE_SIZE", constants.SESSION_CACHE_SIZE)
+        self._ttl = ttl or getattr(config, "SESSION_CACHE_TTL", constants.SESSION_CACHE_TTL)
         self._cache = OrderedDict()
         self._cache_lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def to_json(self):
-        return self._cache.keys()
+        with self._cache_lock:
+            return self._cache.keys()
+
+    def stats(self):
+        with self._cache_lock:
+            return {
+                "size": len(self._cache),
+                "max_size": self._max_size,
+                "ttl": self._ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def __len__(self):
+        return len(self._cache)
 
     def __getitem__(self, item):
-        return self._cache[item]
+        with self._cache_lock:
+            try:
+                value, accessed = self._cache.pop(item)
+            except KeyError:
+                self._register_miss()
+                raise
+
+            if time.time() - accessed > self._ttl:
+                self._register_eviction("ttl")
+                self._register_miss()
+                raise KeyError(item)
+
+            self._cache[item] = (value, time.time())
+            self._register_hit()
+            return value
 
     def __setitem__(self, key, value):
         with self._cache_lock:
-            self._check_limit()
-            self._cache[key] = value
+            self._cache.pop(key, None)
+            self._cache[key] = (value, time.time())
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+                self._register_eviction("size")
+            profiler.register_session_cache_size(len(self._cache))
+
+    def evict(self, key):
+        with self._cache_lock:
+            if self._cache.pop(key, None) is not None:
+                self._register_eviction("closed")
+
+    def _register_hit(self):
+        self.hits += 1
+        profiler.register_session_cache_hit()
+
+    def _register_miss(self):
+        self.misses += 1
+        profiler.register_session_cache_miss()
 
-    def _check_limit(self):
-        if len(self._cache) >= self._max_size:
-            self._cache.popitem(last=False)
+    def _register_eviction(self, reason):
+        self.evictions += 1
+        profiler.register_session_cache_eviction(reason)
+        profiler.register_session_cache_size(len(self._cache))
 
     def values(self):
-        return self._cache.values()
+        with self._cache_lock:
+            return [value for value, _ in self._cache.values()]
 
     def clear(self):
         with self._cache_lock:
             self._cache.clear()
+            profiler.register_session_cache_size(0)
 
 
 class Sessions(object):
@@ -86,6 +308,8 @@ class Sessions(object):
     def __init__(self, database, context, session_worker_class=SessionWorker, cache_class=SessionCache):
         self.db = database
         self.context = context
+        self.timers = SessionTimers()
+        self.active_counters = ActiveSessionsCounters()
 
         if session_worker_class:
             self._worker = session_worker_class(self, self.context)
@@ -101,6 +325,30 @@ class Sessions(object):
         if self._worker:
             self._worker.stop()
 
+    def start_timer(self, session):
+        self.timers.arm(session, config.SESSION_TIMEOUT)
+
+    def stop_timer(self, session):
+        self.timers.disarm(session)
+
+    def evict(self, session):
+        if self._cache is not None:
+            self._cache.evict(str(session.id))
+
+    def register_active(self, session):
+        if session.provider_id:
+            self.active_counters.add(session.provider_id, session.id)
+
+    def unregister_active(self, session):
+        if session.provider_id:
+            self.active_counters.remove(session.provider_id, session.id)
+
+    def active_count(self, provider_id):
+        return self.active_counters.count(provider_id)
+
+    def reconcile_active(self):
+        self.active_counters.reconcile(self.db.get_active_sessions_ids)
+
     def active(self, provider_id=None):
         return self.db.get_active_sessions(provider_id=provider_id)
 
@@ -124,7 +372,7 @@ class Sessions(object):
         :return: Session
         """
         try:
-            session = self._cache[session_id]
+            session = self._cache[str(session_id)]
         except (KeyError, TypeError):
             log.debug('Cache miss (item={})'.format(session_id))
             session = self.db.get_session(session_id)
@@ -135,7 +383,7 @@ class Sessions(object):
         if session.closed and not maybe_closed:
             raise SessionException("Session {}({}) already closed earlier".format(session_id, session.reason))
 
-        if self._cache:
-            self._cache[session_id] = session
+        if self._cache is not None and not session.closed:
+            self._cache[str(session_id)] = session
 
         return session
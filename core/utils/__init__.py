@@ -1,5 +1,6 @@
 # coding: utf-8
 
+import re
 import json
 import os
 import errno
@@ -201,16 +202,83 @@ def json_to_str(data):
         return ""
 
 
-def remove_base64_screenshot(response_data):
-    content_json = to_json(response_data)
+_screenshot_value_start = re.compile(r'\s*:\s*"')
+
 
-    if content_json.get("screenshot", None):
+def _inspect_parsed(response_data):
+    try:
+        content_json = json.loads(response_data)
+    except ValueError:
+        content_json = None
+    if not isinstance(content_json, dict):
+        return None, response_data
+
+    screenshot = content_json.get("screenshot", None) or None
+    if screenshot:
         content_json["screenshot"] = ""
 
     if isinstance(content_json.get("value", None), dict):
+        screenshot = content_json["value"].get("screen", None) or screenshot
         content_json["value"]["screen"] = ""
 
-    return json.dumps(content_json)
+    return screenshot, json.dumps(content_json)
+
+
+def _cut_screenshots(response_data):
+    """
+    :return: ({key: base64 string}, response without them) or None if response can't be cut
+    """
+    parts, values, position = [], {}, 0
+    key_start = response_data.find('"screen')
+    while key_start != -1:
+        key_end = response_data.find('"', key_start + 1)
+        key = response_data[key_start + 1:key_end]
+        value_start = _screenshot_value_start.match(response_data, key_end + 1) if key_end != -1 else None
+        if key in ("screen", "screenshot") and value_start:
+            if key in values:
+                return None
+            value_end = response_data.find('"', value_start.end())
+            if value_end == -1 or response_data.find('\\', value_start.end(), value_end) != -1:
+                return None
+            values[key] = response_data[value_start.end():value_end]
+            parts.append(response_data[position:value_start.end()])
+            position = value_end
+        key_start = response_data.find('"screen', max(key_end, position, key_start + 1))
+    parts.append(response_data[position:])
+    return values, "".join(parts)
+
+
+def _inspect(response_data):
+    if '"screen' not in response_data:
+        return None, response_data
+
+    # base64 strings are cut out without parsing them as json,
+    # json of the remaining small body is parsed to check where they were
+    cut = _cut_screenshots(response_data)
+    if cut is None:
+        return _inspect_parsed(response_data)
+    values, redacted = cut
+
+    content_json = to_json(redacted)
+    value = content_json.get("value", None) if isinstance(content_json, dict) else None
+    found = int("screenshot" in values and content_json.get("screenshot", None) == "") + \
+        int("screen" in values and isinstance(value, dict) and value.get("screen", None) == "")
+    if found != len(values):
+        return _inspect_parsed(response_data)
+
+    return values.get("screen", None) or values.get("screenshot", None) or None, redacted
+
+
+def inspect_response(response_data):
+    """
+    Find screenshot and remove it from webdriver or agent response in one pass
+    :return: (base64 screenshot or None, response without base64 screenshots)
+    """
+    return _inspect(response_data)
+
+
+def remove_base64_screenshot(response_data):
+    return inspect_response(response_data)[1]
 
 
 def exception_handler(return_on_exc=None):
@@ -261,6 +329,27 @@ def get_desired_capabilities(json_string):
     return body.get('desiredCapabilities', {})
 
 
+def get_request_json(request):
+    """
+    Parse request body once, parsed body is kept in request
+    until request.data is replaced
+    :raises ValueError: if body is not a valid json
+    """
+    data = request.data
+    parsed = request.__dict__.get("_parsed_json")
+    if parsed and parsed[0] is data:
+        return parsed[1]
+
+    body = json.loads(data)
+    request.__dict__["_parsed_json"] = (data, body)
+    return body
+
+
+def set_request_json(request, body):
+    request.data = json.dumps(body)
+    request.__dict__["_parsed_json"] = (request.data, body)
+
+
 def get_environment_variables_from_dc(dc):
     if not isinstance(dc, dict):
         dc = to_json(dc)
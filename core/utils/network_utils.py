@@ -1,9 +1,14 @@
 import time
+import json
+import errno
+import select
 import logging
 import netifaces
 import requests
-from Queue import Queue
-from threading import Thread
+import websocket
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
 from core import constants, config
 from core.exceptions import RequestException, RequestTimeoutException
 from . import system_utils
@@ -100,16 +105,195 @@ def get_free_port():
     return port
 
 
-def ping(ip, port):
+def _connect_nonblocking(host, port):
+    """
+    :return: (socket, True if connected already) or (None, False) on error
+    """
+    s = None
     try:
-        s = get_socket(ip, int(port))
-    except Exception:
-        return False
-    if s:
-        s.close()
-        return True
+        family, socktype, proto, _, sockaddr = socket.getaddrinfo(
+            host, int(port), socket.AF_UNSPEC, socket.SOCK_STREAM
+        )[0]
+        s = socket.socket(family, socktype, proto)
+        s.setblocking(0)
+        error = s.connect_ex(sockaddr)
+    except (socket.error, ValueError, TypeError):
+        if s:
+            s.close()
+        return None, False
 
-    return False
+    if error in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+        return s, False
+    s.close()
+    return (None, True) if error == 0 else (None, False)
+
+
+def _wait_writable(sockets, timeout):
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        by_fd = {}
+        for s in sockets:
+            by_fd[s.fileno()] = s
+            poller.register(s, select.POLLOUT)
+        return [by_fd[fd] for fd, _ in poller.poll(timeout * 1000)]
+    return select.select([], sockets, [], timeout)[1]
+
+
+def probe(addresses, timeout=0.1):
+    """
+    Connect to all (host, port) addresses at once with non-blocking sockets
+    :return: dict of address and True if it accepts connections in timeout
+    """
+    results, pending = {}, {}
+    for address in addresses:
+        s, results[address] = _connect_nonblocking(*address)
+        if s:
+            pending[s] = address
+
+    deadline = time.time() + timeout
+    try:
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            for s in _wait_writable(list(pending), remaining):
+                address = pending.pop(s)
+                results[address] = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                s.close()
+    finally:
+        for s in pending:
+            s.close()
+    return results
+
+
+def ping_ports(ip, ports, timeout=0.1):
+    """
+    :return: dict of port and True if it accepts connections
+    """
+    results = probe([(ip, port) for port in ports], timeout)
+    return {port: results[(ip, port)] for port in ports}
+
+
+def ping(ip, port):
+    return ping_ports(ip, [port])[port]
+
+
+class PingResults(object):
+    """
+    Successful pings of endpoints ports, they are trusted for PING_CACHE_TTL seconds
+    """
+    def __init__(self):
+        self._results = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(ip, ports):
+        return str(ip), tuple(sorted(str(port) for port in ports))
+
+    def add(self, ip, ports):
+        with self._lock:
+            self._results[self._key(ip, ports)] = time.time()
+
+    def is_recent(self, ip, ports):
+        ttl = getattr(config.config, "PING_CACHE_TTL", constants.PING_CACHE_TTL)
+        with self._lock:
+            pinged = self._results.get(self._key(ip, ports))
+        return pinged is not None and time.time() - pinged < ttl
+
+    def forget(self, ip):
+        with self._lock:
+            for key in [key for key in self._results if key[0] == str(ip)]:
+                del self._results[key]
+
+
+ping_results = PingResults()
+
+
+class EndpointConnectionPools(object):
+    """
+    Keep-alive HTTP sessions to endpoints keyed by (ip, port)
+    and a shared thread pool for making requests through them
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = Lock()
+        self._workers = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @property
+    def workers(self):
+        with self._lock:
+            if not self._workers:
+                # config is core.config module here, settings are read from its config object
+                self._workers = ThreadPool(
+                    getattr(config.config, "REQUEST_THREAD_POOL_MAX", constants.REQUEST_THREAD_POOL_MAX)
+                )
+            return self._workers
+
+    def get(self, ip, port):
+        key = (str(ip), str(port))
+        with self._lock:
+            session = self._sessions.get(key)
+            if not session:
+                session = requests.Session()
+                session.mount("http://", HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=getattr(config.config, "ENDPOINT_CONNECTIONS_MAX", constants.ENDPOINT_CONNECTIONS_MAX)
+                ))
+                self._sessions[key] = session
+            return session
+
+    def close(self, ip, ports=None):
+        """
+        Close keep-alive connections to endpoint
+        :param ip: str
+        :param ports: list of ports or None for all ports of ip
+        """
+        if ports is not None:
+            ports = [str(port) for port in ports]
+
+        with self._lock:
+            keys = [key for key in self._sessions.keys() if key[0] == str(ip) and (ports is None or key[1] in ports)]
+            sessions = [self._sessions.pop(key) for key in keys]
+
+        for session in sessions:
+            session.close()
+        if sessions:
+            log.debug("Closed connections to {}:{}".format(ip, [key[1] for key in keys]))
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions.values(), {}
+            workers, self._workers = self._workers, None
+
+        for session in sessions:
+            session.close()
+        if workers:
+            workers.terminate()
+
+
+connection_pools = EndpointConnectionPools()
+
+
+def get_request_attempts():
+    return getattr(config.config, "MAKE_REQUEST_ATTEMPTS_AMOUNT", constants.MAKE_REQUEST_ATTEMPTS_AMOUNT)
+
+
+def request_attempt_failed(url, timeout, error, attempt, attempts):
+    """
+    Shared by threaded and reactor proxies: raises on the last attempt,
+    otherwise returns seconds to wait before the next one
+    """
+    if attempt >= attempts:
+        if isinstance(error, (requests.Timeout, RequestTimeoutException)):
+            raise RequestTimeoutException("No response for '%s' in %s sec. Original: %s" % (url, timeout, error))
+        raise RequestException("Error for '%s'. Original: %s" % (url, error))
+
+    sleep_time = constants.REQUEST_SLEEP_BASE_TIME * attempt
+    log.info("Waiting {} seconds before next attempt to request {}".format(sleep_time, url))
+    return sleep_time
 
 
 def make_request(
@@ -123,43 +307,70 @@ def make_request(
     if request.headers.get("Host"):
         del request.headers['Host']
 
+    http_session = connection_pools.get(endpoint_ip, port)
+
     def get_response():
         try:
-            queue.put(
-                requests.request(
-                    method=request.method,
-                    url=url,
-                    headers=request.headers,
-                    data=request.data,
-                    timeout=timeout
-                )
+            return http_session.request(
+                method=request.method,
+                url=url,
+                headers=request.headers,
+                data=request.data,
+                timeout=timeout
             )
         except Exception as e:
-            queue.put(e)
+            return e
 
-    attempts = getattr(config, "MAKE_REQUEST_ATTEMPTS_AMOUNT", constants.MAKE_REQUEST_ATTEMPTS_AMOUNT)
+    attempts = get_request_attempts()
+    watch_interval = getattr(config.config, "REQUEST_WATCH_INTERVAL", constants.REQUEST_WATCH_INTERVAL)
     for attempt in range(1, attempts + 1):
-        queue = Queue()
         log.info("Attempt {}. Making request {} with timeout {} sec.".format(attempt, url, timeout))
-        t = Thread(target=get_response)
-        t.daemon = True
-        t.start()
+        result = connection_pools.workers.apply_async(get_response)
 
-        while t.isAlive():
+        # response is waited for without polling, caller gets control once per
+        # watch interval only to check client connection and session
+        result.wait(watch_interval)
+        while not result.ready():
             yield None, None, None
+            result.wait(watch_interval)
 
-        response = queue.get()
-        if attempt >= attempts:
-            if isinstance(response, requests.Timeout):
-                raise RequestTimeoutException(
-                    "No response for '%s' in %s sec. Original: %s" % (url, timeout, response)
-                )
-            elif isinstance(response, Exception):
-                raise RequestException("Error for '%s'. Original: %s" % (url, response))
-        elif isinstance(response, requests.Response):
+        response = result.get()
+        if isinstance(response, requests.Response):
             yield response.status_code, response.headers, response.content
             break
-        else:
-            sleep_time = constants.REQUEST_SLEEP_BASE_TIME * attempt
-            log.info("Waiting {} seconds before next attempt to request {}".format(sleep_time, url))
-            time.sleep(sleep_time)
+
+        sleep_time = request_attempt_failed(url, timeout, response, attempt, attempts)
+        # caller checks client connection and session before next attempt
+        yield None, None, None
+        time.sleep(sleep_time)
+
+
+def run_agent_script(ip, port, script, timeout):
+    """
+    Run shell script by vmmaster-agent and wait till agent closes websocket
+    :return: output of script
+    """
+    deadline = time.time() + timeout
+    url = "ws://%s:%s/runScript" % (ip, port)
+    try:
+        ws = websocket.create_connection(url, timeout=timeout)
+    except Exception as e:
+        raise RequestException("Error for '%s'. Original: %s" % (url, e))
+
+    output = ""
+    try:
+        ws.send(json.dumps({"command": "sudo -S sh", "script": script}))
+        while True:
+            ws.settimeout(max(deadline - time.time(), 0.01))
+            try:
+                opcode, data = ws.recv_data()
+            except websocket.WebSocketConnectionClosedException:
+                break
+            except websocket.WebSocketTimeoutException:
+                raise RequestTimeoutException("No end of script for '%s' in %s sec." % (url, timeout))
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                break
+            output += data
+    finally:
+        ws.close()
+    return output
@@ -48,6 +48,47 @@ def cleanup():
     cleanup.run()
 
 
+@manager.command
+def reap_screenshots(budget=None):
+    """
+    Delete least recently modified screenshots until SCREENSHOTS_DIR is under budget (bytes),
+    budget defaults to SCREENSHOTS_DIR_BUDGET, nothing is deleted if it's 0
+    """
+    from vmmaster import cleanup
+    change_user_vmmaster()
+    cleanup.reap_screenshots(int(budget) if budget is not None else None)
+
+
+@manager.command
+def backfill_steps_bodies():
+    """
+    Compress or spill to files bodies of stored steps by STEP_BODY_* settings
+    """
+    from vmmaster import backfill
+    change_user_vmmaster()
+    backfill.backfill_steps_bodies()
+
+
+@manager.command
+def partition_steps():
+    """
+    Partition steps tables by month on PostgreSQL 11+, all rows are copied in one transaction
+    """
+    from vmmaster import cleanup
+    change_user_vmmaster()
+    cleanup.partition_steps()
+
+
+@manager.command
+def unpartition_steps():
+    """
+    Replace partitioned steps tables with plain ones
+    """
+    from vmmaster import cleanup
+    change_user_vmmaster()
+    cleanup.unpartition_steps()
+
+
 @manager.command
 def init():
     """
@@ -0,0 +1,22 @@
+from alembic import op
+
+
+"""index session log steps by session and id for last step lookup
+
+Revision ID: 4b0e4ac5d0f3
+Revises: 1f77126c0528
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b0e4ac5d0f3'
+down_revision = '1f77126c0528'
+
+
+def upgrade():
+    op.create_index('ix_session_log_steps_session_id_id', 'session_log_steps', ['session_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_session_log_steps_session_id_id', 'session_log_steps')
@@ -0,0 +1,22 @@
+from alembic import op
+
+
+"""index sessions by closed flag and id for paginated listing
+
+Revision ID: 6d1c7e2f9a41
+Revises: 4b0e4ac5d0f3
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6d1c7e2f9a41'
+down_revision = '4b0e4ac5d0f3'
+
+
+def upgrade():
+    op.create_index('ix_sessions_closed_id', 'sessions', ['closed', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_sessions_closed_id', 'sessions')
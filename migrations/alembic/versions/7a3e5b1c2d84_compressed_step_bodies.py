@@ -0,0 +1,27 @@
+from alembic import op
+import sqlalchemy as sa
+
+
+"""compressed and file stored bodies of session steps and sub steps
+
+Revision ID: 7a3e5b1c2d84
+Revises: 6d1c7e2f9a41
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a3e5b1c2d84'
+down_revision = '6d1c7e2f9a41'
+
+
+def upgrade():
+    for table in ('session_log_steps', 'sub_steps'):
+        op.add_column(table, sa.Column('body_zlib', sa.LargeBinary(), nullable=True))
+        op.add_column(table, sa.Column('body_file', sa.String(), nullable=True))
+
+
+def downgrade():
+    for table in ('session_log_steps', 'sub_steps'):
+        op.drop_column(table, 'body_file')
+        op.drop_column(table, 'body_zlib')
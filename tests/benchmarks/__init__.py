@@ -0,0 +1,46 @@
+# coding: utf-8
+
+"""
+Benchmarks are scripts run by hand from repository root, e.g.:
+python -m tests.benchmarks.make_request
+"""
+
+import os
+import threading
+
+from core.config import setup_config
+
+setup_config(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "unit", "data", "config_openstack.py")))
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))] if values else 0
+
+
+def report(name, latencies, elapsed):
+    print("{:<48} {:>8} ops {:>9.1f} ops/s p50 {:>8.2f} ms p99 {:>8.2f} ms".format(
+        name, len(latencies), len(latencies) / elapsed if elapsed else 0,
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000
+    ))
+
+
+def run_concurrently(threads_count, target):
+    """
+    Run target in threads_count threads started at once
+    :return: list of target results
+    """
+    results = [None] * threads_count
+    barrier = threading.Event()
+
+    def run(index):
+        barrier.wait()
+        results[index] = target()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    barrier.set()
+    for thread in threads:
+        thread.join()
+    return results
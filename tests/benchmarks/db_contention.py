@@ -0,0 +1,150 @@
+# coding: utf-8
+
+"""
+Contention of threads writing to DB at once: every thread saves its session,
+another copy of session endpoint is switched in and out of use, and steps are inserted.
+Database as it was (global lock, whole object merge) is compared with column-targeted writes.
+Updates of endpoints which were overwritten by stale endpoint state cascaded from session are counted as lost.
+
+python -m tests.benchmarks.db_contention [database url, DATABASE of config by default]
+"""
+
+import sys
+import time
+from datetime import datetime
+from threading import Lock
+
+from flask import Flask
+from mock import Mock
+from sqlalchemy import JSON
+from sqlalchemy.ext.compiler import compiles
+
+from tests.benchmarks import report, run_concurrently
+from core.config import config
+from core.db import Database, transaction
+from core.db.models import Base, Session, SessionLogStep, Endpoint, Provider, User, UserGroup
+
+# threads are paired: one saves session, another one switches its endpoint
+THREADS = (2, 10, 50)
+ITERATIONS = 50
+
+
+@compiles(JSON, "sqlite")
+def compile_sqlite_json(element, compiler, **kw):
+    """
+    Local runs against sqlite, JSON columns are stored as text
+    """
+    return "TEXT"
+
+
+class GlobalLockDatabase(Database):
+    """
+    Writes are serialized by one lock, update merges whole object with cascaded related objects
+    """
+    lock = Lock()
+
+    def add(self, obj):
+        with self.lock:
+            return super(GlobalLockDatabase, self).add(obj)
+
+    @transaction
+    def update(self, obj, dbsession):
+        with self.lock:
+            dbsession.merge(obj)
+            dbsession.commit()
+            dbsession.expunge_all()
+
+
+class FakeOrigin(object):
+    short_name = "fake_short_name"
+
+
+def create_app(database):
+    app = Flask(__name__)
+    app.database = database
+    app.sessions = Mock()
+    app.database_task_queue = Mock()
+    return app
+
+
+def create_pair(app, provider):
+    """
+    :return: session with endpoint and another copy of the endpoint, as pool sees it
+    """
+    with app.app_context():
+        endpoint = Endpoint(FakeOrigin(), "ondemand", provider)
+        session = Session("some_platform")
+        session.set_endpoint(endpoint)
+        return session, app.database.get_endpoint(endpoint.id)
+
+
+def measure(latencies, func, *args):
+    start = time.time()
+    func(*args)
+    latencies.append(time.time() - start)
+
+
+def session_workload(app, session):
+    latencies = {"session save": [], "step insert": []}
+    with app.app_context():
+        for _ in range(ITERATIONS):
+            session.modified = datetime.now()
+            measure(latencies["session save"], session.save)
+            measure(latencies["step insert"], app.database.add, SessionLogStep("GET /url", session_id=session.id))
+    return latencies
+
+
+def endpoint_workload(app, endpoint):
+    latencies = {"endpoint set_in_use": []}
+    with app.app_context():
+        # endpoint is left in use by the last iteration
+        for i in range(ITERATIONS):
+            measure(latencies["endpoint set_in_use"], endpoint.set_in_use, i % 2 == (ITERATIONS - 1) % 2)
+    return latencies
+
+
+def run(name, database):
+    app = create_app(database)
+    database.engine.execute(UserGroup.__table__.insert().values(id=1, name="nogroup"))
+    database.engine.execute(User.__table__.insert().values(id=1, username="anonymous", group_id=1, token="anonymous"))
+    provider = Provider("benchmark", "url")
+    database.add(provider)
+
+    for threads in THREADS:
+        pairs = [create_pair(app, provider) for _ in range(threads / 2)]
+        workloads = iter(
+            [(session_workload, session) for session, _ in pairs] +
+            [(endpoint_workload, endpoint) for _, endpoint in pairs]
+        )
+
+        def workload():
+            func, obj = next(workloads)
+            return func(app, obj)
+
+        start = time.time()
+        results = run_concurrently(len(pairs) * 2, workload)
+        elapsed = time.time() - start
+        for operation in ("session save", "endpoint set_in_use", "step insert"):
+            report("{}, {} threads, {}".format(name, len(pairs) * 2, operation),
+                   sum([latencies.get(operation, []) for latencies in results], []), elapsed)
+        lost = [endpoint for _, endpoint in pairs if not database.get_endpoint(endpoint.id).in_use]
+        print("{:<48} {:>8} lost endpoint updates".format("", len(lost)))
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else config.DATABASE
+    for name, database_class in [("global lock", GlobalLockDatabase), ("column-targeted", Database)]:
+        database = database_class(url, sqlite=url.startswith("sqlite"))
+        if url.startswith("sqlite"):
+            # sqlite dialect of this SQLAlchemy version has no JSON support, json module is used
+            database.engine.dialect._json_serializer = database.engine.dialect._json_deserializer = None
+        Base.metadata.drop_all(database.engine)
+        Base.metadata.create_all(database.engine)
+        try:
+            run(name, database)
+        finally:
+            Base.metadata.drop_all(database.engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# coding: utf-8
+
+"""
+Latency of webdriver commands proxied to endpoint by network_utils.make_request
+with keep-alive connection pools against thread and connection per request
+"""
+
+import time
+import BaseHTTPServer
+import SocketServer
+from threading import Thread
+from multiprocessing import Process, Value
+
+import requests
+
+from tests.benchmarks import report, run_concurrently
+from core.utils import network_utils
+
+SESSIONS = (1, 10)
+COMMANDS = 200
+BODY = '{"status": 0, "value": null}'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Endpoint which keeps connections alive and counts them
+    """
+    protocol_version = "HTTP/1.1"
+    # response is sent at once, like servers of endpoints do, not line by line
+    wbufsize = -1
+    connections = None
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with Handler.connections.get_lock():
+            Handler.connections.value += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", len(BODY))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def thread_per_request(ip, port, request):
+    """
+    make_request as it was: new thread and connection per request, polled every 10 ms
+    """
+    response = {}
+
+    def get_response():
+        response["response"] = requests.request(
+            method=request.method, url="http://%s:%s%s" % (ip, port, request.url), headers=request.headers
+        )
+    thread = Thread(target=get_response)
+    thread.start()
+    while thread.is_alive():
+        time.sleep(0.01)
+    return response["response"].status_code
+
+
+def pooled(ip, port, request):
+    for status, headers, body in network_utils.make_request(ip, port, request):
+        pass
+    return status
+
+
+def session_commands(make_request, port):
+    latencies = []
+    for _ in range(COMMANDS):
+        start = time.time()
+        assert make_request("127.0.0.1", port, network_utils.RequestHelper("GET", "/wd/hub/status")) == 200
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def main():
+    # endpoint is served by another process, so it doesn't share GIL with measured client
+    Handler.connections = Value("i", 0)
+    server = Server(("127.0.0.1", 0), Handler)
+    port = server.server_address[1]
+    endpoint = Process(target=server.serve_forever)
+    endpoint.start()
+    try:
+        for sessions in SESSIONS:
+            for name, make_request in [("thread and connection per request", thread_per_request),
+                                       ("pooled keep-alive connections", pooled)]:
+                Handler.connections.value = 0
+                start = time.time()
+                results = run_concurrently(sessions, lambda: session_commands(make_request, port))
+                report("{}, {} sessions".format(name, sessions), sum(results, []), time.time() - start)
+                print("{:<48} {:>8} connections".format("", Handler.connections.value))
+    finally:
+        endpoint.terminate()
+        network_utils.connection_pools.close_all()
+
+
+if __name__ == "__main__":
+    main()
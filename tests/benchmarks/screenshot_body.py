@@ -0,0 +1,48 @@
+# coding: utf-8
+
+"""
+Inspection of webdriver responses carrying base64 screenshot of SCREENSHOT_MB megabytes:
+parsing whole body as json and dumping it back is compared with cutting screenshot out of body.
+"""
+
+import base64
+import json
+import os
+import time
+
+from tests.benchmarks import report
+from core import utils
+
+SCREENSHOT_MB = 5
+ITERATIONS = 50
+
+
+def bodies():
+    screenshot = base64.b64encode(os.urandom(SCREENSHOT_MB * 1024 * 1024 * 3 / 4))
+    return [
+        ("webdriver response", json.dumps({"status": 13, "value": {"message": "error", "screen": screenshot}})),
+        ("agent response", json.dumps({"status": 0, "output": "done", "screenshot": screenshot})),
+    ]
+
+
+def measure(func, body):
+    latencies = []
+    start = time.time()
+    for _ in range(ITERATIONS):
+        started = time.time()
+        func(body)
+        latencies.append(time.time() - started)
+    return latencies, time.time() - start
+
+
+def main():
+    for name, body in bodies():
+        (parsed_screenshot, parsed), (cut_screenshot, cut) = utils._inspect_parsed(body), utils.inspect_response(body)
+        assert parsed_screenshot == cut_screenshot and json.loads(parsed) == json.loads(cut)
+        for method, func in [("json", utils._inspect_parsed), ("cut", utils.inspect_response)]:
+            latencies, elapsed = measure(func, body)
+            report("{} of {} MB, {}".format(name, SCREENSHOT_MB, method), latencies, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# coding: utf-8
+
+"""
+Load test of one vmmaster proxying webdriver commands of concurrent sessions
+to endpoints which spend COMMAND_SECONDS on every command.
+Threaded proxy is limited by FLASK_THREAD_POOL_MAX, reactor proxy (WEBDRIVER_ASYNC_PROXY) is not.
+"""
+
+import json
+import time
+import BaseHTTPServer
+import SocketServer
+from multiprocessing import Process
+
+import requests
+from mock import Mock, patch
+
+from tests.benchmarks import report, run_concurrently
+from tests.helpers import vmmaster_server_mock, server_is_up, server_is_down, get_free_port
+from core.config import config
+
+SESSIONS = (10, 50, 200)
+COMMANDS = 20
+COMMAND_SECONDS = 0.1
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Endpoint which answers every webdriver command after COMMAND_SECONDS
+    """
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(COMMAND_SECONDS)
+        body = json.dumps({"sessionId": self.path.split("/")[4], "status": 0, "value": None})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def create_sessions(app, count, endpoint_port):
+    from core.db.models import Session, Provider, Endpoint
+
+    provider = Provider(name="noname", url="nourl")
+    sessions = {}
+    with app.app_context():
+        for _ in range(count):
+            session = Session("some_platform")
+            session.selenium_session = "selenium-%s" % session.id
+            session.take_screenshot = False
+            session.add_session_step = Mock()
+            endpoint = Endpoint(Mock(), "", provider)
+            endpoint.ip = "127.0.0.1"
+            endpoint.ports = {"selenium": str(endpoint_port)}
+            session.endpoint = endpoint
+            sessions[str(session.id)] = session
+    return sessions
+
+
+def session_commands(url):
+    latencies, errors = [], 0
+    http_session = requests.Session()
+    for _ in range(COMMANDS):
+        start = time.time()
+        response = http_session.post(url, data='{"url": "http://example.com"}')
+        if response.status_code == 200:
+            latencies.append(time.time() - start)
+        else:
+            errors += 1
+    return latencies, errors
+
+
+def load(async_proxy, endpoint_port):
+    port = get_free_port()
+    with patch.object(config, "PORT", port), patch.object(config, "WEBDRIVER_ASYNC_PROXY", async_proxy, create=True):
+        vmmaster = vmmaster_server_mock(port)
+    assert server_is_up(("127.0.0.1", port))
+    name = "reactor proxy" if async_proxy else "threaded proxy"
+    try:
+        for sessions_count in SESSIONS:
+            sessions = create_sessions(vmmaster.app, sessions_count, endpoint_port)
+            urls = iter(["http://127.0.0.1:%s/wd/hub/session/%s/url" % (port, session_id) for session_id in sessions])
+            with patch(
+                "core.sessions.Sessions.get_session",
+                Mock(side_effect=lambda session_id, maybe_closed=False: sessions[str(session_id)])
+            ):
+                start = time.time()
+                results = run_concurrently(sessions_count, lambda: session_commands(next(urls)))
+                elapsed = time.time() - start
+            report("{}, {} sessions".format(name, sessions_count), sum([r[0] for r in results], []), elapsed)
+            print("{:<48} {:>8} errors".format("", sum(r[1] for r in results)))
+            with vmmaster.app.app_context():
+                for session in sessions.values():
+                    session._close()
+    finally:
+        vmmaster.app.sessions.kill_all()
+        vmmaster.app.cleanup()
+        vmmaster.stop_services()
+        server_is_down(("127.0.0.1", port))
+
+
+def main():
+    # endpoints are served by another process, so they don't share GIL with measured vmmaster
+    server = Server(("127.0.0.1", 0), Handler)
+    endpoint = Process(target=server.serve_forever)
+    endpoint.start()
+    try:
+        for async_proxy in (False, True):
+            load(async_proxy, server.server_address[1])
+    finally:
+        endpoint.terminate()
+
+
+if __name__ == "__main__":
+    main()
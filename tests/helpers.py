@@ -175,6 +175,8 @@ class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
         body = "ok"
         self.send_reply(200, {"Content-Length": len(body)}, body)
 
+    do_DELETE = do_GET
+
     def log_error(self, format, *args):
         pass
 
@@ -225,10 +227,14 @@ class DatabaseMock(Mock):
     def __init__(self, *args, **kwargs):
         super(DatabaseMock, self).__init__(*args, **kwargs)
         self.add = Mock(side_effect=set_primary_key)
+        self.add_all = Mock(side_effect=lambda objects: map(set_primary_key, objects))
 
     def get_active_sessions(self, provider_id=None):
         return self.active_sessions.values()
 
+    def get_active_sessions_ids(self):
+        return [(session.id, session.provider_id) for session in self.active_sessions.values()]
+
     def get_session(self, session_id):
         return self.active_sessions.get(str(session_id))
 
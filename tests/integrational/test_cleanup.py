@@ -2,6 +2,7 @@
 
 import os
 import unittest
+from collections import deque
 from mock import Mock, patch
 
 from core.utils import system_utils
@@ -15,7 +16,8 @@ class TestCleanup(unittest.TestCase):
 
         from flask import Flask
         cls.app = Flask(__name__)
-        cls.app.sessions = None
+        cls.app.sessions = Mock()
+        cls.app.database_task_queue = deque()
 
         from core import db
         cls.app.database = db.Database(config.DATABASE)
@@ -33,6 +35,11 @@ class TestCleanup(unittest.TestCase):
     def tearDown(self):
         self.ctx.pop()
 
+    def execute_database_tasks(self):
+        while self.app.database_task_queue:
+            task, args = self.app.database_task_queue.popleft()
+            task(*args)
+
     def test_file_deletion(self):
         from core.db.models import Session
         session = Session('some_platform')
@@ -52,8 +59,13 @@ class TestCleanup(unittest.TestCase):
         system_utils.run_command(
             ["touch", os.path.join(session_dir, "file_for_deletion")],
             silent=True)
+        bodies_dir = os.path.join(config.SCREENSHOTS_DIR, "steps", str(session.id))
+        system_utils.run_command(
+            ["mkdir", "-p", bodies_dir],
+            silent=True)
         self.cleanup.delete_session_data([session])
         self.assertEqual(os.path.isdir(session_dir), 0)
+        self.assertFalse(os.path.isdir(bodies_dir))
         system_utils.run_command(
             ["rm", "-rf", config.SCREENSHOTS_DIR], silent=True)
 
@@ -92,6 +104,96 @@ class TestCleanup(unittest.TestCase):
 
         self.cleanup.delete_session_data([session1, session2])
 
+    def test_delete_sessions_with_steps(self):
+        from core.db.models import Session, SessionLogStep, SessionLogSubStep
+        session = Session(platform='some_platform', name='__test_delete_sessions_with_steps')
+        session.save()
+        step = SessionLogStep(control_line='POST /wd/hub/session/1/url', session_id=session.id)
+        self.execute_database_tasks()
+        SessionLogSubStep(control_line='POST /wd/hub/session/1/url', parent_id=step.id)
+        self.execute_database_tasks()
+
+        self.cleanup.delete_sessions([session.id])
+
+        self.assertIsNone(self.app.database.get_session(session.id))
+        self.assertIsNone(self.app.database.get_step_by_id(step.id))
+
+    def test_delete_old_steps(self):
+        """
+        - new step of closed session, then old steps of closed and keep forever sessions,
+        ids of steps don't grow with created
+        expected: old step of closed session deleted with sub step, others kept
+        """
+        from datetime import datetime
+        from core.db.models import Session, SessionLogStep, SessionLogSubStep
+        sessions = []
+        for keep_forever in (False, True):
+            session = Session(platform='some_platform', name='__test_delete_old_steps')
+            session.closed = True
+            session.keep_forever = keep_forever
+            session.save()
+            sessions.append(session)
+        new_step = SessionLogStep('GET /wd/hub/session/1/url', session_id=sessions[0].id)
+        self.execute_database_tasks()
+        old_step = SessionLogStep('GET /wd/hub/session/1/url', session_id=sessions[0].id, created=datetime(2000, 1, 1))
+        kept_step = SessionLogStep('GET /wd/hub/session/1/url', session_id=sessions[1].id, created=datetime(2000, 1, 1))
+        self.execute_database_tasks()
+        sub_step = SessionLogSubStep('GET /wd/hub/session/1/url', parent_id=old_step.id)
+        self.execute_database_tasks()
+
+        report = self.cleanup.delete_old_steps(months=1, batch_size=1)
+
+        self.assertEqual(1, report["deleted_steps"])
+        self.assertIsNone(self.app.database.get_step_by_id(old_step.id))
+        self.assertEqual([], self.app.database.get_sub_steps(old_step.id))
+        self.assertIsNotNone(self.app.database.get_step_by_id(kept_step.id))
+        self.assertIsNotNone(self.app.database.get_step_by_id(new_step.id))
+        self.assertIsNotNone(sub_step.id)
+        self.cleanup.delete_session_data(sessions)
+
+    def test_reap_screenshots(self):
+        """
+        - three closed sessions with 100 bytes of screenshots
+        - the oldest one is keep forever
+        - not session directory with 100 bytes
+        expected: nothing deleted with 0 budget,
+        the second one deleted with 250 bytes budget, not session directory kept
+        """
+        from core.db.models import Session
+        sessions = []
+        for i in range(3):
+            session = Session(platform='some_platform', name='__test_reap_screenshots_%s' % i)
+            session.closed = True
+            session.keep_forever = i == 0
+            session.save()
+            sessions.append(session)
+
+            session_dir = os.path.join(config.SCREENSHOTS_DIR, str(session.id))
+            os.makedirs(session_dir)
+            screenshot = os.path.join(session_dir, "1.png")
+            with open(screenshot, "w") as f:
+                f.write("0" * 100)
+            os.utime(screenshot, (i, i))
+
+        other_dir = os.path.join(config.SCREENSHOTS_DIR, "other")
+        os.makedirs(other_dir)
+        with open(os.path.join(other_dir, "1.png"), "w") as f:
+            f.write("0" * 100)
+
+        self.assertIsNone(self.cleanup.reap_screenshots(budget=0))
+        report = self.cleanup.reap_screenshots(budget=250)
+
+        self.assertEqual(300, report["used_bytes"])
+        self.assertEqual(100, report["reclaimed_bytes"])
+        self.assertEqual(
+            [True, False, True],
+            [os.path.isdir(os.path.join(config.SCREENSHOTS_DIR, str(s.id))) for s in sessions]
+        )
+        self.assertTrue(os.path.isdir(other_dir))
+        system_utils.run_command(
+            ["rm", "-rf", config.SCREENSHOTS_DIR], silent=True)
+        self.cleanup.delete_session_data(sessions)
+
     def test_endpoints_cleanup(self):
         """
         - endpoint1 linked with session
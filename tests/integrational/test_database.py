@@ -20,6 +20,7 @@ class MyModel(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
+    value = Column(Integer)
 
 
 class Parent(Base):
@@ -140,6 +141,45 @@ class TestDatabaseBasicMethods(TestCase):
         self.db.delete(obj)
         self.assertEqual(self.count(obj), 0)
 
+    def test_update_keeps_concurrent_changes(self):
+        """
+        Test updating different fields of two copies of object
+        Expected: both changes are kept
+        """
+        obj = MyModel(name='name', value=1)
+        self.db.add(obj)
+        s = self.db.DBSession()
+        obj_copy = s.query(MyModel).get(obj.id)
+        s.close()
+
+        obj.name = 'name_changed'
+        obj_copy.value = 2
+        self.db.update(obj)
+        self.db.update(obj_copy)
+
+        obj = self.get_objects(obj)[0]
+        self.assertEqual(('name_changed', 2), (obj.name, obj.value))
+
+    def test_update_does_not_write_related_objects(self):
+        """
+        Test updating child with stale parent
+        Expected: parent changes made in another copy are kept
+        """
+        parent = self.create_parent()
+        child = Child('child', parent)
+        self.db.add(child)
+        s = self.db.DBSession()
+        parent_copy = s.query(Parent).get(parent.id)
+        s.close()
+
+        parent_copy.name = 'second'
+        self.db.update(parent_copy)
+        child.name = 'child_changed'
+        self.db.update(child)
+
+        self.assertEqual('second', self.select_all(Parent)[0].name)
+        self.assertEqual('child_changed', self.select_all_children(parent)[0].name)
+
     def test_refresh_obj(self):
         """
         Test refreshing objects
@@ -305,6 +345,34 @@ class TestDatabaseBasicMethods(TestCase):
         self.assertEqual(len(children), 0)
         self.assertIsNone(self.get_session_from_obj(parent))
 
+    def test_parallel_add_without_errors(self):
+        """
+        Test adding objects with one shared parent in parallel threads
+            - Create Parent instance
+            - Create Child instances with this parent in parallel threads
+        Expected:
+            - no errors raised
+            - all child objects exists in db
+            - parent and children objects not attached to any sessions
+        """
+        parent = self.create_parent()
+        errors = []
+
+        def add_child(name):
+            try:
+                child = Child(name, parent)
+                self.db.add(child)
+                self.assertIsNotNone(child.id)
+                self.assertIsNone(self.get_session_from_obj(child))
+            except Exception as e:
+                errors.append(e)
+
+        self.execute_parallel(add_child, ['child_{}'.format(item) for item in range(1, self.size + 1)])
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.select_all_children(parent)), self.size)
+        self.assertIsNone(self.get_session_from_obj(parent))
+
     def test_change_single_object_in_parallel_threads(self):
         """
         Test object state refresh and save in parallel threads
@@ -355,3 +423,44 @@ class TestDatabaseBasicMethods(TestCase):
 
         self.db.delete(obj)
         self.assertEqual(self.count(obj), 0)
+
+
+class TestPlatformsFingerprint(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        setup_config('data/config.py')
+        from core.db.models import Base as ModelsBase
+        cls.models_base = ModelsBase
+        cls.db = Database(config.DATABASE)
+        ModelsBase.metadata.create_all(cls.db.engine)
+
+    def setUp(self):
+        # providers left by other tests are in fingerprint too
+        self.delete_providers()
+
+    def tearDown(self):
+        self.delete_providers()
+
+    def delete_providers(self):
+        s = self.db.DBSession()
+        for table in ('platforms', 'providers'):
+            s.execute(self.models_base.metadata.tables[table].delete())
+        s.commit()
+        s.close()
+
+    def test_fingerprint_changes_with_providers_and_platforms(self):
+        provider = self.db.register_provider('name', 'url', {}, 1)
+        self.db.register_platforms(provider, ['ubuntu-14', 'ubuntu-16'])
+        fingerprints = [self.db.get_platforms_fingerprint()]
+
+        self.db.update_platforms(provider.id, ['ubuntu-14', 'ubuntu-18'])
+        fingerprints.append(self.db.get_platforms_fingerprint())
+        self.db.register_provider('name', 'url', {}, 2)
+        fingerprints.append(self.db.get_platforms_fingerprint())
+        self.db.register_provider('name', 'url', {'linux': {'ubuntu-14': {}}}, 2)
+        fingerprints.append(self.db.get_platforms_fingerprint())
+        self.db.unregister_provider(provider.id)
+        fingerprints.append(self.db.get_platforms_fingerprint())
+
+        self.assertEqual(len(fingerprints), len(set(map(repr, fingerprints))))
+        self.assertEqual(([], []), fingerprints[-1])
@@ -0,0 +1,141 @@
+# coding: utf-8
+
+import unittest
+from collections import deque
+from datetime import datetime
+from mock import Mock, patch
+
+from core.config import setup_config, config
+
+
+class TestStepsPartitions(unittest.TestCase):
+    """
+    Steps tables are partitioned, filled and cleaned on PostgreSQL 11+ and restored after all
+    """
+    @classmethod
+    def setUpClass(cls):
+        setup_config('data/config.py')
+
+        from flask import Flask
+        cls.app = Flask(__name__)
+        cls.app.sessions = Mock()
+        cls.app.database_task_queue = deque()
+
+        from core import db
+        cls.app.database = db.Database(config.DATABASE)
+        with cls.app.database.engine.connect() as connection:
+            dialect = connection.dialect
+        if dialect.name != "postgresql" or dialect.server_version_info < (11,):
+            raise unittest.SkipTest("steps partitioning requires PostgreSQL 11+")
+
+        with patch(
+            'core.utils.init.home_dir', Mock(return_value=config.BASEDIR)
+        ):
+            from vmmaster import cleanup
+            cls.cleanup = cleanup
+        from core.db import partitions
+        cls.partitions = partitions
+
+    def setUp(self):
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.sessions = []
+
+    def tearDown(self):
+        self.cleanup.delete_session_data(self.sessions)
+        self.cleanup.unpartition_steps()
+        self.ctx.pop()
+
+    def execute_database_tasks(self):
+        while self.app.database_task_queue:
+            task, args = self.app.database_task_queue.popleft()
+            task(*args)
+
+    def create_session(self, keep_forever=False):
+        from core.db.models import Session
+        session = Session(platform='some_platform', name='__test_steps_partitions')
+        session.closed = True
+        session.keep_forever = keep_forever
+        session.save()
+        self.sessions.append(session)
+        return session
+
+    def create_step(self, session, created):
+        from core.db.models import SessionLogStep, SessionLogSubStep
+        step = SessionLogStep('GET /wd/hub/session/1/url', session_id=session.id, created=created)
+        self.execute_database_tasks()
+        sub_step = SessionLogSubStep('GET /wd/hub/session/1/url', parent_id=step.id)
+        sub_step.created = created
+        self.execute_database_tasks()
+        return step, sub_step
+
+    def partition_of_step(self, step):
+        return self.app.database.engine.execute(
+            "SELECT tableoid::regclass::text FROM session_log_steps WHERE id = %s", step.id
+        ).scalar()
+
+    def test_partitioned_steps_lifecycle(self):
+        """
+        - steps of closed and keep forever sessions created months ago, step created now
+        - tables partitioned, new steps inserted, partition of a late month created
+        expected: rows copied to month partitions, old partitions dropped
+        with old steps of closed session and their sub steps, others kept,
+        sub steps deleted with steps, tables and foreign key restored by unpartition
+        """
+        current_month = self.partitions.month_start(datetime.now())
+        old_month = self.partitions.add_months(current_month, -3)
+        closed, kept = self.create_session(), self.create_session(keep_forever=True)
+        old_step, old_sub_step = self.create_step(closed, old_month)
+        kept_step, kept_sub_step = self.create_step(kept, old_month)
+
+        self.cleanup.partition_steps()
+
+        self.assertTrue(self.cleanup.steps_partitioned())
+        self.assertEqual(
+            self.partitions.partition_name("session_log_steps", old_month), self.partition_of_step(old_step)
+        )
+        self.assertEqual([old_sub_step.id], [s.id for s in self.app.database.get_sub_steps(old_step.id)])
+
+        new_step, new_sub_step = self.create_step(closed, datetime.now())
+        self.assertEqual(
+            self.partitions.partition_name("session_log_steps", current_month), self.partition_of_step(new_step)
+        )
+        late_month = self.partitions.add_months(current_month, 12)
+        late_step, _ = self.create_step(closed, late_month)
+        self.assertEqual("session_log_steps_default", self.partition_of_step(late_step))
+        with self.app.database.engine.begin() as connection:
+            self.partitions.create_month_partitions(connection, "session_log_steps", late_month, late_month)
+        self.assertEqual(
+            self.partitions.partition_name("session_log_steps", late_month), self.partition_of_step(late_step)
+        )
+
+        report = self.cleanup.delete_old_steps(months=1)
+
+        # two months before cutoff for both tables at least
+        self.assertLessEqual(4, report["dropped_partitions"])
+        with self.app.database.engine.connect() as connection:
+            for table in self.partitions.STEPS_TABLES:
+                self.assertEqual([], [
+                    name for month, name in self.partitions.month_partitions(connection, table)
+                    if month < self.partitions.add_months(current_month, -1)
+                ])
+        self.assertIsNone(self.app.database.get_step_by_id(old_step.id))
+        self.assertEqual([], self.app.database.get_sub_steps(old_step.id))
+        self.assertIsNotNone(self.app.database.get_step_by_id(kept_step.id))
+        self.assertEqual([kept_sub_step.id], [s.id for s in self.app.database.get_sub_steps(kept_step.id)])
+        self.assertIsNotNone(self.app.database.get_step_by_id(new_step.id))
+
+        self.app.database.engine.execute("DELETE FROM session_log_steps WHERE id = %s", new_step.id)
+        self.assertEqual([], self.app.database.get_sub_steps(new_step.id))
+
+        self.cleanup.unpartition_steps()
+
+        self.assertFalse(self.cleanup.steps_partitioned())
+        self.assertIsNotNone(self.app.database.get_step_by_id(kept_step.id))
+        self.assertEqual(1, self.app.database.engine.execute(
+            "SELECT count(*) FROM pg_constraint WHERE conname = 'sub_step_to_parent_fkey'"
+        ).scalar())
+        self.assertEqual(["YES", "YES"], [nullable for nullable, in self.app.database.engine.execute(
+            "SELECT is_nullable FROM information_schema.columns "
+            "WHERE table_name IN ('session_log_steps', 'sub_steps') AND column_name = 'created'"
+        )])
@@ -203,7 +203,7 @@ class TestVmmasterApi(BaseTestCase):
         session = Session(self.platform, "session1", self.desired_caps["desiredCapabilities"])
         session.created = session.modified = datetime.now()
 
-        with patch('flask.current_app.sessions.active',
+        with patch('flask.current_app.database.get_sessions_page',
                    Mock(return_value=[session])):
             response = self.vmmaster_client.get('/api/sessions')
         body = json.loads(response.data)
@@ -211,11 +211,141 @@ class TestVmmasterApi(BaseTestCase):
 
         sessions = body['result']['sessions']
         self.assertEqual(1, len(sessions))
+        self.assertIsNone(body['result']['next_cursor'])
         self.assertEqual(self.platform, session.platform)
         self.assertEqual(200, body['metacode'])
 
         session.failed()
 
+    def test_api_sessions_pagination(self):
+        sessions = [Mock(id=i, info={"id": i}) for i in range(1, 4)]
+        get_sessions_page = Mock(return_value=sessions)
+
+        with patch('flask.current_app.database.get_sessions_page', get_sessions_page):
+            response = self.vmmaster_client.get(
+                '/api/sessions?limit=2&cursor=10&status=running&provider_id=1&user_id=2&created_from=0'
+            )
+        body = json.loads(response.data)
+
+        self.assertEqual([{"id": 1}, {"id": 2}], body['result']['sessions'])
+        self.assertEqual(2, body['result']['next_cursor'])
+        get_sessions_page.assert_called_once_with(
+            after_id=10, limit=3, statuses=['running'], provider_id=1, user_id=2,
+            created_from=datetime.fromtimestamp(0), created_to=None
+        )
+
+    def test_api_sessions_without_pagination(self):
+        sessions = [Mock(id=i, info={"id": i}) for i in range(1, 4)]
+        get_sessions_page = Mock(return_value=sessions)
+
+        with patch('flask.current_app.database.get_sessions_page', get_sessions_page):
+            response = self.vmmaster_client.get('/api/sessions?status=running')
+        body = json.loads(response.data)
+
+        self.assertEqual([{"id": 1}, {"id": 2}, {"id": 3}], body['result']['sessions'])
+        self.assertIsNone(body['result']['next_cursor'])
+        self.assertIsNone(get_sessions_page.call_args[1]['limit'])
+
+    def test_api_queue_returns_only_waiting_sessions(self):
+        get_sessions_page = Mock(return_value=[])
+
+        with patch('flask.current_app.database.get_sessions_page', get_sessions_page):
+            response = self.vmmaster_client.get('/api/queue?limit=100000')
+        body = json.loads(response.data)
+
+        self.assertEqual([], body['result']['queue'])
+        self.assertEqual(['waiting'], get_sessions_page.call_args[1]['statuses'])
+        self.assertEqual(constants.API_PAGE_SIZE_MAX + 1, get_sessions_page.call_args[1]['limit'])
+
+    @dataprovider([
+        '/api/sessions?cursor=abc',
+        '/api/sessions?limit=0',
+        '/api/queue?created_to=yesterday',
+    ])
+    def test_api_sessions_bad_parameters(self, url):
+        response = self.vmmaster_client.get(url)
+        body = json.loads(response.data)
+        self.assertEqual(400, body['metacode'])
+
+    def test_api_sessions_not_modified(self):
+        from core.db.models import Session
+        session = Session(self.platform, "session1", self.desired_caps["desiredCapabilities"])
+        session.created = session.modified = datetime.now()
+
+        with patch('flask.current_app.database.get_sessions_page', Mock(return_value=[session])):
+            response = self.vmmaster_client.get('/api/sessions')
+            etag = response.headers['ETag']
+            self.assertTrue(etag.startswith('W/'))
+
+            # duration and inactivity of running session have changed since the first response
+            response = self.vmmaster_client.get('/api/sessions', headers={'If-None-Match': etag})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual('', response.data)
+
+            session.name = 'session2'
+            response = self.vmmaster_client.get('/api/sessions', headers={'If-None-Match': etag})
+            self.assertEqual(200, response.status_code)
+            etag = response.headers['ETag']
+
+            session.status = 'running'
+            response = self.vmmaster_client.get('/api/sessions', headers={'If-None-Match': etag})
+            self.assertEqual(200, response.status_code)
+
+        session.failed()
+
+    def test_api_session_steps(self):
+        steps = [Mock(id=i, info={"id": i}) for i in (5, 6)]
+        get_log_steps_page = Mock(return_value=steps)
+
+        with patch('flask.current_app.database.get_log_steps_page', get_log_steps_page):
+            response = self.vmmaster_client.get('/api/session/1/steps?cursor=4&before=10&limit=1')
+        body = json.loads(response.data)
+
+        self.assertEqual([{"id": 5}], body['result']['steps'])
+        self.assertEqual(5, body['result']['next_cursor'])
+        get_log_steps_page.assert_called_once_with(1, after_id=4, before_id=10, limit=2)
+
+    def test_api_status_active_sessions(self):
+        from core.db.models import Session
+        session = Session(self.platform, "session1", provider_id=1)
+
+        with patch.multiple(
+            'vmmaster.api.helpers',
+            get_active_providers=Mock(return_value=[]),
+            get_platforms=Mock(return_value=[]),
+            get_endpoints=Mock(return_value={})
+        ):
+            response = self.vmmaster_client.get('/api/status')
+            body = json.loads(response.data)
+            self.assertEqual(200, body['metacode'])
+            self.assertDictEqual({"1": 1}, body['result']['active_sessions'])
+
+            session.failed()
+            response = self.vmmaster_client.get('/api/status')
+            body = json.loads(response.data)
+            self.assertDictEqual({"1": 0}, body['result']['active_sessions'])
+
+    def test_api_sessions_cache(self):
+        from core.db.models import Session
+        session = Session(self.platform, "session1", self.desired_caps["desiredCapabilities"])
+        with patch.dict(self.app.database.active_sessions, {str(session.id): session}):
+            self.app.sessions.get_session(session.id)
+            self.app.sessions.get_session(session.id)
+
+        response = self.vmmaster_client.get('/api/sessions/cache')
+        body = json.loads(response.data)
+        self.assertEqual(200, body['metacode'])
+        self.assertEqual(1, body['result']['cached_sessions'])
+        self.assertEqual(1, body['result']['stats']['size'])
+        self.assertEqual(1, body['result']['stats']['hits'])
+        self.assertEqual(1, body['result']['stats']['misses'])
+
+        session.failed()
+        response = self.vmmaster_client.get('/api/sessions/cache')
+        body = json.loads(response.data)
+        self.assertEqual(0, body['result']['cached_sessions'])
+        self.assertEqual(1, body['result']['stats']['evictions'])
+
     def test_api_stop_session(self):
         from core.db.models import Session
         session = Session("some_platform")
@@ -232,14 +362,28 @@ class TestVmmasterApi(BaseTestCase):
         session.failed.assert_any_call(
             reason=constants.SESSION_CLOSE_REASON_API_CALL)
 
-    def test_get_screenshots(self):
-        steps = [
-            Mock(screenshot=None),
-            Mock(screenshot="/vmmaster/screenshots/1/1.png")
-        ]
+    def test_api_session_step_with_body(self):
+        log_step = Mock(session_id=1, body="step body", info={"id": 2})
+        sub_step = Mock(id=3, control_line="200", body="sub step body")
 
-        with patch('flask.current_app.database.get_log_steps_for_session',
-                   Mock(return_value=steps)):
+        with patch.multiple(
+            'flask.current_app.database',
+            get_step_by_id=Mock(return_value=log_step),
+            get_sub_steps=Mock(return_value=[sub_step])
+        ):
+            response = self.vmmaster_client.get('/api/session/1/step/2')
+            other_session_response = self.vmmaster_client.get('/api/session/5/step/2')
+        body = json.loads(response.data)
+
+        self.assertEqual("step body", body['result']['body'])
+        self.assertEqual(
+            [{"id": 3, "control_line": "200", "body": "sub step body"}], body['result']['sub_steps']
+        )
+        self.assertEqual(404, json.loads(other_session_response.data)['metacode'])
+
+    def test_get_screenshots(self):
+        with patch('flask.current_app.database.get_screenshots',
+                   Mock(return_value=["/vmmaster/screenshots/1/1.png"])):
             response = self.vmmaster_client.get('/api/session/1/screenshots')
         body = json.loads(response.data)
         self.assertEqual(200, response.status_code)
@@ -268,18 +412,16 @@ class TestVmmasterApi(BaseTestCase):
         self.assertEqual(200, body['metacode'])
 
     def test_get_screenshots_for_label(self):
-
-        steps = [
-            Mock(control_line="POST /wd/hub/session/23/element HTTP/1.0",
-                 id=2,
-                 screenshot="/vmmaster/screenshots/1/1.png"),
-            Mock(control_line="POST /wd/hub/session/23/vmmasterLabel HTTP/1.0",
-                 id=1,
-                 screenshot=None)
-        ]
-
-        with patch('flask.current_app.database.get_log_steps_for_session',
-                   Mock(return_value=steps)):
+        label_step = Mock(control_line="POST /wd/hub/session/23/vmmasterLabel HTTP/1.0",
+                          id=1, session_id=1, screenshot=None)
+        get_screenshots = Mock(return_value=["/vmmaster/screenshots/1/2.png"])
+
+        with patch.multiple(
+            'flask.current_app.database',
+            get_step_by_id=Mock(return_value=label_step),
+            get_next_label_step_id=Mock(return_value=5),
+            get_screenshots=get_screenshots
+        ):
             response = \
                 self.vmmaster_client.get('/api/session/1/label/1/screenshots')
         body = json.loads(response.data)
@@ -288,6 +430,18 @@ class TestVmmasterApi(BaseTestCase):
         screenshots = body['result']['screenshots']
         self.assertEqual(1, len(screenshots))
         self.assertEqual(200, body['metacode'])
+        get_screenshots.assert_called_once_with(1, from_id=1, to_id=5)
+
+    def test_get_screenshots_for_not_label_step(self):
+        step = Mock(control_line="POST /wd/hub/session/23/element HTTP/1.0",
+                    id=2, session_id=1, screenshot="/vmmaster/screenshots/1/2.png")
+
+        with patch('flask.current_app.database.get_step_by_id',
+                   Mock(return_value=step)):
+            response = \
+                self.vmmaster_client.get('/api/session/1/label/2/screenshots')
+        body = json.loads(response.data)
+        self.assertEqual([], body['result']['screenshots'])
 
 
 class TestProviderApi(BaseTestCase):
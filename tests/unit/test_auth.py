@@ -30,6 +30,8 @@ class TestWDAuthPositive(BaseTestCase):
                 'platform': 'test_origin_1'
             }
         }
+        from core.auth.custom_auth import user_tokens
+        user_tokens.clear()
 
     def tearDown(self):
         self.ctx.pop()
@@ -101,6 +103,48 @@ class TestWDAuthPositive(BaseTestCase):
         self.assertEqual(resp.status_code, 401)
         self.assertDictEqual(json.loads(resp.data), success_data)
 
+    def test_auth_restores_username_from_token(self):
+        from flask import request
+        from core.auth.custom_auth import auth as wd_auth
+        self.set_auth_credentials(token="token")
+        self.push_to_ctx()
+
+        with patch(
+            "flask.current_app.database", new=Mock(
+                get_user=Mock(return_value=Mock(id=1, username="user")))
+        ):
+            wd_auth.login_required(decorate_this)()
+
+        self.assertEqual(json.loads(request.data)["desiredCapabilities"]["user"], "user")
+
+    def test_auth_user_cached_by_token(self):
+        from core.auth.custom_auth import auth as wd_auth
+        self.set_auth_credentials(token="token")
+        self.push_to_ctx()
+
+        database = Mock(get_user=Mock(return_value=Mock(id=1, username="user")))
+        with patch("flask.current_app.database", new=database):
+            wd_auth.login_required(decorate_this)()
+            wd_auth.login_required(decorate_this)()
+
+        database.get_user.assert_called_once_with(token="token")
+
+    def test_regenerate_token_invalidates_cached_user(self):
+        from core.db.models import User
+        from core.auth.custom_auth import auth as wd_auth
+        self.set_auth_credentials(token="token")
+        self.push_to_ctx()
+
+        user = User(username="user", token="token")
+        user.save = Mock()
+        database = Mock(get_user=Mock(return_value=user))
+        with patch("flask.current_app.database", new=database):
+            wd_auth.login_required(decorate_this)()
+            user.regenerate_token()
+            wd_auth.login_required(decorate_this)()
+
+        self.assertEqual(database.get_user.call_count, 2)
+
 
 class TestAPIAuthPositive(BaseTestCase):
     @classmethod
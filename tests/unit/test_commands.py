@@ -450,6 +450,15 @@ class TestGetDesiredCapabilities(BaseTestCase):
         dc = self.commands.get_desired_capabilities(self.request)
         self.assertFalse(dc["takeScreenshot"])
 
+    def test_replace_platform_with_any(self):
+        self.request.data = json.dumps(self.body)
+        dc = self.commands.get_desired_capabilities(self.request)
+        self.commands.replace_platform_with_any(self.request)
+
+        self.assertEqual(dc["platform"], "some_platform")
+        self.assertEqual(json.loads(self.request.data)["desiredCapabilities"]["platform"], "ANY")
+        self.assertEqual(self.commands.get_desired_capabilities(self.request)["platform"], "ANY")
+
 
 class TestRunScript(CommonCommandsTestCase):
     def setUp(self):
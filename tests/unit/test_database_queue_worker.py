@@ -0,0 +1,138 @@
+# coding: utf-8
+
+import time
+from flask import Flask
+from mock import Mock, call
+from sqlalchemy.dialects import postgresql
+
+from core.config import setup_config
+from tests.helpers import BaseTestCase
+
+
+class TestDatabaseQueueWorker(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        from core.db import DatabaseQueueWorker, DatabaseTaskQueue
+
+        self.calls = Mock()
+        self.database = Mock(add=self.calls.add, add_all=self.calls.add_all)
+        self.queue = DatabaseTaskQueue()
+        self.worker = DatabaseQueueWorker(self.queue, self.database)
+
+    def test_consecutive_adds_written_in_one_transaction(self):
+        self.queue.extend([(self.database.add, (i,)) for i in range(5)])
+
+        self.worker._poll_and_execute()
+
+        self.assertEqual([call.add_all([0, 1, 2, 3, 4])], self.calls.mock_calls)
+        self.assertEqual(0, len(self.queue))
+
+    def test_tasks_order_is_kept(self):
+        task = self.calls.task
+        task.__name__ = "task"
+        self.queue.extend([
+            (self.database.add, (1,)),
+            (self.database.add, (2,)),
+            (task, ("sub_step",)),
+            (self.database.add, (3,)),
+        ])
+
+        self.worker._poll_and_execute()
+
+        self.assertEqual(
+            [call.add_all([1, 2]), call.task("sub_step"), call.add_all([3])],
+            self.calls.mock_calls
+        )
+
+    def test_batch_size(self):
+        self.worker.batch_size = 2
+        self.queue.extend([(self.database.add, (i,)) for i in range(3)])
+
+        self.worker._poll_and_execute()
+
+        self.assertEqual([call.add_all([0, 1]), call.add_all([2])], self.calls.mock_calls)
+
+    def test_objects_added_one_by_one_if_batch_failed(self):
+        self.calls.add_all.side_effect = Exception("batch error")
+        self.queue.extend([(self.database.add, (i,)) for i in range(2)])
+
+        self.worker._poll_and_execute()
+
+        self.assertEqual(
+            [call.add_all([0, 1]), call.add(0), call.add(1)],
+            self.calls.mock_calls
+        )
+
+    def test_step_bodies_encoded_before_write(self):
+        from core.db.models import StepBodyMixin
+        step = Mock(spec=StepBodyMixin)
+        self.calls.attach_mock(step.encode_body, "encode_body")
+        self.queue.extend([(self.database.add, (step,)), (self.database.add, (1,))])
+
+        self.worker._poll_and_execute()
+
+        self.assertEqual([call.encode_body(), call.add_all([step, 1])], self.calls.mock_calls)
+
+    def test_full_batch_is_not_waited(self):
+        self.worker.batch_size = 2
+        self.worker.max_latency = 10
+        self.queue.extend([(self.database.add, (i,)) for i in range(2)])
+
+        start = time.time()
+        self.worker._wait_for_flush()
+
+        self.assertLess(time.time() - start, 1)
+
+    def test_tasks_waited_for_max_latency(self):
+        self.worker.max_latency = 0.2
+        self.queue.append((self.database.add, (1,)))
+
+        start = time.time()
+        self.worker._wait_for_flush()
+
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertGreaterEqual(self.queue.oldest_task_age(), 0.2)
+
+    def test_stop_wakes_up_worker(self):
+        self.worker.start()
+        self.worker.stop()
+
+        self.assertFalse(self.worker.is_alive())
+
+
+class TestDatabaseBulkInsert(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        from core.db import Database
+
+        self.app = Flask(__name__)
+        self.app.database_task_queue = Mock()
+        self.database = self.app.database = Database("sqlite://", sqlite=True)
+
+    def create_steps(self, count):
+        from core.db.models import SessionLogStep
+        with self.app.app_context():
+            return [SessionLogStep("GET /url", body="body", session_id=1) for _ in range(count)]
+
+    def test_steps_inserted_by_one_statement(self):
+        steps = self.create_steps(3)
+        dbsession = Mock(bind=Mock(dialect=postgresql.dialect()))
+        dbsession.execute.side_effect = [[(7,), (8,), (9,)], Mock()]
+
+        self.database._add_objects(steps, dbsession)
+
+        ids, insert = [str(c[0][0].compile(dialect=postgresql.dialect())) for c in dbsession.execute.call_args_list]
+        self.assertIn("nextval('session_log_steps_id_seq')", ids)
+        self.assertEqual(3, insert.count("%(control_line_m"))
+        self.assertEqual([7, 8, 9], [step.id for step in steps])
+        self.assertEqual(["body"] * 3, [step.body for step in steps])
+
+    def test_steps_inserted_one_by_one_without_sequences(self):
+        from core.db.models import SessionLogStep
+        SessionLogStep.__table__.create(self.database.engine)
+        steps = self.create_steps(3)
+
+        self.database.add_all(steps)
+
+        self.assertEqual([1, 2, 3], [step.id for step in steps])
+        self.assertEqual(3, len(self.database.get_log_steps_for_session(1)))
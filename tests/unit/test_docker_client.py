@@ -56,6 +56,17 @@ class TestDockerClient(BaseTestCase):
         self.assertTrue(self._docker_client.client.images.list.called)
         self.assertTrue(len(images_list), 1)
 
+    def test_pull_image_with_progress(self):
+        progress = Mock()
+        self._docker_client.client.api.pull.return_value = iter([
+            {"status": "Downloading", "id": "a"}, {"status": "Pull complete", "id": "a"}
+        ])
+
+        self._docker_client.pull_image("image", "latest", progress=progress)
+
+        self._docker_client.client.api.pull.assert_called_once_with("image", tag="latest", stream=True, decode=True)
+        self.assertEqual(2, progress.call_count)
+
     def test_create_network(self):
         self._docker_client.create_network("network")
         self.assertTrue(self._docker_client.client.networks.create.called)
@@ -0,0 +1,217 @@
+# coding: utf-8
+
+from mock import Mock, patch, PropertyMock
+
+from core import constants
+from core.config import setup_config, config
+from core.exceptions import CreationException, RequestException
+from core.db.models import Provider
+from tests.helpers import BaseTestCase, DatabaseMock
+
+
+def container(status="running", ip="10.0.0.2", health=None, ports=None):
+    return Mock(id="container_id", status=status, ip=ip, health=health, ports=ports or {})
+
+
+def agent_script_done(ip, port, script, timeout):
+    """
+    Output of recycle script which ends with echo of marker
+    """
+    return "Stopped\n%s\n" % script.splitlines()[-1].replace("echo ", "")
+
+
+class TestDockerCloneUnit(BaseTestCase):
+    def setUp(self):
+        from flask import Flask
+        setup_config('data/config_openstack.py')
+        self.config_patch = patch.multiple(
+            config, create=True,
+            BIND_LOCALHOST_PORTS=True, DOCKER_PROBE_MIN_DELAY=0.01, DOCKER_PROBE_MAX_DELAY=0.015,
+        )
+        self.config_patch.start()
+
+        self.app = Flask(__name__)
+        self.app.database = DatabaseMock()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+        self.client = Mock()
+        with patch("core.db.models.DockerClone._get_client", Mock(return_value=self.client)):
+            from core.db.models import DockerClone
+            self.clone = DockerClone(
+                Mock(short_name="ubuntu-14.04"), "preloaded", Mock(provider=Provider(name='fake', url='no//url'))
+            )
+        self.clone.uuid = "container_id"
+
+    def tearDown(self):
+        self.ctx.pop()
+        self.config_patch.stop()
+
+    @patch.multiple(
+        "core.db.models.DockerClone",
+        ping_vm=Mock(return_value=True),
+        selenium_is_ready=PropertyMock(return_value=True)
+    )
+    def test_ready_after_ip_and_healthcheck(self):
+        self.client.get_container.side_effect = [
+            container(status="created", ip=""),
+            container(health="starting"),
+            container(health="healthy"),
+        ]
+
+        with patch("core.db.models.DockerClone.refresh", Mock()) as refresh:
+            self.assertTrue(self.clone._wait_for_activated_service())
+
+        self.assertEqual("10.0.0.2", self.clone.ip)
+        self.assertEqual(3, self.client.get_container.call_count)
+        self.assertEqual(1, self.clone.ping_vm.call_count)
+        self.assertFalse(refresh.called)
+
+    @patch.multiple(
+        "core.db.models.DockerClone",
+        ping_vm=Mock(return_value=True),
+        selenium_is_ready=PropertyMock(return_value=True)
+    )
+    def test_unpaused_container_is_inspected_again(self):
+        paused = container(status="paused")
+        self.client.get_container.side_effect = [paused, container()]
+
+        self.clone.unpause()
+
+        self.assertTrue(paused.unpause.called)
+        self.assertTrue(self.clone.ready)
+
+    def test_unhealthy_container(self):
+        self.client.get_container.return_value = container(health="unhealthy")
+
+        with self.assertRaises(CreationException):
+            self.clone._wait_for_activated_service()
+
+    def test_exited_container(self):
+        self.client.get_container.return_value = container(status="exited")
+
+        with self.assertRaises(CreationException):
+            self.clone._wait_for_activated_service()
+
+    @patch.multiple(
+        "core.db.models.DockerClone",
+        ping_vm=Mock(return_value=True),
+        selenium_is_ready=PropertyMock(side_effect=[False] * 5 + [True])
+    )
+    def test_selenium_probed_with_backoff(self):
+        self.client.get_container.return_value = container()
+        sleep = Mock()
+
+        self.assertTrue(self.clone._wait_for_activated_service(sleep=sleep))
+        self.assertEqual([0.01, 0.015, 0.015, 0.015, 0.015], [args[0] for args, _ in sleep.call_args_list])
+
+    @patch.multiple(
+        "core.db.models.DockerClone",
+        ping_vm=Mock(return_value=False),
+        rebuild=Mock(return_value=False)
+    )
+    def test_rebuild_after_ping_retries(self):
+        self.client.get_container.return_value = container()
+
+        self.assertFalse(self.clone._wait_for_activated_service(sleep=Mock()))
+        self.assertEqual(config.VM_PING_RETRY_COUNT + 1, self.clone.ping_vm.call_count)
+        self.assertTrue(self.clone.rebuild.called)
+
+
+class TestDockerCloneRebuild(BaseTestCase):
+    def setUp(self):
+        from flask import Flask
+        setup_config('data/config_openstack.py')
+        self.config_patch = patch.multiple(
+            config, create=True,
+            BIND_LOCALHOST_PORTS=True, PUBLIC_IP="10.0.0.2", DOCKER_PROBE_MIN_DELAY=0.01, DOCKER_PROBE_MAX_DELAY=0.015,
+            DOCKER_RECYCLE=True, DOCKER_RECYCLE_TIMEOUT=1
+        )
+        self.config_patch.start()
+
+        self.app = Flask(__name__)
+        self.app.database = DatabaseMock()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+        self.container = container(ports={"4455": "32001", "9000": "32002", "5900": "32003"})
+        self.client = Mock(get_container=Mock(return_value=self.container))
+        with patch("core.db.models.DockerClone._get_client", Mock(return_value=self.client)):
+            from core.db.models import DockerClone
+            self.clone = DockerClone(
+                Mock(short_name="ubuntu-14.04"), "preloaded", Mock(provider=Provider(name='fake', url='no//url'))
+            )
+        self.clone.uuid = "container_id"
+        self.clone.ip = "10.0.0.2"
+        self.clone.ready = True
+        self.clone.in_use = True
+
+    def tearDown(self):
+        self.ctx.pop()
+        self.config_patch.stop()
+
+    @patch("core.utils.network_utils.ping_ports", Mock(side_effect=lambda ip, ports: {port: True for port in ports}))
+    @patch("core.utils.network_utils.run_agent_script", Mock(side_effect=agent_script_done))
+    @patch("core.db.models.DockerClone.selenium_is_ready", PropertyMock(side_effect=[False, True]))
+    def test_rebuild_by_recycle(self):
+        from core.utils import network_utils
+
+        self.assertTrue(self.clone.delete(try_to_rebuild=True))
+
+        self.assertFalse(self.container.restart.called)
+        self.assertFalse(self.clone.in_use)
+        ip, port, script, timeout = network_utils.run_agent_script.call_args[0]
+        self.assertEqual(("10.0.0.2", "32002", 1), (ip, port, timeout))
+        self.assertIn(constants.DOCKER_RECYCLE_SCRIPT, script)
+
+    @patch("core.utils.network_utils.run_agent_script", Mock(return_value="supervisorctl: command not found"))
+    @patch("core.db.models.DockerClone._wait_for_activated_service")
+    def test_restart_after_failed_recycle(self, wait_for_activated_service):
+        self.assertFalse(self.clone.delete(try_to_rebuild=True))
+
+        self.assertTrue(self.container.restart.called)
+        self.assertTrue(wait_for_activated_service.called)
+
+    @patch("core.utils.network_utils.run_agent_script", Mock(side_effect=RequestException("refused")))
+    @patch("core.db.models.DockerClone._wait_for_activated_service")
+    def test_restart_after_agent_error(self, wait_for_activated_service):
+        self.clone.delete(try_to_rebuild=True)
+
+        self.assertTrue(self.container.restart.called)
+
+    @patch("core.utils.network_utils.run_agent_script")
+    @patch("core.db.models.DockerClone._wait_for_activated_service")
+    def test_restart_if_recycle_is_off(self, wait_for_activated_service, run_agent_script):
+        config.DOCKER_RECYCLE = False
+
+        self.clone.delete(try_to_rebuild=True)
+
+        self.assertFalse(run_agent_script.called)
+        self.assertTrue(self.container.restart.called)
+
+    @patch("core.db.models.DockerClone._wait_for_activated_service", Mock(return_value=True))
+    def test_pause(self):
+        from core.db.models import DockerClone
+        with patch("core.db.models.DockerClone._get_client", Mock(return_value=self.client)):
+            clone = DockerClone(
+                Mock(short_name="ubuntu-14.04"), "paused", Mock(provider=Provider(name='fake', url='no//url'))
+            )
+        self.client.run_container.return_value = self.container
+        clone.ready = True
+        clone.create()
+
+        clone.pause()
+
+        self.assertTrue(self.container.pause.called)
+        self.assertFalse(clone.ready)
+
+    def test_unpause(self):
+        self.clone.ready = False
+        self.container.status = "paused"
+        self.container.unpause.side_effect = lambda: setattr(self.container, "status", "running")
+
+        with patch("core.db.models.DockerClone.ping_vm", Mock(return_value=True)), \
+                patch("core.db.models.DockerClone.selenium_is_ready", PropertyMock(return_value=True)):
+            self.clone.unpause()
+
+        self.assertTrue(self.clone.ready)
@@ -0,0 +1,139 @@
+# coding: utf-8
+
+from mock import Mock, patch
+
+from core.config import setup_config, config
+from tests.helpers import BaseTestCase
+
+
+def image(short_name, prefix="vmmaster-"):
+    docker_image = Mock(short_name=short_name)
+    # name of mock is set as attribute only
+    docker_image.name = "{}{}".format(prefix, short_name)
+    return docker_image
+
+
+class TestDockerPlatforms(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.config_patch = patch.multiple(
+            config, create=True,
+            DOCKER_IMAGE_NAME_PREFIX="vmmaster-", DOCKER_PULL_CONCURRENCY=2, DOCKER_PULL_PROGRESS_INTERVAL=0,
+            PLATFORMS={"docker": {"ubuntu-14.04:latest": {}, "ubuntu-16.04:latest": {}, "wrong_name": {}}}
+        )
+        self.config_patch.start()
+
+        from vmpool.platforms import DockerPlatforms
+        self.client_patch = patch.object(DockerPlatforms, "client", Mock())
+        self.client = self.client_patch.start()
+        self.images = [image("ubuntu-14.04:latest"), image("ubuntu-16.04:latest"), image("other", prefix="")]
+        self.client.images.return_value = self.images
+        self.platforms = DockerPlatforms(Mock())
+
+    def tearDown(self):
+        self.client_patch.stop()
+        self.config_patch.stop()
+
+    def test_images_are_listed_once(self):
+        self.assertEqual(self.images[0], self.platforms.get("ubuntu-14.04:latest"))
+        self.assertEqual(self.images[1], self.platforms.get("ubuntu-16.04:latest"))
+        self.assertIsNone(self.platforms.get("other"))
+
+        self.assertEqual(2, len(self.platforms.platforms))
+        self.assertEqual(1, self.client.images.call_count)
+
+    def test_last_images_are_kept_if_they_cant_be_listed(self):
+        self.platforms.refresh_images()
+        self.client.images.return_value = None
+
+        self.assertEqual(2, len(self.platforms.refresh_images()))
+        self.assertEqual(self.images[0], self.platforms.get("ubuntu-14.04:latest"))
+
+    def test_images_of_all_platforms_are_pulled(self):
+        self.platforms.prepare_platforms()
+
+        self.assertEqual(
+            [("vmmaster-ubuntu-14.04", "latest"), ("vmmaster-ubuntu-16.04", "latest")],
+            sorted((kwargs["name"], kwargs["tag"]) for _, kwargs in self.client.pull_image.call_args_list)
+        )
+        self.assertEqual(1, self.client.images.call_count)
+
+    def test_pull_progress(self):
+        from vmpool.platforms import ImagePullProgress
+        progress = ImagePullProgress("vmmaster-ubuntu-14.04:latest")
+
+        for status in [
+            {"status": "Pulling from vmmaster-ubuntu-14.04", "id": "latest"},
+            {"status": "Downloading", "id": "a", "progressDetail": {"current": 1048576, "total": 2097152}},
+            {"status": "Already exists", "id": "b", "progressDetail": {}},
+            {"status": "Downloading", "id": "a", "progressDetail": {"current": 2097152, "total": 2097152}},
+            {"status": "Pull complete", "id": "a", "progressDetail": {}},
+        ]:
+            progress(status)
+
+        self.assertEqual("2 layers pulled, 2.0/2.0 MB downloaded", str(progress))
+
+
+class TestImagesWatcher(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+
+    def test_images_refreshed_on_image_events(self):
+        from vmpool.platforms import ImagesWatcher
+        on_refresh = Mock()
+        docker_platforms = Mock()
+        watcher = ImagesWatcher(docker_platforms, on_refresh)
+
+        def events(since, until):
+            watcher.running = False
+            return [{"Type": "image", "Action": "pull"}, {"Type": "image", "Action": "tag"}, {"status": "inspect"}]
+        docker_platforms.client.image_events.side_effect = events
+
+        watcher.run()
+
+        self.assertEqual(2, docker_platforms.refresh_images.call_count)
+        on_refresh.assert_called_with(docker_platforms.refresh_images.return_value)
+
+
+class TestPlatforms(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.config_patch = patch.multiple(
+            config, create=True,
+            USE_OPENSTACK=False, USE_DOCKER=True, DOCKER_IMAGE_NAME_PREFIX="vmmaster-", PLATFORMS={}
+        )
+        self.config_patch.start()
+
+        from vmpool.platforms import DockerPlatforms, Platforms
+        self.watcher = Mock()
+        self.client_patch = patch.object(DockerPlatforms, "client", Mock())
+        self.client_patch.start().images.return_value = [image("ubuntu-14.04:latest")]
+        self.watch_patch = patch.object(
+            DockerPlatforms, "watch_images",
+            lambda docker_platforms, on_refresh: setattr(docker_platforms, "images_watcher", self.watcher)
+        )
+        self.watch_patch.start()
+
+        self.database = Mock()
+        self.platforms = Platforms(self.database)
+        self.platforms.provider_id = 1
+
+    def tearDown(self):
+        self.platforms.cleanup()
+        self.watch_patch.stop()
+        self.client_patch.stop()
+        self.config_patch.stop()
+
+    def test_refreshed_platforms_updated_in_db(self):
+        self.platforms.update_docker_platforms({"ubuntu-16.04:latest": image("ubuntu-16.04:latest")})
+
+        self.assertEqual(["ubuntu-16.04:latest"], self.platforms.info())
+        self.database.update_platforms.assert_called_once_with(1, ["ubuntu-16.04:latest"])
+
+    def test_refresh_after_cleanup_is_ignored(self):
+        self.platforms.cleanup()
+        self.platforms.update_docker_platforms({"ubuntu-16.04:latest": image("ubuntu-16.04:latest")})
+
+        self.assertTrue(self.watcher.stop.called)
+        self.assertEqual([], self.platforms.info())
+        self.assertFalse(self.database.update_platforms.called)
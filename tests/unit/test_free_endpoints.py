@@ -0,0 +1,74 @@
+# coding: utf-8
+
+from datetime import datetime
+from mock import Mock, patch
+
+from core.config import setup_config, config
+from tests.helpers import BaseTestCase
+
+
+def endpoint(endpoint_id, platform_name="origin_1", created_time=None, ready=True, in_use=False, deleted=False):
+    return Mock(
+        id=endpoint_id, platform_name=platform_name, created_time=created_time or datetime(2018, 1, endpoint_id),
+        ready=ready, in_use=in_use, deleted=deleted
+    )
+
+
+class TestFreeEndpoints(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        from vmpool.virtual_machines_pool import FreeEndpoints
+        self.free_endpoints = FreeEndpoints(reconcile_interval=30)
+
+    def test_newest_endpoint_first(self):
+        for endpoint_id in (2, 3, 1):
+            self.free_endpoints.update(endpoint(endpoint_id))
+
+        self.assertEqual([3, 2, 1, None], [self.free_endpoints.pop("origin_1") for _ in range(4)])
+
+    def test_busy_endpoints_are_not_free(self):
+        self.free_endpoints.update(endpoint(1))
+        self.free_endpoints.update(endpoint(2))
+        self.free_endpoints.update(endpoint(3, platform_name="origin_2"))
+
+        self.free_endpoints.update(endpoint(2, in_use=True))
+        self.free_endpoints.update(endpoint(1, ready=False))
+
+        self.assertIsNone(self.free_endpoints.pop("origin_1"))
+        self.assertEqual(3, self.free_endpoints.pop("origin_2"))
+
+    def test_reconcile_replaces_free_endpoints(self):
+        self.free_endpoints.update(endpoint(1))
+        self.assertTrue(self.free_endpoints.expired)
+
+        self.free_endpoints.reconcile([endpoint(2), endpoint(3, deleted=True), endpoint(4, platform_name="origin_2")])
+
+        self.assertFalse(self.free_endpoints.expired)
+        self.assertEqual(2, len(self.free_endpoints))
+        self.assertEqual([2, None], [self.free_endpoints.pop("origin_1") for _ in range(2)])
+
+
+class TestGetByPlatform(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        from vmpool.virtual_machines_pool import VirtualMachinesPool
+        with patch.multiple(config, create=True, PUBLIC_IP="127.0.0.1", PORT=9001):
+            self.pool = VirtualMachinesPool(
+                Mock(), platforms_class=Mock(), preloader_class=Mock(), artifact_collector_class=Mock(),
+                endpoint_remover_class=Mock(), endpoint_preparer_class=Mock()
+            )
+
+    def test_endpoint_taken_by_id(self):
+        vm = endpoint(1)
+        self.pool.platforms.pool = [vm, endpoint(2, in_use=True)]
+        self.pool.platforms.get_endpoint.return_value = vm
+
+        self.assertEqual(vm, self.pool.get_by_platform("origin_1"))
+        vm.set_in_use.assert_called_once_with(True)
+        self.assertIsNone(self.pool.get_by_platform("origin_1"))
+
+    def test_endpoint_taken_in_db_is_skipped(self):
+        self.pool.platforms.pool = [endpoint(1)]
+        self.pool.platforms.get_endpoint.return_value = endpoint(1, in_use=True)
+
+        self.assertIsNone(self.pool.get_by_platform("origin_1"))
@@ -1,8 +1,10 @@
 # coding: utf-8
 
+import json
 import requests
 from mock import Mock, patch
 
+from core import utils
 from core.config import setup_config, config
 from tests.helpers import (vmmaster_server_mock, server_is_up, server_is_down,
                            BaseTestCase, get_free_port, ServerMock)
@@ -90,3 +92,125 @@ class TestHttpProxy(BaseTestCase):
             "make sure you request uri has "
             "/proxy/session/<session_id>/port/<port_number>/<destination>",
             response.content)
+
+
+class TestWebDriverProxy(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.host = "localhost"
+        self.port = config.PORT
+        self.address = (self.host, self.port)
+        with patch.object(config, "WEBDRIVER_ASYNC_PROXY", True, create=True):
+            self.vmmaster = vmmaster_server_mock(self.port)
+        self.assertTrue(server_is_up(self.address))
+        self.free_port = get_free_port()
+
+        self.ctx = self.vmmaster.app.app_context()
+        self.ctx.push()
+
+        from core.db.models import Session, Provider, Endpoint
+        self.session = Session('some_platform')
+        self.session.selenium_session = "selenium-session-id"
+
+        provider = Provider(name='noname', url='nourl')
+        endpoint = Endpoint(Mock(), '', provider)
+        endpoint.ip = 'localhost'
+        endpoint.ports = {'selenium': str(self.free_port)}
+        self.session.endpoint = endpoint
+        self.session.add_session_step = Mock()
+
+    def tearDown(self):
+        self.session._close()
+        self.ctx.pop()
+        self.vmmaster.app.sessions.kill_all()
+        self.vmmaster.app.cleanup()
+        self.vmmaster.stop_services()
+        self.assertTrue(server_is_down(self.address))
+
+    def url(self, path=""):
+        return "http://%s:%s/wd/hub/session/%s%s" % (self.host, self.port, self.session.id, path)
+
+    def test_proxy_command(self):
+        from twisted.python.threadable import isInIOThread
+        in_reactor = []
+        self.session.add_session_step.side_effect = lambda **kwargs: in_reactor.append(isInIOThread())
+        server = ServerMock(self.host, self.free_port)
+        server.start()
+        with patch(
+            'core.sessions.Sessions.get_session', Mock(return_value=self.session)
+        ):
+            response = requests.post(
+                self.url("/element"),
+                data='{"sessionId": "%s", "using": "id"}' % self.session.id,
+                headers={"reply": "200"}
+            )
+        server.stop()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("selenium-session-id", response.json()["sessionId"])
+        self.assertEqual(2, self.session.add_session_step.call_count)
+        self.assertEqual([False, False], in_reactor)
+        self.assertFalse(self.session.is_active)
+
+    def test_screenshot_is_removed_from_logged_response(self):
+        self.session.take_screenshot = True
+        server = ServerMock(self.host, self.free_port)
+        server.start()
+        with patch(
+            'core.sessions.Sessions.get_session', Mock(return_value=self.session)
+        ), patch(
+            'core.utils.inspect_response', Mock(side_effect=utils.inspect_response)
+        ) as inspect_response, patch.object(
+            self.vmmaster.app, 'screenshots', Mock(), create=True
+        ) as screenshots:
+            response = requests.post(
+                self.url("/element"),
+                data='{"sessionId": "%s", "status": 7, "value": {"screen": "aGVsbG8="}}' % self.session.id,
+                headers={"reply": "500"}
+            )
+        server.stop()
+
+        self.assertEqual(500, response.status_code)
+        self.assertEqual("aGVsbG8=", response.json()["value"]["screen"])
+        logged_body = self.session.add_session_step.call_args_list[-1][1]["body"]
+        self.assertEqual("", json.loads(logged_body)["value"]["screen"])
+        self.assertEqual(1, inspect_response.call_count)
+        self.assertEqual("aGVsbG8=", screenshots.put.call_args[0][2])
+
+    def test_proxy_command_when_endpoint_unreachable(self):
+        with patch(
+            'core.sessions.Sessions.get_session', Mock(return_value=self.session)
+        ), patch.object(
+            config, "MAKE_REQUEST_ATTEMPTS_AMOUNT", 1
+        ):
+            response = requests.get(self.url("/url"))
+
+        self.assertEqual(500, response.status_code)
+        self.assertIn("Connection was refused", response.json()["value"]["message"])
+        self.assertTrue(self.session.closed)
+        self.assertEqual("failed", self.session.status)
+
+    def test_delete_session(self):
+        server = ServerMock(self.host, self.free_port)
+        server.start()
+        with patch(
+            'core.sessions.Sessions.get_session', Mock(return_value=self.session)
+        ):
+            response = requests.delete(self.url())
+        server.stop()
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(self.session.closed)
+        self.assertEqual("succeed", self.session.status)
+
+    def test_unknown_session(self):
+        response = requests.get(self.url("/url"))
+
+        self.assertEqual(500, response.status_code)
+        self.assertIn("Unknown session", response.json()["value"]["message"])
+
+    def test_other_requests_are_served_by_wsgi(self):
+        response = requests.get("http://%s:%s/wd/hub/unknown" % (self.host, self.port))
+
+        self.assertEqual(404, response.status_code)
+        self.assertIn("Not Found", response.content)
@@ -170,15 +170,48 @@ class TestMatcherFallback(BaseTestCase):
         self.assertListEqual(['ubuntu-14.04-x64'], matcher.get_matched_platforms(dc))
 
 
-def provider(uid, max_limit):
+class TestPlatformsIndex(BaseTestCase):
+    def setUp(self):
+        from vmmaster.matcher import PlatformsIndex
+        self.index = PlatformsIndex()
+        self.index.build([
+            (Mock(id=1, max_limit=1, config={
+                "linux": {
+                    "ubuntu_1": {"browsers": {"chrome": "52.0.1", "firefox": "45"}},
+                    "ubuntu_2": {"browsers": {"chrome": "53"}},
+                }
+            }), ["ubuntu_1", "ubuntu_2"]),
+            (Mock(id=2, max_limit=1, config={}), ["win_1"]),
+            (Mock(id=3, max_limit=0, config={}), ["win_1"]),
+        ])
+
+    @dataprovider([
+        ({"platform": "LINUX", "browserName": "chrome"}, {1: ["ubuntu_1", "ubuntu_2"]}),
+        ({"platform": "LINUX", "browserName": "chrome", "version": "52"}, {1: ["ubuntu_1"]}),
+        ({"platform": "LINUX", "browserName": "chrome", "version": "52.0.1"}, {1: ["ubuntu_1"]}),
+        ({"platform": "LINUX", "browserName": "chrome", "version": "52.0"}, {}),
+        ({"platform": "LINUX", "browserName": "opera"}, {}),
+        ({"platform": "LINUX"}, {}),
+        ({"platform": "WIN_1"}, {2: ["win_1"]}),
+        ({"platform": "ANY", "browserName": "firefox"}, {1: ["ubuntu_1"], 2: ["win_1"]}),
+    ])
+    def test_matched_platforms(self, dc, expected):
+        matched = {
+            provider_id: sorted(platforms) for provider_id, platforms in self.index.get_matched_platforms(dc).items()
+        }
+        self.assertDictEqual(matched, expected)
+
+
+def provider(uid, max_limit, platforms=("ubuntu_1",)):
     _provider = Mock()
     type(_provider).id = uid
     type(_provider).max_limit = max_limit
-    type(_provider).config = {"LINUX": {"ubuntu_1"}}
+    type(_provider).config = {"LINUX": {platform: {"browsers": {"chrome": "52"}} for platform in platforms}}
     return _provider
 
 
 class TestMatchingAndBalancing(BaseTestCase):
+    dc = {"platform": "LINUX", "browserName": "chrome"}
 
     @dataprovider([
         (1, 1, [], None, None),
@@ -189,51 +222,69 @@ class TestMatchingAndBalancing(BaseTestCase):
         with patch(
             'core.sessions.Sessions', Mock()
         ), patch.multiple(
-            'vmmaster.app.Vmmaster', get_provider_id=Mock(return_value=provider_id), providers=[provider(1, max_limit)]
-        ), patch(
-            'vmmaster.matcher.SeleniumMatcher.get_matched_platforms', Mock(return_value=platforms)
+            'vmmaster.app.Vmmaster', get_provider_id=Mock(return_value=provider_id),
+            providers=[provider(1, max_limit, platforms)]
         ), patch(
-            'core.db.Database', Mock()
+            'core.db.Database', Mock(return_value=Mock(get_platforms=Mock(return_value={})))
         ):
             from vmmaster.app import Vmmaster
             vmmaster = Vmmaster("test")
-            platform, provider_id = vmmaster.get_matched_platforms({})
+            platform, provider_id = vmmaster.get_matched_platforms(self.dc)
 
             self.assertEqual(provider_id, exp_provider)
             self.assertEqual(platform, exp_platform)
 
     @dataprovider([
-        ([], ([], []), None, None),
-        ((provider(1, 1), provider(2, 1)), ([], []), None, None),
-        ((provider(1, 0), provider(2, 0)), (["ubuntu_1"], ["ubuntu_1"]), None, None),
-        ((provider(1, 1), provider(2, 1)), ([], ["ubuntu_1"]), "ubuntu_1", 2),
+        ([], None, None),
+        ((provider(1, 1, []), provider(2, 1, [])), None, None),
+        ((provider(1, 0), provider(2, 0)), None, None),
+        ((provider(1, 1, []), provider(2, 1)), "ubuntu_1", 2),
     ])
-    def test_matched_platforms_multiple_provider(self, providers, platforms, exp_platform, exp_provider):
+    def test_matched_platforms_multiple_provider(self, providers, exp_platform, exp_provider):
         with patch(
             'core.sessions.Sessions', Mock()
         ), patch.multiple(
             'vmmaster.app.Vmmaster', get_provider_id=Mock(return_value=exp_provider), providers=providers
         ), patch(
-            'vmmaster.matcher.SeleniumMatcher.get_matched_platforms', Mock(side_effect=platforms)
-        ), patch(
-            'core.db.Database', Mock()
+            'core.db.Database', Mock(return_value=Mock(get_platforms=Mock(return_value={})))
         ):
             from vmmaster.app import Vmmaster
             vmmaster = Vmmaster("test")
-            platform, provider_id = vmmaster.get_matched_platforms({})
+            platform, provider_id = vmmaster.get_matched_platforms(self.dc)
 
             self.assertEqual(provider_id, exp_provider)
             self.assertEqual(platform, exp_platform)
 
+    def test_platforms_index_rebuilt_on_providers_change(self):
+        providers = [provider(1, 1)]
+        with patch(
+            'core.sessions.Sessions', Mock()
+        ), patch.multiple(
+            'vmmaster.app.Vmmaster', get_provider_id=Mock(side_effect=lambda limits: max(limits)),
+            providers=property(lambda self: providers)
+        ), patch(
+            'core.db.Database', Mock(return_value=Mock(get_platforms=Mock(return_value={})))
+        ):
+            from vmmaster.app import Vmmaster
+            vmmaster = Vmmaster("test")
+            vmmaster.database.get_platforms_fingerprint.return_value = (1, 1, 1)
+            self.assertEqual(vmmaster.get_matched_platforms(self.dc), ("ubuntu_1", 1))
+
+            providers.append(provider(2, 1, ["ubuntu_2"]))
+            self.assertEqual(vmmaster.get_matched_platforms(self.dc), ("ubuntu_1", 1))
+
+            vmmaster.database.get_platforms_fingerprint.return_value = (2, 2, 2)
+            self.assertEqual(vmmaster.get_matched_platforms(self.dc), ("ubuntu_2", 2))
+
     @dataprovider([
-        ({1: 1}, [], 1),
-        ({1: 2}, [Mock()], 1),
-        ({1: 1}, [Mock()], 1),
-        ({1: 1}, [Mock(), Mock()], 1),
+        ({1: 1}, 0, 1),
+        ({1: 2}, 1, 1),
+        ({1: 1}, 1, 1),
+        ({1: 1}, 2, 1),
     ])
     def test_getting_single_provider(self, limits, active_sessions, expected):
         with patch(
-            'core.sessions.Sessions', Mock(active=Mock(return_value=active_sessions))
+            'core.sessions.Sessions', Mock(active_count=Mock(return_value=active_sessions))
         ) as sessions, patch(
             'core.db.Database', Mock()
         ):
@@ -245,17 +296,17 @@ class TestMatchingAndBalancing(BaseTestCase):
             self.assertEqual(provider_id, expected)
 
     @dataprovider([
-        ({1: 1, 2: 1}, ([], []), 1),
-        ({1: 1, 2: 2}, ([], []), 2),
-        ({1: 1, 2: 1}, ([Mock()], []), 2),
-        ({1: 1, 2: 1}, ([], [Mock(), Mock()]), 1),
-        ({1: 1, 2: 1}, ([Mock(), Mock()], [Mock()]), 2),
-        ({1: 1, 2: 2}, ([Mock(), Mock()], [Mock()]), 2),
-        ({1: 2, 2: 2}, ([Mock(), Mock()], [Mock(), Mock()]), 1),
+        ({1: 1, 2: 1}, (0, 0), 1),
+        ({1: 1, 2: 2}, (0, 0), 2),
+        ({1: 1, 2: 1}, (1, 0), 2),
+        ({1: 1, 2: 1}, (0, 2), 1),
+        ({1: 1, 2: 1}, (2, 1), 2),
+        ({1: 1, 2: 2}, (2, 1), 2),
+        ({1: 2, 2: 2}, (2, 2), 1),
     ])
     def test_getting_multiple_providers(self, limits, active_sessions, expected):
         with patch(
-                'core.sessions.Sessions', Mock(active=Mock(side_effect=active_sessions))
+                'core.sessions.Sessions', Mock(active_count=Mock(side_effect=active_sessions))
         ) as sessions, patch(
             'core.db.Database', Mock()
         ):
@@ -0,0 +1,80 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+
+from mock import Mock, patch
+
+from core.config import setup_config, config
+from tests.helpers import BaseTestCase
+
+
+class TestStepBodyStorage(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.screenshots_dir = tempfile.mkdtemp()
+        self.config_patch = patch.multiple(
+            config, create=True,
+            SCREENSHOTS_DIR=self.screenshots_dir,
+            STEP_BODY_COMPRESS_THRESHOLD=100,
+            STEP_BODY_SPILL_THRESHOLD=1000
+        )
+        self.config_patch.start()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.screenshots_dir)
+
+    def test_short_body_stored_as_is(self):
+        from core.db.models import encode_step_body
+        self.assertEqual(("short", None, None), encode_step_body("short", 1))
+
+    def test_long_body_compressed(self):
+        from core.db.models import encode_step_body, decode_step_body
+        body = u'{"value": "%s"}' % (u"тест" * 100)
+
+        stored = encode_step_body(body, 1)
+
+        self.assertIsNone(stored[0])
+        self.assertLess(len(stored[1]), len(body))
+        self.assertEqual(body, decode_step_body(*stored))
+
+    def test_huge_body_spilled_to_file(self):
+        from core.db.models import encode_step_body, decode_step_body
+        body = os.urandom(2000).encode("hex")
+
+        stored = encode_step_body(body, 1)
+
+        self.assertEqual((None, None), stored[:2])
+        self.assertTrue(stored[2].startswith(os.path.join(self.screenshots_dir, "steps", "1")))
+        self.assertEqual(body, decode_step_body(*stored))
+
+    def test_huge_body_without_session_compressed(self):
+        from core.db.models import encode_step_body, decode_step_body
+        body = os.urandom(2000).encode("hex")
+
+        stored = encode_step_body(body)
+
+        self.assertIsNone(stored[2])
+        self.assertEqual(body, decode_step_body(*stored))
+
+    def test_body_of_step_is_transparent(self):
+        from flask import Flask
+        from collections import deque
+        from core.db.models import SessionLogStep
+        app = Flask(__name__)
+        app.database = Mock()
+        app.database_task_queue = deque()
+        body = "b" * 500
+
+        with app.app_context():
+            log_step = SessionLogStep("GET /wd/hub/session/1/source", body=body, session_id=1)
+
+        self.assertIsNone(log_step.body_zlib)
+        self.assertEqual(body, log_step.body)
+
+        log_step.encode_body()
+
+        self.assertIsNotNone(log_step.body_zlib)
+        self.assertEqual(body, log_step.body)
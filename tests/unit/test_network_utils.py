@@ -0,0 +1,158 @@
+# coding: utf-8
+
+import socket
+from mock import Mock, patch
+
+from core.config import setup_config, config
+from core.exceptions import RequestException, RequestTimeoutException
+from core.utils import network_utils
+from tests.helpers import BaseTestCase, ServerMock, get_free_port
+
+
+class TestEndpointConnectionPools(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.host = "localhost"
+        self.port = get_free_port()
+        self.pools = network_utils.connection_pools
+        self.pools.close_all()
+
+    def tearDown(self):
+        self.pools.close_all()
+
+    def test_make_request_through_pool(self):
+        server = ServerMock(self.host, self.port)
+        server.start()
+        try:
+            for status, headers, body in network_utils.make_request(
+                self.host, self.port, network_utils.RequestHelper("GET", "/")
+            ):
+                pass
+        finally:
+            server.stop()
+
+        self.assertEqual(200, status)
+        self.assertEqual("ok", body)
+        self.assertEqual(1, len(self.pools))
+
+    def test_response_waited_without_polling(self):
+        server = ServerMock(self.host, self.port)
+        server.start()
+        try:
+            with patch.object(config, "REQUEST_WATCH_INTERVAL", 5, create=True):
+                values = list(network_utils.make_request(
+                    self.host, self.port, network_utils.RequestHelper("GET", "/")
+                ))
+        finally:
+            server.stop()
+
+        self.assertEqual([200], [status for status, headers, body in values])
+
+    def test_response_of_last_attempt_is_returned(self):
+        server = ServerMock(self.host, self.port)
+        server.start()
+        try:
+            with patch.object(config, "MAKE_REQUEST_ATTEMPTS_AMOUNT", 1):
+                values = list(network_utils.make_request(
+                    self.host, self.port, network_utils.RequestHelper("GET", "/")
+                ))
+        finally:
+            server.stop()
+
+        self.assertEqual([200], [status for status, headers, body in values])
+
+    def test_request_attempt_failed(self):
+        self.assertEqual(5, network_utils.request_attempt_failed("url", 1, Exception(), 1, 2))
+        with self.assertRaises(RequestTimeoutException):
+            network_utils.request_attempt_failed("url", 1, RequestTimeoutException(), 2, 2)
+        with self.assertRaises(RequestException):
+            network_utils.request_attempt_failed("url", 1, Exception(), 2, 2)
+
+    def test_same_session_for_same_endpoint_port(self):
+        self.assertIs(self.pools.get(self.host, 4455), self.pools.get(self.host, "4455"))
+        self.assertIsNot(self.pools.get(self.host, 4455), self.pools.get(self.host, 9000))
+        self.assertEqual(2, len(self.pools))
+
+    def test_close_endpoint_ports(self):
+        self.pools.get(self.host, 4455)
+        self.pools.get(self.host, 9000)
+        self.pools.get("127.0.0.2", 4455)
+
+        self.pools.close(self.host, ["4455"])
+        self.assertEqual(2, len(self.pools))
+
+        self.pools.close(self.host)
+        self.assertEqual(1, len(self.pools))
+
+    def test_endpoint_connections_max_from_config(self):
+        with patch.object(config, "ENDPOINT_CONNECTIONS_MAX", 3, create=True):
+            session = self.pools.get(self.host, 4455)
+
+        self.assertEqual(3, session.get_adapter("http://%s:4455" % self.host)._pool_maxsize)
+
+
+class TestProbe(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.host = "127.0.0.1"
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind((self.host, 0))
+        self.server.listen(5)
+        self.open_port = self.server.getsockname()[1]
+        self.closed_port = get_free_port()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_ping_ports_at_once(self):
+        self.assertEqual(
+            {self.open_port: True, self.closed_port: False},
+            network_utils.ping_ports(self.host, [self.open_port, self.closed_port])
+        )
+
+    def test_probe_addresses_of_many_hosts(self):
+        results = network_utils.probe([(self.host, self.open_port), ("bad host name", self.open_port)])
+
+        self.assertTrue(results[(self.host, self.open_port)])
+        self.assertFalse(results[("bad host name", self.open_port)])
+
+    def test_ping(self):
+        self.assertTrue(network_utils.ping(self.host, self.open_port))
+        self.assertFalse(network_utils.ping(self.host, self.closed_port))
+
+
+class TestPingResults(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.results = network_utils.PingResults()
+
+    @patch.object(config, "PING_CACHE_TTL", 5, create=True)
+    def test_recent_result(self):
+        self.results.add("10.0.0.1", [4455, "9000"])
+
+        self.assertTrue(self.results.is_recent("10.0.0.1", ["9000", 4455]))
+        self.assertFalse(self.results.is_recent("10.0.0.1", [4455, 9000, 5900]))
+        self.assertFalse(self.results.is_recent("10.0.0.2", [4455, 9000]))
+
+    @patch.object(config, "PING_CACHE_TTL", 5, create=True)
+    def test_result_expired(self):
+        with patch("core.utils.network_utils.time.time", Mock(return_value=100)):
+            self.results.add("10.0.0.1", [4455])
+        with patch("core.utils.network_utils.time.time", Mock(return_value=105)):
+            self.assertFalse(self.results.is_recent("10.0.0.1", [4455]))
+
+    @patch.object(config, "PING_CACHE_TTL", 0, create=True)
+    def test_cache_disabled(self):
+        self.results.add("10.0.0.1", [4455])
+
+        self.assertFalse(self.results.is_recent("10.0.0.1", [4455]))
+
+    def test_forget_endpoint(self):
+        self.results.add("10.0.0.1", [4455])
+        self.results.add("10.0.0.1", [4455, 9000])
+        self.results.add("10.0.0.2", [4455])
+
+        self.results.forget("10.0.0.1")
+
+        self.assertFalse(self.results.is_recent("10.0.0.1", [4455]))
+        self.assertTrue(self.results.is_recent("10.0.0.2", [4455]))
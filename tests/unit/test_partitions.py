@@ -0,0 +1,115 @@
+# coding: utf-8
+
+from datetime import datetime
+from lode_runner import dataprovider
+from mock import Mock
+from sqlalchemy.dialects import postgresql
+
+from tests.helpers import BaseTestCase
+
+
+class TestMonthPartitions(BaseTestCase):
+    @dataprovider([
+        (datetime(2018, 5, 1), 1, datetime(2018, 6, 1)),
+        (datetime(2018, 12, 1), 1, datetime(2019, 1, 1)),
+        (datetime(2018, 1, 1), -1, datetime(2017, 12, 1)),
+        (datetime(2018, 3, 1), -15, datetime(2016, 12, 1)),
+    ])
+    def test_add_months(self, month, months, expected):
+        from core.db.partitions import add_months
+        self.assertEqual(expected, add_months(month, months))
+
+    def test_partition_name(self):
+        from core.db.partitions import partition_name, month_start
+        self.assertEqual("sub_steps_y2018m05", partition_name("sub_steps", month_start(datetime(2018, 5, 17, 10))))
+
+    def test_month_partitions(self):
+        from core.db.partitions import month_partitions
+        connection = Mock(execute=Mock(return_value=[
+            ("sub_steps_y2018m06",), ("sub_steps_default",), ("sub_steps_y2017m12",)
+        ]))
+
+        self.assertEqual(
+            [(datetime(2017, 12, 1), "sub_steps_y2017m12"), (datetime(2018, 6, 1), "sub_steps_y2018m06")],
+            month_partitions(connection, "sub_steps")
+        )
+
+    def test_sqlite_is_not_partitioned(self):
+        from core.db.partitions import is_partitioned
+        connection = Mock()
+        connection.dialect.name = "sqlite"
+
+        self.assertFalse(is_partitioned(connection, "sub_steps"))
+        self.assertFalse(connection.execute.called)
+
+    def test_identifiers_quoted(self):
+        from core.db.partitions import statement
+        connection = Mock(dialect=postgresql.dialect())
+
+        self.assertEqual(
+            'DROP TABLE "sub_steps; DROP TABLE sessions"',
+            str(statement(connection, "DROP TABLE {name}", name="sub_steps; DROP TABLE sessions"))
+        )
+
+    @staticmethod
+    def connection(existing_tables=(), default_has_rows=False):
+        statements, bound = [], []
+
+        def execute(statement, **params):
+            statements.append(str(statement))
+            bound.append(params)
+            result = Mock(rowcount=3)
+            if "to_regclass" in str(statement):
+                result.scalar.return_value = params["table"] in existing_tables
+            else:
+                result.scalar.return_value = default_has_rows
+            return result
+        connection = Mock(execute=Mock(side_effect=execute), dialect=postgresql.dialect(), bound=bound)
+        return connection, statements
+
+    def test_month_partition_created(self):
+        from core.db.partitions import create_month_partition
+        connection, statements = self.connection(existing_tables=["sub_steps_default"])
+
+        create_month_partition(connection, "sub_steps", datetime(2018, 5, 1))
+
+        self.assertEqual(
+            "CREATE TABLE sub_steps_y2018m05 PARTITION OF sub_steps FOR VALUES FROM (:start) TO (:end)",
+            statements[-1]
+        )
+        self.assertEqual({"start": "2018-05-01", "end": "2018-06-01"}, connection.bound[-1])
+
+    def test_existing_month_partition_kept(self):
+        from core.db.partitions import create_month_partition
+        connection, statements = self.connection(existing_tables=["sub_steps_y2018m05"])
+
+        create_month_partition(connection, "sub_steps", datetime(2018, 5, 1))
+
+        self.assertEqual(1, len(statements))
+
+    def test_rows_of_late_month_partition_moved_from_default(self):
+        from core.db.partitions import create_month_partition
+        connection, statements = self.connection(existing_tables=["sub_steps_default"], default_has_rows=True)
+
+        create_month_partition(connection, "sub_steps", datetime(2018, 5, 1))
+
+        self.assertEqual([
+            "CREATE TABLE sub_steps_y2018m05 (LIKE sub_steps INCLUDING DEFAULTS)",
+            "WITH moved AS (DELETE FROM sub_steps_default WHERE created >= :start AND created < :end "
+            "RETURNING *) INSERT INTO sub_steps_y2018m05 SELECT * FROM moved",
+            "ALTER TABLE sub_steps ATTACH PARTITION sub_steps_y2018m05 FOR VALUES FROM (:start) TO (:end)",
+        ], statements[-3:])
+        self.assertEqual([{"start": "2018-05-01", "end": "2018-06-01"}] * 2, connection.bound[-2:])
+
+    def test_sub_steps_of_dropped_steps_deleted(self):
+        from core.db.partitions import drop_month_partition
+        connection, statements = self.connection()
+
+        drop_month_partition(connection, "session_log_steps", "session_log_steps_y2018m05", keep="session_id = 1")
+
+        self.assertIn(
+            "DELETE FROM sub_steps WHERE session_log_step_id IN "
+            "(SELECT id FROM session_log_steps_y2018m05 WHERE (session_id = 1) IS NOT TRUE)",
+            statements
+        )
+        self.assertEqual("DROP TABLE session_log_steps_y2018m05", statements[-1])
@@ -0,0 +1,200 @@
+# coding: utf-8
+
+from mock import Mock, patch
+
+from core.config import setup_config, config
+from tests.helpers import BaseTestCase, app_context_mock
+
+
+def preloaded_vm(platform_name):
+    return Mock(platform_name=platform_name, is_preloaded=Mock(return_value=True))
+
+
+def paused_vm(endpoint_id, platform_name, in_use=False, deleted=False):
+    return Mock(
+        id=endpoint_id, platform_name=platform_name, in_use=in_use, deleted=deleted,
+        is_preloaded=Mock(return_value=False)
+    )
+
+
+class TestPreloader(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_with_preloaded.py')
+        self.config_patch = patch.multiple(
+            config, create=True,
+            OPENSTACK_PRELOADED={'origin_1': 3, 'origin_2': 2},
+            PRELOADER_DEMAND_WINDOW=0,
+            PRELOADER_DEMAND_MAX_TARGET=5,
+            USE_DOCKER=False,
+            DOCKER_PAUSED={}
+        )
+        self.config_patch.start()
+
+        from vmpool.virtual_machines_pool import VirtualMachinesPool
+        self.pool = Mock(
+            app=Mock(app_context=app_context_mock),
+            active_endpoints=[preloaded_vm('origin_1')],
+            count_virtual_machines=VirtualMachinesPool.count_virtual_machines
+        )
+
+    def tearDown(self):
+        self.config_patch.stop()
+
+    def test_deficit_of_every_platform(self):
+        from vmpool.virtual_machines_pool import VirtualMachinesPoolPreloader
+        preloader = VirtualMachinesPoolPreloader(self.pool)
+
+        self.assertEqual({'origin_1': 2, 'origin_2': 2}, preloader.need_load())
+
+    def test_pending_preloads_are_not_repeated(self):
+        from vmpool.virtual_machines_pool import VirtualMachinesPoolPreloader
+        preloader = VirtualMachinesPoolPreloader(self.pool)
+        preloader.workers = Mock()
+
+        for _ in range(2):
+            preloader.submit('origin_2')
+
+        self.assertEqual({'origin_1': 2}, preloader.need_load())
+        self.assertEqual(2, preloader.workers.apply_async.call_count)
+
+    def test_preload_done(self):
+        from vmpool.virtual_machines_pool import VirtualMachinesPoolPreloader
+        preloader = VirtualMachinesPoolPreloader(self.pool)
+        preloader.workers = Mock()
+        self.pool.preload.side_effect = [Mock(ready=True), Exception("creation failed")]
+
+        for _ in range(2):
+            preloader.submit('origin_2')
+            preloader.preload('origin_2')
+
+        self.assertEqual(0, preloader.pending['preloaded']['origin_2'])
+        self.assertEqual({'origin_1': 2, 'origin_2': 2}, preloader.need_load())
+
+    def test_queued_preloads_dropped_on_stop(self):
+        from multiprocessing.pool import ThreadPool
+        from threading import Event, Timer
+        from vmpool.virtual_machines_pool import VirtualMachinesPoolPreloader
+        preloader = VirtualMachinesPoolPreloader(self.pool)
+        preloader.workers = ThreadPool(1)
+        started, release = Event(), Event()
+        self.pool.preload.side_effect = lambda *args: started.set() or release.wait(5) and Mock(ready=True)
+
+        for _ in range(3):
+            preloader.submit('origin_2')
+        started.wait(5)
+        # preload in progress is finished while preloader is stopping
+        Timer(0.5, release.set).start()
+        with patch.object(preloader, "join", Mock()):
+            preloader.stop()
+
+        self.assertEqual(1, self.pool.preload.call_count)
+        self.assertFalse(any(worker.is_alive() for worker in preloader.workers._pool))
+
+    def test_target_raised_by_demand(self):
+        from vmpool.virtual_machines_pool import VirtualMachinesPoolPreloader
+        config.PRELOADER_DEMAND_WINDOW = 60
+        preloader = VirtualMachinesPoolPreloader(self.pool)
+
+        for _ in range(7):
+            preloader.register_demand('origin_2')
+        preloader.register_demand('origin_1')
+
+        self.assertEqual({'origin_1': 3, 'origin_2': 5}, preloader.targets())
+
+    def test_paused_deficit(self):
+        from vmpool.virtual_machines_pool import VirtualMachinesPoolPreloader
+        config.USE_DOCKER = True
+        config.DOCKER_PAUSED = {'origin_1': 2, 'origin_2': 1}
+        self.pool.count_paused.return_value = {'origin_1': 1}
+        preloader = VirtualMachinesPoolPreloader(self.pool)
+        preloader.workers = Mock()
+
+        preloader.submit('origin_2', 'paused')
+
+        self.assertEqual({'origin_1': 1}, preloader.need_load('paused'))
+        self.assertEqual({'origin_1': 2, 'origin_2': 2}, preloader.need_load())
+        preloader.workers.apply_async.assert_called_once_with(preloader.preload, ('origin_2', 'paused'))
+
+
+class TestAddFromPaused(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        from vmpool.virtual_machines_pool import VirtualMachinesPool
+        with patch.multiple(config, create=True, PUBLIC_IP="127.0.0.1", PORT=9001):
+            self.pool = VirtualMachinesPool(
+                Mock(), platforms_class=Mock(), preloader_class=Mock(), artifact_collector_class=Mock(),
+                endpoint_remover_class=Mock(), endpoint_preparer_class=Mock()
+            )
+        self.origin = Mock()
+        self.pool.platforms.get.return_value = self.origin
+
+    def paused(self, *vms):
+        self.pool.platforms.active_endpoints = list(vms)
+        self.pool.platforms.get_endpoint.side_effect = {vm.id: vm for vm in vms}.get
+        for vm in vms:
+            self.pool.paused[vm.platform_name].append(vm.id)
+
+    def test_paused_endpoint_is_unpaused(self):
+        vm = paused_vm(3, 'origin_1')
+        vm.unpause.side_effect = lambda: setattr(vm, "ready", True)
+        self.paused(paused_vm(1, 'origin_2'), paused_vm(2, 'origin_1', in_use=True), vm)
+
+        self.assertEqual(vm, self.pool.add('origin_1'))
+
+        vm.set_in_use.assert_called_once_with(True)
+        self.assertFalse(self.origin.make_clone.called)
+        self.assertEqual({'origin_2': 1}, self.pool.count_paused())
+
+    def test_cold_start_without_paused_endpoints(self):
+        self.paused(paused_vm(1, 'origin_2'), paused_vm(2, 'origin_1', deleted=True))
+
+        clone = self.pool.add('origin_1')
+
+        self.assertEqual(self.origin.make_clone.return_value, clone)
+        self.assertTrue(clone.create.called)
+
+    def test_cold_start_after_failed_unpause(self):
+        vm = paused_vm(1, 'origin_1')
+        vm.ready = False
+        self.paused(vm)
+
+        clone = self.pool.add('origin_1')
+
+        self.assertTrue(vm.delete.called)
+        self.assertEqual(self.origin.make_clone.return_value, clone)
+
+    def test_paused_endpoint_is_not_used_with_environment_variables(self):
+        vm = paused_vm(1, 'origin_1')
+        self.paused(vm)
+
+        self.pool.add('origin_1', environment_variables={"TZ": "UTC"})
+
+        self.assertFalse(vm.unpause.called)
+        self.assertTrue(self.origin.make_clone.called)
+
+    def test_paused_endpoint_is_not_used_for_preloaded(self):
+        vm = paused_vm(1, 'origin_1')
+        self.paused(vm)
+
+        self.pool.add('origin_1', prefix="preloaded")
+
+        self.assertFalse(vm.unpause.called)
+        self.assertTrue(self.origin.make_clone.called)
+
+    def test_created_paused_endpoint(self):
+        clone = self.origin.make_clone.return_value
+        clone.id, clone.ready = 5, True
+        self.paused()
+
+        self.pool.add('origin_1', prefix="paused")
+
+        self.assertTrue(clone.pause.called)
+        self.assertFalse(clone.set_in_use.called)
+        self.pool.platforms.active_endpoints = [clone]
+        self.assertEqual({'origin_1': 1}, self.pool.count_paused())
+
+    def test_deleted_paused_endpoint_is_forgotten(self):
+        self.paused(paused_vm(1, 'origin_1'), paused_vm(2, 'origin_1'))
+        self.pool.platforms.active_endpoints.pop()
+
+        self.assertEqual({'origin_1': 1}, self.pool.count_paused())
@@ -0,0 +1,73 @@
+# coding: utf-8
+
+import io
+import os
+import base64
+import shutil
+import tempfile
+
+from mock import Mock, patch
+from PIL import Image
+
+from core.config import setup_config, config
+from tests.helpers import BaseTestCase, app_context_mock
+
+
+def png(width, height):
+    content = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(content, "PNG")
+    return content.getvalue()
+
+
+class TestScreenshotsPool(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        self.screenshots_dir = tempfile.mkdtemp()
+        self.config_patch = patch.object(config, "SCREENSHOTS_DIR", self.screenshots_dir)
+        self.config_patch.start()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.screenshots_dir)
+
+    def test_screenshot_saved_by_worker(self):
+        from core.screenshots import ScreenshotsPool
+        log_step = Mock(id=2)
+        pool = ScreenshotsPool(app_context_mock, workers=1)
+        pool.start()
+
+        self.assertTrue(pool.put(1, log_step, base64.b64encode(png(1280, 720))))
+        pool.stop()
+
+        path = os.path.join(self.screenshots_dir, "1", "2.png")
+        self.assertEqual(path, log_step.screenshot)
+        self.assertTrue(log_step.save.called)
+        self.assertEqual((1280, 720), Image.open(path).size)
+        self.assertEqual((128, 72), Image.open(os.path.join(self.screenshots_dir, "1", "2_thumb.png")).size)
+
+    def test_screenshot_dropped_if_queue_is_full(self):
+        from core.screenshots import ScreenshotsPool
+        pool = ScreenshotsPool(app_context_mock, queue_size=1, policy="drop")
+
+        self.assertTrue(pool.put(1, Mock(id=1), "screenshot"))
+        self.assertFalse(pool.put(1, Mock(id=2), "screenshot"))
+        self.assertEqual(1, pool.tasks.qsize())
+
+    def test_screenshot_dropped_after_waiting_if_queue_is_full(self):
+        from core.screenshots import ScreenshotsPool
+        pool = ScreenshotsPool(app_context_mock, queue_size=1, policy="wait", timeout=0.01)
+
+        self.assertTrue(pool.put(1, Mock(id=1), "screenshot"))
+        self.assertFalse(pool.put(1, Mock(id=2), "screenshot"))
+
+    def test_worker_continues_after_failed_screenshot(self):
+        from core.screenshots import ScreenshotsPool
+        log_step = Mock(id=2)
+        pool = ScreenshotsPool(app_context_mock, workers=1)
+        pool.start()
+
+        pool.put(1, Mock(id=1), "not base64 screenshot!")
+        pool.put(1, log_step, base64.b64encode(png(10, 10)))
+        pool.stop()
+
+        self.assertTrue(log_step.save.called)
@@ -170,6 +170,43 @@ class TestProxyRequests(BaseTestFlaskApp):
         )
 
 
+class TestScreenshotAfterCommand(BaseTestFlaskApp):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        super(TestScreenshotAfterCommand, self).setUp()
+        self.vmmaster_client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.app.sessions.kill_all()
+        self.app.cleanup()
+        self.ctx.pop()
+
+    @patch(
+        "vmmaster.webdriver.helpers.transparent",
+        Mock(return_value=transparent_mock(500, {}, json.dumps({"status": 7, "value": {"screen": "aGVsbG8="}})))
+    )
+    def test_response_inspected_once(self):
+        from core import utils
+        session = Mock(id=1, closed=False, take_screenshot=True)
+        self.app.sessions.get_session = Mock(return_value=session)
+
+        with patch(
+            "core.utils.inspect_response", Mock(side_effect=utils.inspect_response)
+        ) as inspect_response, patch.object(
+            self.app, "screenshots", Mock(), create=True
+        ) as screenshots:
+            response = self.vmmaster_client.post("/wd/hub/session/1/element", data=json.dumps({"using": "id"}))
+
+        self.assertEqual(500, response.status_code)
+        self.assertEqual("aGVsbG8=", json.loads(response.data)["value"]["screen"])
+        logged_body = session.add_session_step.call_args_list[-1][1]["body"]
+        self.assertEqual("", json.loads(logged_body)["value"]["screen"])
+        self.assertEqual(1, inspect_response.call_count)
+        self.assertEqual("aGVsbG8=", screenshots.put.call_args[0][2])
+
+
 @patch.multiple(
     'vmmaster.webdriver.commands',
     ping_endpoint_before_start_session=Mock(side_effect=ping_vm_true_mock),
@@ -452,11 +489,11 @@ class TestSessionWorker(BaseTestCase):
         setup_config('data/config_openstack.py')
 
         from flask import Flask
+        from core.sessions import SessionWorker, SessionTimers
         self.app = Flask(__name__)
-        self.app.sessions = Mock()
+        self.app.sessions = Mock(timers=SessionTimers())
         self.app.sessions.app = self.app
 
-        from core.sessions import SessionWorker
         self.worker = SessionWorker(self.app.sessions, app_context_mock)
 
     def tearDown(self):
@@ -469,16 +506,119 @@ class TestSessionWorker(BaseTestCase):
         Expected: session timeouted
         """
 
-        session = Mock()
+        session = Mock(id=1, is_active=False, closed=False)
         session.timeout = Mock()
-        session.is_active = False
         session.inactivity = config.SESSION_TIMEOUT + 1
 
-        self.app.sessions.running = Mock(return_value=[session])
         self.worker.start()
-        time.sleep(1)
-        session.timeout.assert_any_call()
-        session._close()
+        self.app.sessions.timers.arm(session, 0)
+        time.sleep(0.5)
+        session.timeout.assert_called_once_with()
+        self.assertEqual(len(self.app.sessions.timers), 0)
+
+    def test_active_session_not_timeouted(self):
+        """
+        - arm timer for session and disarm it before deadline
+        - run session worker
+        Expected: session not timeouted
+        """
+        session = Mock(id=1, is_active=True, closed=False)
+        session.timeout = Mock()
+        session.inactivity = config.SESSION_TIMEOUT + 1
+
+        self.worker.start()
+        self.app.sessions.timers.arm(session, 0.2)
+        self.app.sessions.timers.disarm(session)
+        time.sleep(0.5)
+        self.assertFalse(session.timeout.called)
+        self.assertEqual(len(self.app.sessions.timers), 0)
+
+    def test_rearmed_session_timeouted_after_new_deadline(self):
+        """
+        - arm timer for session and re-arm it with later deadline
+        - run session worker
+        Expected: session timeouted only after new deadline
+        """
+        session = Mock(id=1, is_active=False, closed=False)
+        session.timeout = Mock()
+        session.inactivity = config.SESSION_TIMEOUT + 1
+
+        self.worker.start()
+        self.app.sessions.timers.arm(session, 0.1)
+        self.app.sessions.timers.arm(session, 0.6)
+        time.sleep(0.3)
+        self.assertFalse(session.timeout.called)
+        time.sleep(0.6)
+        session.timeout.assert_called_once_with()
+
+
+class TestSessionCache(BaseTestCase):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+
+        from core.sessions import SessionCache
+        self.cache = SessionCache(max_size=2, ttl=60)
+
+    def test_least_recently_used_evicted(self):
+        """
+        - add two sessions, read first one and add third session
+        Expected: second session evicted
+        """
+        self.cache["1"], self.cache["2"] = "first", "second"
+        self.assertEqual(self.cache["1"], "first")
+        self.cache["3"] = "third"
+
+        self.assertEqual(self.cache.to_json(), ["1", "3"])
+        self.assertRaises(KeyError, lambda: self.cache["2"])
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_expired_session_evicted(self):
+        """
+        - add session and read it after ttl
+        Expected: cache miss, session evicted
+        """
+        self.cache["1"] = "first"
+        with patch("core.sessions.time.time", Mock(return_value=time.time() + 61)):
+            self.assertRaises(KeyError, lambda: self.cache["1"])
+
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_evict_session(self):
+        self.cache["1"] = "first"
+        self.cache.evict("1")
+        self.cache.evict("2")
+
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+
+class TestActiveSessionsCounters(BaseTestCase):
+    def setUp(self):
+        from core.sessions import ActiveSessionsCounters
+        self.counters = ActiveSessionsCounters()
+
+    def test_add_and_remove_sessions(self):
+        self.counters.add(1, 1)
+        self.counters.add(1, 1)
+        self.counters.add(1, 2)
+        self.counters.add(2, 3)
+        self.counters.remove(1, 2)
+        self.counters.remove(1, 2)
+        self.counters.remove(3, 4)
+
+        self.assertEqual(self.counters.count(1), 1)
+        self.assertEqual(self.counters.count(2), 1)
+        self.assertEqual(self.counters.count(3), 0)
+        self.assertDictEqual(self.counters.to_json(), {1: 1, 2: 1})
+
+    def test_reconcile_with_database(self):
+        self.counters.add(1, 1)
+        self.counters.reconcile(Mock(return_value=[(2, 1), (3, 1), (4, None)]))
+
+        self.assertEqual(self.counters.count(1), 2)
+        self.assertDictEqual(self.counters.to_json(), {1: 2})
 
 
 class TestConnectionClose(BaseTestFlaskApp):
@@ -513,6 +653,38 @@ class TestConnectionClose(BaseTestFlaskApp):
             self.assertIn("ConnectionError: Client has disconnected", response.data)
 
 
+class TestSessionLogSteps(BaseTestFlaskApp):
+    def setUp(self):
+        setup_config('data/config_openstack.py')
+        super(TestSessionLogSteps, self).setUp()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.app.database.get_last_session_step = Mock()
+
+    def tearDown(self):
+        self.app.sessions.kill_all()
+        self.app.cleanup()
+        self.ctx.pop()
+
+    def test_sub_step_added_to_step_from_memory(self):
+        """
+        - add step and sub step while both are still queued
+        Expected: sub step parent is the queued step, no database lookup
+        """
+        from core.db.models import Session, SessionLogSubStep
+        session = Session('some_platform')
+        session.add_session_step("POST /wd/hub/session/1/url")
+        step = session._last_log_step
+        session.add_sub_step("POST /wd/hub/session/1/url")
+        session.add_session_step("GET /wd/hub/session/1/url")
+
+        self.assertTrue(wait_for(lambda: not self.app.database_task_queue))
+        added = [obj for (objects,), _ in self.app.database.add_all.call_args_list for obj in objects]
+        sub_steps = [obj for obj in added if isinstance(obj, SessionLogSubStep)]
+        self.assertEqual([step.id], [sub_step.session_log_step_id for sub_step in sub_steps])
+        self.assertFalse(self.app.database.get_last_session_step.called)
+
+
 class TestServerShutdown(BaseTestCase):
     def setUp(self):
         setup_config('data/config_openstack.py')
@@ -723,6 +895,7 @@ class TestHelpers(BaseTestCase):
         self.app = Flask('my_app')
         self.app.get_matched_platforms = Mock(return_value=('origin_1', 1))
         self.app.database = Mock()
+        self.app.sessions = Mock()
         self.request_context = self.app.test_request_context()
         self.request_context.push()
 
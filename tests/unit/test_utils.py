@@ -0,0 +1,78 @@
+# coding: utf-8
+
+import json
+from lode_runner import dataprovider
+
+from tests.helpers import BaseTestCase
+
+
+class TestInspectResponse(BaseTestCase):
+    def test_screenshot_from_webdriver_response(self):
+        from core.utils import inspect_response
+        body = json.dumps({"status": 13, "value": {"message": "error", "screen": "aGVsbG8="}})
+
+        screenshot, redacted = inspect_response(body)
+
+        self.assertEqual("aGVsbG8=", screenshot)
+        self.assertEqual({"status": 13, "value": {"message": "error", "screen": ""}}, json.loads(redacted))
+
+    def test_screenshot_from_agent_response(self):
+        from core.utils import inspect_response
+        screenshot, redacted = inspect_response('{"screenshot": "aGVsbG8="}')
+
+        self.assertEqual("aGVsbG8=", screenshot)
+        self.assertEqual({"screenshot": ""}, json.loads(redacted))
+
+    @dataprovider([
+        '{"status": 0, "value": "http://example.com"}',
+        'not json',
+    ])
+    def test_response_without_screenshot_is_not_changed(self, body):
+        from core.utils import inspect_response
+        self.assertEqual((None, body), inspect_response(body))
+
+    def test_screen_key_not_in_value(self):
+        from core.utils import inspect_response
+        body = json.dumps({"status": 0, "value": {"element": {"screen": "keep me"}}})
+
+        screenshot, redacted = inspect_response(body)
+
+        self.assertIsNone(screenshot)
+        self.assertEqual("keep me", json.loads(redacted)["value"]["element"]["screen"])
+
+    @dataprovider([
+        'error "screenshot": "aGVsbG8="',
+        '{"value": {"screen": "aGVsbG8="}',
+        '["screen", "screenshot"]',
+    ])
+    def test_not_json_object_is_not_changed(self, body):
+        from core.utils import inspect_response
+        self.assertEqual((None, body), inspect_response(body))
+
+    def test_screenshot_with_escaped_quote(self):
+        from core.utils import inspect_response
+        body = json.dumps({"status": 13, "value": {"message": "error", "screen": 'aGVs\\"bG8='}})
+
+        screenshot, redacted = inspect_response(body)
+
+        self.assertEqual('aGVs\\"bG8=', screenshot)
+        self.assertEqual({"status": 13, "value": {"message": "error", "screen": ""}}, json.loads(redacted))
+
+    def test_duplicate_screenshot_keys(self):
+        from core.utils import inspect_response
+        body = '{"screenshot": "Zmlyc3Q=", "screenshot": "bGFzdA=="}'
+
+        screenshot, redacted = inspect_response(body)
+
+        self.assertEqual("bGFzdA==", screenshot)
+        self.assertEqual({"screenshot": ""}, json.loads(redacted))
+
+    def test_screenshot_key_in_string_value(self):
+        from core.utils import inspect_response
+        body = json.dumps({"status": 0, "value": {"message": '"screen": "not a screenshot"', "screen": "aGVsbG8="}})
+
+        screenshot, redacted = inspect_response(body)
+
+        self.assertEqual("aGVsbG8=", screenshot)
+        self.assertEqual('"screen": "not a screenshot"', json.loads(redacted)["value"]["message"])
+        self.assertEqual("", json.loads(redacted)["value"]["screen"])
@@ -4,6 +4,7 @@ import json
 import helpers
 import logging
 import os
+from datetime import datetime
 
 from flask import Blueprint, jsonify, request
 
@@ -24,6 +25,62 @@ def render_json(result, code=200):
     return jsonify(response)
 
 
+def render_json_conditional(result, code=200, etag=None):
+    """
+    render_json with ETag, returns 304 if client has the same page already
+    :param etag: weak ETag of result, strong ETag (hash of response body) is set if None
+    """
+    response = render_json(result, code)
+    if etag:
+        response.set_etag(etag, weak=True)
+    else:
+        response.add_etag()
+    return response.make_conditional(request)
+
+
+def _get_int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("Parameter '%s' must be integer, got '%s'" % (name, value))
+
+
+def _get_time_arg(name):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        raise ValueError("Parameter '%s' must be unix timestamp, got '%s'" % (name, value))
+
+
+def _get_limit_arg():
+    limit = _get_int_arg('limit', getattr(config, "API_PAGE_SIZE", constants.API_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError("Parameter 'limit' must be positive, got '%s'" % limit)
+    return min(limit, getattr(config, "API_PAGE_SIZE_MAX", constants.API_PAGE_SIZE_MAX))
+
+
+def _sessions_page(statuses=None):
+    """
+    Sessions are paginated only if limit or cursor is passed, all of them are returned otherwise
+    """
+    paginated = 'limit' in request.args or 'cursor' in request.args
+    return helpers.get_sessions_page(
+        limit=_get_limit_arg() if paginated else None,
+        after_id=_get_int_arg('cursor'),
+        statuses=statuses,
+        provider_id=_get_int_arg('provider_id'),
+        user_id=_get_int_arg('user_id'),
+        created_from=_get_time_arg('created_from'),
+        created_to=_get_time_arg('created_to')
+    )
+
+
 @api.route('/version')
 def version():
     return render_json({'version': os.environ.get('APP_VERSION', 'unknown')})
@@ -34,6 +91,7 @@ def status():
     return render_json({
         'providers': helpers.get_active_providers(),
         'sessions': helpers.get_sessions(),
+        'active_sessions': helpers.get_active_sessions_counters(),
         'queue': helpers.get_queue(),
         'platforms': helpers.get_platforms(),
         'endpoints': helpers.get_endpoints()
@@ -61,7 +119,8 @@ def platforms():
 def sessions_cache():
     return render_json(
         result={
-            'cached_sessions': len(helpers.get_cached_sessions())
+            'cached_sessions': len(helpers.get_cached_sessions()),
+            'stats': helpers.get_sessions_cache_stats()
         }
     )
 
@@ -80,12 +139,25 @@ def _config():
 
 @api.route('/sessions')
 def get_sessions():
-    return render_json({'sessions': helpers.get_sessions()})
+    """
+    Active sessions page, filters: status, provider_id, user_id,
+    created_from and created_to (unix timestamps), cursor and limit
+    """
+    statuses = request.args.getlist('status')
+    try:
+        sessions, next_cursor, etag = _sessions_page(statuses=statuses)
+    except ValueError as e:
+        return render_json(str(e), 400)
+    return render_json_conditional({'sessions': sessions, 'next_cursor': next_cursor}, etag=etag)
 
 
 @api.route('/queue')
 def get_queue():
-    return render_json({'queue': helpers.get_queue()})
+    try:
+        sessions, next_cursor, etag = _sessions_page(statuses=['waiting'])
+    except ValueError as e:
+        return render_json(str(e), 400)
+    return render_json_conditional({'queue': sessions, 'next_cursor': next_cursor}, etag=etag)
 
 
 @api.route('/session/<int:session_id>')
@@ -97,6 +169,32 @@ def get_session(session_id):
         return render_json("Session %s not found" % session_id, 404)
 
 
+@api.route('/session/<int:session_id>/steps')
+def get_session_steps(session_id):
+    """
+    Session steps with id in (cursor, before) range
+    """
+    try:
+        steps, next_cursor = helpers.get_log_steps_page(
+            session_id,
+            limit=_get_limit_arg(),
+            after_id=_get_int_arg('cursor'),
+            before_id=_get_int_arg('before')
+        )
+    except ValueError as e:
+        return render_json(str(e), 400)
+    return render_json_conditional({'steps': steps, 'next_cursor': next_cursor})
+
+
+@api.route('/session/<int:session_id>/step/<int:log_step_id>')
+def get_session_step(session_id, log_step_id):
+    log_step = helpers.get_log_step(session_id, log_step_id)
+    if log_step:
+        return render_json_conditional(log_step)
+    else:
+        return render_json("Step %s of session %s not found" % (log_step_id, session_id), 404)
+
+
 @api.route('/session/<string:session_id>/stop', methods=['GET'])
 def stop_session(session_id):
     _session = helpers.get_session(session_id)
@@ -1,5 +1,6 @@
 # coding: utf-8
 
+import hashlib
 from flask import current_app
 from core.exceptions import SessionException
 
@@ -28,10 +29,47 @@ def get_cached_sessions():
     return current_app.sessions._cache.to_json()
 
 
+def get_sessions_cache_stats():
+    return current_app.sessions._cache.stats()
+
+
 def get_sessions():
     return [session.info for session in current_app.sessions.active()]
 
 
+def get_sessions_page(limit=None, after_id=None, **filters):
+    """
+    :param limit: page size, all sessions are returned if None
+    :return: sessions info, cursor of the next page (None if it's the last page) and weak ETag of page
+    """
+    if limit is None:
+        sessions = current_app.database.get_sessions_page(after_id=after_id, limit=None, **filters)
+        next_cursor = None
+    else:
+        sessions = current_app.database.get_sessions_page(after_id=after_id, limit=limit + 1, **filters)
+        next_cursor = sessions[limit - 1].id if len(sessions) > limit else None
+        sessions = sessions[:limit]
+    info = [session.info for session in sessions]
+    return info, next_cursor, sessions_etag(sessions, info, next_cursor)
+
+
+def sessions_etag(sessions, info, next_cursor=None):
+    """
+    Weak ETag of sessions page covers every field of sessions info but duration and inactivity,
+    which change every second, created and modified times they are counted from are covered instead
+    """
+    state = [
+        (sorted((key, value) for key, value in session_info.items() if key not in ('duration', 'inactivity')),
+         str(session.created), str(session.modified))
+        for session, session_info in zip(sessions, info)
+    ]
+    return hashlib.sha1(repr((state, next_cursor))).hexdigest()
+
+
+def get_active_sessions_counters():
+    return current_app.sessions.active_counters.to_json()
+
+
 def get_queue():
     return [session.info for session in current_app.sessions.waiting()]
 
@@ -47,40 +85,47 @@ def regenerate_user_token(user_id):
     return None
 
 
-def get_screenshots(session_id, log_step_id=None):
-    screenshots = []
+def get_log_steps_page(session_id, limit, after_id=None, before_id=None):
+    steps = current_app.database.get_log_steps_page(
+        session_id, after_id=after_id, before_id=before_id, limit=limit + 1
+    )
+    next_cursor = steps[limit - 1].id if len(steps) > limit else None
+    return [step.info for step in steps[:limit]], next_cursor
 
-    if log_step_id:
-        steps = [current_app.database.get_step_by_id(log_step_id)]
-    else:
-        steps = current_app.database.get_log_steps_for_session(session_id)
 
-    for log_step in steps:
-        if log_step.screenshot:
-            screenshots.append(log_step.screenshot)
+def get_log_step(session_id, log_step_id):
+    """
+    :return: step info with body and sub steps or None
+    """
+    log_step = current_app.database.get_step_by_id(log_step_id)
+    if not log_step or log_step.session_id != session_id:
+        return None
 
-    return sorted(screenshots)
+    info = log_step.info
+    info["body"] = log_step.body
+    info["sub_steps"] = [
+        {"id": sub_step.id, "control_line": sub_step.control_line, "body": sub_step.body}
+        for sub_step in current_app.database.get_sub_steps(log_step_id)
+    ]
+    return info
 
 
-def get_screenshots_for_label(session_id, label_id):
-    steps_groups = {}
-    current_label = 0
-    log_steps = current_app.database.get_log_steps_for_session(session_id)
+def get_screenshots(session_id, log_step_id=None):
+    if log_step_id:
+        log_step = current_app.database.get_step_by_id(log_step_id)
+        return [log_step.screenshot] if log_step and log_step.screenshot else []
 
-    for step in reversed(log_steps):
-        if label_step(step.control_line) == 'label':
-            current_label = step.id
+    return current_app.database.get_screenshots(session_id)
 
-        if not steps_groups.get(current_label, None):
-            steps_groups[current_label] = []
 
-        if step.screenshot:
-            steps_groups[current_label].append(step.screenshot)
+def get_screenshots_for_label(session_id, label_id):
+    if label_id:
+        log_step = current_app.database.get_step_by_id(label_id)
+        if not log_step or log_step.session_id != session_id or label_step(log_step.control_line) != 'label':
+            return []
 
-    try:
-        return steps_groups[label_id]
-    except KeyError:
-        return []
+    next_label_id = current_app.database.get_next_label_step_id(session_id, after_id=label_id)
+    return current_app.database.get_screenshots(session_id, from_id=label_id, to_id=next_label_id)
 
 
 def label_step(string):
@@ -2,7 +2,6 @@
 
 import logging
 import threading
-from collections import deque
 
 from flask import Flask
 
@@ -16,26 +15,34 @@ class Vmmaster(Flask):
     balance_lock = threading.Lock()
 
     def __init__(self, *args, **kwargs):
-        from core.db import Database, DatabaseQueueWorker
+        from core.db import Database, DatabaseQueueWorker, DatabaseTaskQueue
         from core.sessions import Sessions
+        from core.screenshots import ScreenshotsPool
+        from vmmaster.matcher import PlatformsIndex
 
         super(Vmmaster, self).__init__(*args, **kwargs)
         self.running = True
         self.json_encoder = JSONEncoder
 
         self.database = Database()
-        self.database_task_queue = deque()
-        self.database_task_worker = DatabaseQueueWorker(self.database_task_queue)
+        self.database_task_queue = DatabaseTaskQueue()
+        self.database_task_worker = DatabaseQueueWorker(self.database_task_queue, self.database)
         self.database_task_worker.start()
 
         self.sessions = Sessions(self.database, self.app_context)
         self.sessions.start_workers()
 
+        self.screenshots = ScreenshotsPool(self.app_context)
+        self.screenshots.start()
+
+        self.platforms_index = PlatformsIndex()
+
     def cleanup(self):
         log.info("Cleanup...")
         try:
-            self.database_task_worker.stop()
             self.sessions.stop_workers()
+            self.screenshots.stop()
+            self.database_task_worker.stop()
             log.info("Cleanup done")
         except:
             log.exception("Cleanup was finished with errors")
@@ -47,25 +54,22 @@ class Vmmaster(Flask):
     def stop(self):
         self.running = False
 
-    def get_matched_platforms(self, dc):
-        from vmmaster.matcher import SeleniumMatcher, PlatformsBasedMatcher
-        providers_platforms, limits = {}, {}
+    def refresh_platforms_index(self):
+        fingerprint = self.database.get_platforms_fingerprint()
+        if fingerprint != self.platforms_index.fingerprint:
+            self.platforms_index.build(
+                [(provider, self.database.get_platforms(provider.id).keys()) for provider in self.providers],
+                fingerprint
+            )
 
+    def get_matched_platforms(self, dc):
         with self.balance_lock:
-            for provider in self.providers:
-                platforms = self.database.get_platforms(provider.id)
-                matcher = SeleniumMatcher(
-                    platforms=provider.config,
-                    fallback_matcher=PlatformsBasedMatcher(platforms)
-                )
-                matched_platforms = matcher.get_matched_platforms(dc)
-                if matched_platforms and provider.max_limit:
-                    providers_platforms[provider.id] = matched_platforms
-                    limits[provider.id] = provider.max_limit
-
+            self.refresh_platforms_index()
+            providers_platforms = self.platforms_index.get_matched_platforms(dc)
             if not providers_platforms:
                 return None, None
 
+            limits = {provider_id: self.platforms_index.limits[provider_id] for provider_id in providers_platforms}
             provider_id = self.get_provider_id(limits)
             if provider_id:
                 return providers_platforms[provider_id][0], provider_id
@@ -76,8 +80,7 @@ class Vmmaster(Flask):
         availables = {}
 
         for provider_id, limit in limits.items():
-            sessions = self.sessions.active(provider_id=provider_id)
-            availables[provider_id] = limit - len(sessions)
+            availables[provider_id] = limit - self.sessions.active_count(provider_id)
 
         if availables:
             max_value = max(availables.values())
@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import time
+import logging
+
+from sqlalchemy import func, bindparam
+
+from core.db.models import SessionLogStep, SessionLogSubStep, encode_step_body, step_body_min_encoded_length
+from vmmaster.cleanup import transaction, get_batch_size
+
+log = logging.getLogger(__name__)
+
+
+@transaction
+def encode_bodies_batch(model, after_id, limit, min_length, dbsession=None):
+    """
+    Store plain bodies of batch of steps or sub steps as encode_step_body does for new ones
+    :return: (id of the last processed row, count of rows) or None if there is nothing to process
+    """
+    if model is SessionLogStep:
+        query = dbsession.query(SessionLogStep.id, SessionLogStep._body, SessionLogStep.session_id)
+    else:
+        query = dbsession.query(SessionLogSubStep.id, SessionLogSubStep._body, SessionLogStep.session_id).join(
+            SessionLogStep, SessionLogSubStep.session_log_step_id == SessionLogStep.id
+        )
+    rows = query.filter(
+        model.id > after_id, model._body.isnot(None), func.length(model._body) >= min_length
+    ).order_by(model.id).limit(limit).all()
+    if not rows:
+        return None
+
+    values = []
+    for row_id, body, session_id in rows:
+        body, body_zlib, body_file = encode_step_body(body, session_id)
+        values.append({"row_id": row_id, "body": body, "body_zlib": body_zlib, "body_file": body_file})
+
+    table = model.__table__
+    dbsession.execute(
+        table.update().where(table.c.id == bindparam("row_id")).values(
+            body=bindparam("body"), body_zlib=bindparam("body_zlib"), body_file=bindparam("body_file")
+        ),
+        values
+    )
+    dbsession.commit()
+    return rows[-1][0], len(rows)
+
+
+def backfill_steps_bodies(batch_size=None):
+    """
+    Compress or spill to files bodies of steps and sub steps stored before
+    STEP_BODY_COMPRESS_THRESHOLD or STEP_BODY_SPILL_THRESHOLD were set
+    :return: count of processed rows
+    """
+    min_length = step_body_min_encoded_length()
+    if not min_length:
+        log.info("Step bodies compression and spilling are disabled, nothing to backfill")
+        return 0
+
+    batch_size = batch_size or get_batch_size()
+    start, processed = time.time(), 0
+    for model in (SessionLogStep, SessionLogSubStep):
+        after_id = 0
+        while True:
+            batch = encode_bodies_batch(model, after_id, batch_size, min_length)
+            if batch is None:
+                break
+            after_id, count = batch
+            processed += count
+            log.info("%s: bodies encoded up to id %s (%.1fs)" % (model.__tablename__, after_id, time.time() - start))
+
+    log.info("Step bodies backfill done in %.1fs, %s bodies encoded" % (time.time() - start, processed))
+    return processed
@@ -1,21 +1,30 @@
 # coding: utf-8
 
 import os
+import json
+import time
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, or_
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import ArgumentError
 
+from core import constants
 from core.config import config, setup_config
-from core.db.models import Session, User, Endpoint
+from core.db.models import Session, SessionLogStep, SessionLogSubStep, User, Endpoint, step_bodies_dir
+from core.db import partitions
 from core.utils import change_user_vmmaster
 from core.utils.init import home_dir
 
 from shutil import rmtree
 from errno import ENOENT
 
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
 setup_config('%s/config.py' % home_dir())
 log = logging.getLogger(__name__)
 
@@ -36,84 +45,411 @@ def transaction(func):
     return wrapper
 
 
+def get_batch_size():
+    return getattr(config, "CLEANUP_BATCH_SIZE", constants.CLEANUP_BATCH_SIZE)
+
+
+def get_checkpoint_file():
+    return getattr(config, "CLEANUP_CHECKPOINT_FILE", None) or os.path.join(config.BASEDIR, "cleanup_checkpoint.json")
+
+
+def load_checkpoint():
+    """
+    :return: {"user_id": ..., "cutoff_id": ..., "after_id": ...} of interrupted run or empty dict
+    """
+    try:
+        with open(get_checkpoint_file()) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_checkpoint(user_id, cutoff_id, after_id):
+    checkpoint_file = get_checkpoint_file()
+    with open("%s.tmp" % checkpoint_file, "w") as f:
+        json.dump({"user_id": user_id, "cutoff_id": cutoff_id, "after_id": after_id}, f)
+    os.rename("%s.tmp" % checkpoint_file, checkpoint_file)
+
+
+def clear_checkpoint():
+    try:
+        os.remove(get_checkpoint_file())
+    except OSError as os_error:
+        if os_error.errno != ENOENT:
+            raise
+
+
+def delete_dir(path):
+    try:
+        rmtree(path)
+        log.debug("Successful deleted dir %s" % path)
+    except OSError as os_error:
+        # Ignore 'No such file or directory' error
+        if os_error.errno != ENOENT:
+            log.info('Unable to delete %s (%s)' %
+                     (str(path), os_error.strerror))
+
+
 def delete_files(session_id=None):
     if session_id:
-        session_dir = os.path.join(config.SCREENSHOTS_DIR, str(session_id))
-        try:
-            rmtree(session_dir)
-            log.debug("Successful deleted dir %s" % session_dir)
-        except OSError as os_error:
-            # Ignore 'No such file or directory' error
-            if os_error.errno != ENOENT:
-                log.info('Unable to delete %s (%s)' %
-                         (str(session_dir), os_error.strerror))
+        delete_dir(os.path.join(config.SCREENSHOTS_DIR, str(session_id)))
+        delete_dir(step_bodies_dir(session_id))
 
 
 @transaction
-def delete(session_id, dbsession=None):
-    obj_to_delete = dbsession.query(Session).get(session_id)
-    dbsession.delete(obj_to_delete)
+def delete_sessions(session_ids, dbsession=None):
+    """
+    Delete sessions with their steps and sub steps in one transaction
+    """
+    steps_ids = select([SessionLogStep.id]).where(SessionLogStep.session_id.in_(session_ids))
+    dbsession.execute(
+        SessionLogSubStep.__table__.delete().where(SessionLogSubStep.session_log_step_id.in_(steps_ids))
+    )
+    dbsession.execute(SessionLogStep.__table__.delete().where(SessionLogStep.session_id.in_(session_ids)))
+    dbsession.execute(Session.__table__.delete().where(Session.id.in_(session_ids)))
     dbsession.commit()
-    log.debug("Successful deleted session %s from db" % obj_to_delete.id)
+    log.debug("Successful deleted sessions %s..%s from db" % (session_ids[0], session_ids[-1]))
 
 
 def delete_session_data(sessions=None):
-    sessions_count = len(sessions)
-
-    log.info("Got %s sessions. " % str(sessions_count))
-    if sessions_count:
-        checkpoint = datetime.now()
-        time_step = timedelta(days=0, seconds=10)
-
-        log.info("Done: %s%% (0 / %d)" % ('0.0'.rjust(5), sessions_count))
-        for num, session in enumerate(sessions):
-            delta = datetime.now() - checkpoint
-            if delta > time_step or num == sessions_count - 1:
-                percentage = str(
-                    round((num + 1)/float(sessions_count) * 100, 1))
-                log.info("Done: %s%% (%d / %d)" %
-                         (percentage.rjust(5), num + 1, sessions_count))
-                checkpoint = datetime.now()
-            delete_files(session.id)
-            delete(session.id)
-        log.info(
-            "%s sessions have been deleted.\n" % (str(sessions_count)))
-    else:
-        log.info("Nothing to delete.\n")
+    session_ids = sorted(session.id for session in sessions)
+    batch_size = get_batch_size()
+    pool = ThreadPool(getattr(config, "CLEANUP_RMTREE_THREADS", constants.CLEANUP_RMTREE_THREADS))
+    try:
+        for start in range(0, len(session_ids), batch_size):
+            batch = session_ids[start:start + batch_size]
+            delete_sessions(batch)
+            pool.map(delete_files, batch)
+    finally:
+        pool.close()
+        pool.join()
+    log.info("%s sessions have been deleted." % len(session_ids))
 
 
 @transaction
-def get_users(dbsession=None):
-    return dbsession.query(User).all()
+def get_users_limits(from_user_id=None, dbsession=None):
+    """
+    :return: list of (user id, max stored sessions) ordered by user id
+    """
+    query = dbsession.query(User.id, User.max_stored_sessions)
+    if from_user_id:
+        query = query.filter(User.id >= from_user_id)
+    return query.order_by(User.id).all()
+
+
+def _overflow_query(dbsession, user_id):
+    return dbsession.query(Session.id).filter_by(user_id=user_id, keep_forever=False)
+
+
+@transaction
+def overflow_cutoff_id(user_id, max_stored_sessions, dbsession=None):
+    """
+    :return: id of the newest session of user to delete or None
+    """
+    current_sessions = _overflow_query(dbsession, user_id).count()
+    if current_sessions <= max_stored_sessions:
+        return None
+
+    overflow = current_sessions - max_stored_sessions
+    return _overflow_query(dbsession, user_id).order_by(Session.id).offset(overflow - 1).limit(1).scalar()
+
+
+@transaction
+def overflow_sessions_ids(user_id, cutoff_id, after_id=None, limit=None, dbsession=None):
+    query = _overflow_query(dbsession, user_id).filter(Session.id <= cutoff_id)
+    if after_id:
+        query = query.filter(Session.id > after_id)
+    return [session_id for session_id, in query.order_by(Session.id).limit(limit or get_batch_size())]
 
 
 @transaction
 def sessions_overflow(user, dbsession=None):
-    res = []
-    current_sessions = dbsession.query(Session).\
-        filter_by(user_id=user.id, keep_forever=False).count()
+    cutoff_id = overflow_cutoff_id(user.id, user.max_stored_sessions)
+    if cutoff_id is None:
+        return []
+    return _overflow_query(dbsession, user.id).filter(Session.id <= cutoff_id).order_by(Session.id).all()
+
+
+def delete_sessions_overflow(batch_size=None, sleep=None, max_duration=None):
+    """
+    Delete overflow sessions of every user by batches of ids, every batch is
+    one transaction and screenshots of the batch are removed in parallel
+    while the next batch is deleted from db.
+    The last deleted id is saved to checkpoint file, so interrupted or
+    stopped by max_duration run continues from it.
+
+    :return: count of deleted sessions
+    """
+    batch_size = batch_size or get_batch_size()
+    sleep = getattr(config, "CLEANUP_BATCH_SLEEP", constants.CLEANUP_BATCH_SLEEP) if sleep is None else sleep
+    if max_duration is None:
+        max_duration = getattr(config, "CLEANUP_MAX_DURATION", constants.CLEANUP_MAX_DURATION)
+
+    start = time.time()
+    checkpoint = load_checkpoint()
+    if checkpoint:
+        log.info("Resuming cleanup from %s" % checkpoint)
+
+    deleted, files_deletion = 0, None
+    pool = ThreadPool(getattr(config, "CLEANUP_RMTREE_THREADS", constants.CLEANUP_RMTREE_THREADS))
+    try:
+        for user_id, max_stored_sessions in get_users_limits(from_user_id=checkpoint.get("user_id")):
+            if user_id == checkpoint.get("user_id"):
+                cutoff_id, after_id = checkpoint["cutoff_id"], checkpoint["after_id"]
+            else:
+                cutoff_id, after_id = overflow_cutoff_id(user_id, max_stored_sessions), None
+            if cutoff_id is None:
+                continue
 
-    if current_sessions > user.max_stored_sessions:
-        overflow = current_sessions - user.max_stored_sessions
+            while True:
+                session_ids = overflow_sessions_ids(user_id, cutoff_id, after_id=after_id, limit=batch_size)
+                if not session_ids:
+                    break
+
+                delete_sessions(session_ids)
+                if files_deletion:
+                    files_deletion.wait()
+                files_deletion = pool.map_async(delete_files, session_ids)
+
+                after_id = session_ids[-1]
+                deleted += len(session_ids)
+                save_checkpoint(user_id, cutoff_id, after_id)
+                log.info("Deleted %d sessions, user %s, last session id %s (%.1fs)" % (
+                    deleted, user_id, after_id, time.time() - start)
+                )
+
+                if max_duration and time.time() - start > max_duration:
+                    log.info("Cleanup stopped after %ss, it will be resumed on next run" % max_duration)
+                    return deleted
+                if sleep:
+                    time.sleep(sleep)
+
+        clear_checkpoint()
+    finally:
+        pool.close()
+        pool.join()
+
+    log.info("%s sessions have been deleted in %.1fs." % (deleted, time.time() - start))
+    return deleted
+
+
+def dir_usage(path):
+    """
+    :return: (size in bytes, latest modification time) of files in directory tree
+    """
+    size, mtime = 0, 0
+    dirs = [path]
+    while dirs:
         try:
-            res = dbsession.query(Session).\
-                filter_by(user_id=user.id, keep_forever=False).order_by(Session.id).\
-                limit(overflow).all()
-        except ArgumentError:
-            log.exception("Error during getting sessions ids from db")
+            entries = list(scandir(dirs.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    stat = entry.stat(follow_symlinks=False)
+                    size += stat.st_size
+                    mtime = max(mtime, stat.st_mtime)
+            except OSError:
+                continue
+    return size, mtime
+
+
+def _session_dir_usage(entry):
+    size, mtime = dir_usage(entry.path)
+    return max(mtime, entry.stat(follow_symlinks=False).st_mtime), size, entry.name, entry.path
 
-    return res
 
+def scan_screenshots_dir(pool):
+    """
+    :return: list of (latest modification time, size in bytes, session id, path) of session directories,
+        they are named by session id, other entries are skipped
+    """
+    try:
+        entries = [
+            entry for entry in scandir(config.SCREENSHOTS_DIR)
+            if entry.name.isdigit() and entry.is_dir(follow_symlinks=False)
+        ]
+    except OSError as os_error:
+        if os_error.errno != ENOENT:
+            raise
+        return []
+    return pool.map(_session_dir_usage, entries)
+
+
+@transaction
+def protected_sessions_ids(dbsession=None):
+    """
+    :return: ids of keep forever and active sessions, their files are never reaped
+    """
+    return {
+        str(session_id) for session_id, in
+        dbsession.query(Session.id).filter(or_(Session.keep_forever.is_(True), Session.closed.is_(False)))
+    }
+
+
+def reap_screenshots(budget=None):
+    """
+    Delete directories of sessions from SCREENSHOTS_DIR, least recently
+    modified first, until total size is under budget in bytes.
+    Nothing is deleted if budget is 0 (disabled)
+
+    :return: report with used and reclaimed bytes, deleted directories and elapsed seconds,
+        None if budget is disabled
+    """
+    if budget is None:
+        budget = getattr(config, "SCREENSHOTS_DIR_BUDGET", constants.SCREENSHOTS_DIR_BUDGET)
+    if not budget:
+        log.info("Screenshots reaper is disabled: budget isn't set")
+        return None
+
+    start = time.time()
+    reclaimed, to_delete = 0, []
+    pool = ThreadPool(getattr(config, "CLEANUP_RMTREE_THREADS", constants.CLEANUP_RMTREE_THREADS))
+    try:
+        usage = scan_screenshots_dir(pool)
+        used = sum(size for _, size, _, _ in usage)
+        if used > budget:
+            protected = protected_sessions_ids()
+            for _, size, session_id, path in sorted(usage):
+                if used - reclaimed <= budget:
+                    break
+                if session_id in protected:
+                    continue
+                to_delete.append(path)
+                reclaimed += size
+            pool.map(delete_dir, to_delete)
+    finally:
+        pool.close()
+        pool.join()
+
+    report = {
+        "used_bytes": used,
+        "reclaimed_bytes": reclaimed,
+        "deleted_dirs": len(to_delete),
+        "elapsed": round(time.time() - start, 3)
+    }
+    log.info("Screenshots reaper: %s" % report)
+    return report
+
+
+# rows of keep forever and active sessions are moved out of dropped partitions
+PROTECTED_SESSIONS_SQL = "SELECT id FROM sessions WHERE keep_forever IS true OR closed IS false"
+PROTECTED_ROWS_SQL = {
+    "session_log_steps": "session_id IN (%s)" % PROTECTED_SESSIONS_SQL,
+    "sub_steps": "session_log_step_id IN (SELECT id FROM session_log_steps WHERE session_id IN (%s))" % (
+        PROTECTED_SESSIONS_SQL
+    )
+}
+
+
+def get_partitions_ahead():
+    return getattr(config, "STEPS_PARTITIONS_AHEAD", constants.STEPS_PARTITIONS_AHEAD)
+
+
+def steps_partitioned():
+    with engine.connect() as connection:
+        return all(partitions.is_partitioned(connection, table) for table in partitions.STEPS_TABLES)
+
+
+def partition_steps():
+    with engine.begin() as connection:
+        partitions.partition_steps_tables(connection, get_partitions_ahead())
+
+
+def unpartition_steps():
+    with engine.begin() as connection:
+        partitions.unpartition_steps_tables(connection)
+
+
+def ensure_steps_partitions():
+    if steps_partitioned():
+        with engine.begin() as connection:
+            partitions.ensure_month_partitions(connection, get_partitions_ahead())
+
+
+def drop_old_steps_partitions(cutoff):
+    """
+    Drop partitions of months before cutoff, every partition in own transaction
+
+    :return: count of dropped partitions
+    """
+    dropped = 0
+    for table in partitions.STEPS_TABLES:
+        with engine.connect() as connection:
+            old_partitions = [
+                name for month, name in partitions.month_partitions(connection, table)
+                if partitions.add_months(month, 1) <= cutoff
+            ]
+        for name in old_partitions:
+            with engine.begin() as connection:
+                partitions.drop_month_partition(connection, table, name, keep=PROTECTED_ROWS_SQL[table])
+            dropped += 1
+    return dropped
+
+
+@transaction
+def old_steps_batch(cutoff, after_id, limit, dbsession=None):
+    return dbsession.query(SessionLogStep.id, SessionLogStep.session_id).filter(
+        SessionLogStep.id > after_id, or_(SessionLogStep.created.is_(None), SessionLogStep.created < cutoff)
+    ).order_by(SessionLogStep.id).limit(limit).all()
+
+
+@transaction
+def delete_steps(steps_ids, dbsession=None):
+    dbsession.execute(
+        SessionLogSubStep.__table__.delete().where(SessionLogSubStep.session_log_step_id.in_(steps_ids))
+    )
+    dbsession.execute(SessionLogStep.__table__.delete().where(SessionLogStep.id.in_(steps_ids)))
+    dbsession.commit()
+
+
+def delete_old_steps_by_batches(cutoff, batch_size):
+    """
+    Walk steps created before cutoff by id and delete them with sub steps by batches
+
+    :return: count of deleted steps
+    """
+    protected = {int(session_id) for session_id in protected_sessions_ids()}
+    deleted, after_id = 0, 0
+    while True:
+        steps = old_steps_batch(cutoff, after_id, batch_size)
+        if not steps:
+            break
+        steps_ids = [step.id for step in steps if step.session_id not in protected]
+        if steps_ids:
+            delete_steps(steps_ids)
+            deleted += len(steps_ids)
+            log.info("Deleted %d old steps, last step id %s" % (deleted, steps_ids[-1]))
+        after_id = steps[-1].id
+    return deleted
+
+
+def delete_old_steps(months=None, batch_size=None):
+    """
+    Delete steps and sub steps created before the first day of month
+    STEPS_RETENTION_MONTHS ago, steps of keep forever and active sessions are kept.
+    Whole partitions are dropped if steps tables are partitioned, rows are deleted
+    by batches otherwise.
+
+    :return: report with dropped partitions, deleted steps and elapsed seconds
+    """
+    if months is None:
+        months = getattr(config, "STEPS_RETENTION_MONTHS", constants.STEPS_RETENTION_MONTHS)
+    cutoff = partitions.add_months(partitions.month_start(datetime.now()), -months)
+
+    start = time.time()
+    report = {"dropped_partitions": 0, "deleted_steps": 0}
+    if steps_partitioned():
+        report["dropped_partitions"] = drop_old_steps_partitions(cutoff)
+    else:
+        report["deleted_steps"] = delete_old_steps_by_batches(cutoff, batch_size or get_batch_size())
+    report["elapsed"] = round(time.time() - start, 3)
 
-def sessions_to_delete():
-    sessions = []
-    for user in get_users():
-        to_delete = sessions_overflow(user)
-        if to_delete:
-            log.debug(
-                "%s sessions found for %s" % (len(to_delete), user.username))
-            sessions += to_delete
-    return sessions
+    log.info("Steps created before %s deleted: %s" % (cutoff.date(), report))
+    return report
 
 
 @transaction
@@ -123,17 +459,24 @@ def endpoints_to_delete(dbsession=None):
 
 @transaction
 def delete_endpoints(dbsession=None):
-    endpoints = endpoints_to_delete()
-    log.info('Got {} endpoints to delete'.format(len(endpoints)))
-    for endpoint in endpoints:
-        log.info('Deleting endpoint {}'.format(endpoint.id))
-        dbsession.delete(endpoint)
+    endpoints_ids = [endpoint.id for endpoint in endpoints_to_delete()]
+    log.info('Got {} endpoints to delete'.format(len(endpoints_ids)))
+    batch_size = get_batch_size()
+    for start in range(0, len(endpoints_ids), batch_size):
+        batch = endpoints_ids[start:start + batch_size]
+        dbsession.query(Endpoint).filter(Endpoint.id.in_(batch)).delete(synchronize_session=False)
         dbsession.commit()
+        log.info('Deleted endpoints {}..{}'.format(batch[0], batch[-1]))
 
 
 def run():
     log.info('Running cleanup...')
     change_user_vmmaster()
 
-    delete_session_data(sessions_to_delete())
+    delete_sessions_overflow()
     delete_endpoints()
+    if getattr(config, "SCREENSHOTS_DIR_BUDGET", constants.SCREENSHOTS_DIR_BUDGET):
+        reap_screenshots()
+    ensure_steps_partitions()
+    if getattr(config, "STEPS_RETENTION_MONTHS", constants.STEPS_RETENTION_MONTHS):
+        delete_old_steps()
@@ -1,8 +1,33 @@
-from twisted.internet import reactor, protocol
+# coding: utf-8
+
+import logging
+from datetime import datetime
+from StringIO import StringIO
+from traceback import format_exc
+
+from twisted.internet import reactor, protocol, task
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.internet.threads import deferToThread
 from twisted.web.resource import Resource
-from twisted.web.http import HTTPChannel, HTTPClient, Request
+from twisted.web.http import HTTPChannel, HTTPClient, Request, PotentialDataLoss
+from twisted.web.http_headers import Headers
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, ResponseDone
 from twisted.web.server import NOT_DONE_YET
 
+from core import constants, utils
+from core.utils import network_utils
+from core.config import config
+from core.exceptions import SessionException, ConnectionError, TimeoutException, RequestTimeoutException
+from core.profiler import profiler
+from vmmaster.webdriver import commands, helpers
+
+log = logging.getLogger(__name__)
+
+HOP_BY_HOP_HEADERS = (
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length'
+)
+
 
 class HTTPChannelWithClient(HTTPChannel):
     requestFactory = Request
@@ -122,3 +147,253 @@ class ProxyResource(Resource):
         except Exception as e:
             request.setResponseCode(500)
             return e.message
+
+
+class BodyReader(protocol.Protocol):
+    def __init__(self, finished):
+        self.finished = finished
+        self.data = []
+
+    def dataReceived(self, data):
+        self.data.append(data)
+
+    def connectionLost(self, reason):
+        if self.finished.called:
+            return
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback("".join(self.data))
+        else:
+            self.finished.errback(reason)
+
+
+def read_body(response):
+    def cancel(_):
+        reader.transport.stopProducing()
+
+    d = Deferred(cancel)
+    reader = BodyReader(d)
+    response.deliverBody(reader)
+    return d
+
+
+class CommandWatcher(object):
+    """
+    Cancels request to endpoint if client has disconnected,
+    session was closed or request was timed out
+    """
+    def __init__(self, request, session, interval=0.5):
+        self.session = session
+        self.reason = None
+        self._pending = None
+        request.notifyFinish().addErrback(
+            lambda _: self.cancel(ConnectionError("Client has disconnected"))
+        )
+        self._loop = task.LoopingCall(self._check_session)
+        self._loop.start(interval, now=False)
+
+    def _check_session(self):
+        if self.session.timeouted:
+            self.cancel(TimeoutException("Session %s timeout (%s)" % (self.session.id, self.session.reason)))
+        elif self.session.closed:
+            self.cancel(SessionException("Session %s closed (%s)" % (self.session.id, self.session.reason)))
+
+    def cancel(self, reason):
+        if not self.reason:
+            self.reason = reason
+        if self._pending:
+            self._pending.cancel()
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def watch(self, d, timeout=None):
+        if self.reason:
+            d.cancel()
+            raise self.reason
+
+        timeout_call = reactor.callLater(timeout, d.cancel) if timeout else None
+        self._pending = d
+
+        def done(result):
+            self._pending = None
+            if self.reason:
+                raise self.reason
+            if timeout_call:
+                if not timeout_call.active():
+                    raise RequestTimeoutException("No response in %s sec. Original: %s" % (timeout, result))
+                timeout_call.cancel()
+            return result
+
+        return d.addBoth(done)
+
+
+class WebDriverProxyResource(Resource):
+    """
+    Serves proxy_request, get_session and delete_session without holding
+    a thread while endpoint is processing command, other requests are passed to fallback resource
+    """
+    isLeaf = True
+
+    def __init__(self, app, fallback_resource):
+        Resource.__init__(self)
+        self.app = app
+        self.fallback_resource = fallback_resource
+        self.agent = Agent(reactor, pool=HTTPConnectionPool(reactor, persistent=True))
+
+    @staticmethod
+    def get_session_id(request):
+        """
+        Parse <session_id> from /wd/hub/session/<session_id>[/<command>], vmmaster commands are not served
+        """
+        parts = request.postpath
+        if len(parts) < 3 or parts[:2] != ["hub", "session"] or not parts[-1]:
+            return None
+        if len(parts) == 3 and request.method not in ("GET", "DELETE"):
+            return None
+        if len(parts) > 3 and (parts[3] == "vmmaster" or request.method not in ("GET", "POST", "DELETE")):
+            return None
+        return commands.get_session_id(request.path)
+
+    def render(self, request):
+        session_id = self.get_session_id(request)
+        if not session_id:
+            request.postpath.insert(0, request.prepath.pop())
+            return self.fallback_resource.render(request)
+
+        self.process(request, session_id)
+        return NOT_DONE_YET
+
+    def _call_in_thread(self, func, *args, **kwargs):
+        def call():
+            with self.app.app_context():
+                return func(*args, **kwargs)
+        return deferToThread(call)
+
+    def _find_session(self, session_id):
+        try:
+            return self.app.sessions.get_session(session_id, maybe_closed=True)
+        except SessionException:
+            return None
+
+    @inlineCallbacks
+    def process(self, request, session_id):
+        started = datetime.now()
+        body = request.content.read()
+        is_command = len(request.postpath) > 3
+        session, active_session, watcher, redacted_body = None, None, None, None
+
+        try:
+            session = yield self._call_in_thread(self._find_session, session_id)
+            if session:
+                with self.app.app_context():
+                    session.stop_timer()
+                yield self._call_in_thread(
+                    session.add_session_step,
+                    control_line="%s %s %s" % (request.method, request.path, request.clientproto),
+                    body=str(body), created=started
+                )
+
+            if session and not session.closed:
+                active_session = session
+            else:
+                active_session = yield self._call_in_thread(self.app.sessions.get_session, session_id)
+
+            watcher = CommandWatcher(request, active_session)
+            timer = profiler.requests_duration_manual(helpers.get_webdriver_command(request.path)) \
+                if is_command else None
+            status, headers, response_body = yield self.transparent(request, active_session, body, watcher)
+            if timer:
+                timer.end()
+
+            if request.method == "DELETE" and not is_command:
+                yield self._call_in_thread(active_session.succeed)
+            elif is_command:
+                redacted_body = yield self._call_in_thread(
+                    helpers.take_screenshot_after_command, active_session, request.path, status, response_body
+                )
+        except Exception as e:
+            tb = format_exc()
+            log.exception(e)
+            redacted_body = None
+            if active_session:
+                yield self._call_in_thread(active_session.failed, tb=tb, reason=e)
+            status, headers, response_body = 500, None, "%s %s" % (e, tb)
+        finally:
+            if watcher:
+                watcher.stop()
+
+        status, headers, response_body = helpers.prepare_response(status, headers, response_body)
+        if session:
+            try:
+                yield self._call_in_thread(
+                    session.add_session_step,
+                    control_line=status, body=redacted_body or utils.remove_base64_screenshot(response_body),
+                    created=datetime.now()
+                )
+            except Exception:
+                log.exception("Response step of session {} wasn't logged".format(session.id))
+            if not session.closed:
+                with self.app.app_context():
+                    session.start_timer()
+
+        self.write_response(request, status, headers, response_body)
+
+    @inlineCallbacks
+    def transparent(self, request, session, body, watcher):
+        log.debug('Swap session_id={} and selenium_session={}'.format(session.id, session.selenium_session))
+        url = "http://%s:%s%s" % (
+            session.endpoint.ip, session.endpoint.selenium_port,
+            commands.set_path_session_id(request.path, session.selenium_session)
+        )
+        headers = Headers({
+            name: [value] for name, value in request.getAllHeaders().items()
+            if value and name.lower() not in HOP_BY_HOP_HEADERS
+        })
+        body = commands.set_body_session_id(body, session.selenium_session)
+
+        try:
+            status, headers, body = yield self.make_request(request.method, url, headers, body, watcher)
+        except RequestTimeoutException:
+            status, headers, body = yield self._call_in_thread(
+                helpers.endpoint_timeout_response, session, format_exc()
+            )
+
+        returnValue((status, headers, body))
+
+    @inlineCallbacks
+    def make_request(self, method, url, headers, body, watcher):
+        timeout = getattr(config, "REQUEST_TIMEOUT", constants.REQUEST_TIMEOUT)
+        attempts = network_utils.get_request_attempts()
+
+        for attempt in range(1, attempts + 1):
+            log.info("Attempt {}. Making request {} with timeout {} sec.".format(attempt, url, timeout))
+            try:
+                response = yield watcher.watch(self.agent.request(
+                    method, url, headers, FileBodyProducer(StringIO(body)) if body else None
+                ), timeout)
+                response_body = yield watcher.watch(read_body(response), timeout)
+            except (ConnectionError, TimeoutException, SessionException):
+                raise
+            except Exception as e:
+                sleep_time = network_utils.request_attempt_failed(url, timeout, e, attempt, attempts)
+                yield task.deferLater(reactor, sleep_time, lambda: None)
+            else:
+                returnValue((
+                    response.code,
+                    {name: values[-1] for name, values in response.headers.getAllRawHeaders()},
+                    response_body
+                ))
+
+    @staticmethod
+    def write_response(request, status, headers, body):
+        if request.finished or request._disconnected:
+            return
+
+        request.setResponseCode(status)
+        for name, value in headers.items():
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                request.setHeader(name, str(value))
+        request.setHeader("Content-Length", str(len(body)))
+        request.write(body)
+        request.finish()
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from collections import OrderedDict
+
 from core import constants
 
 log = logging.getLogger(__name__)
@@ -144,3 +146,106 @@ class SeleniumMatcher(IMatcher):
 
     def match(self, dc):
         return bool(self.get_matched_platforms(dc))
+
+
+class PlatformsIndex(object):
+    """
+    Matched platforms of all providers by desired (platform type, browser, version),
+    built from the same configuration SeleniumMatcher and PlatformsBasedMatcher use
+    """
+    def __init__(self):
+        self.fingerprint = None
+        self.limits = {}
+        self._configured = {}
+        self._matches = {}
+        self._fallback = {}
+
+    @staticmethod
+    def _browser_keys(platforms):
+        """
+        :param platforms: dict with platform names as a keys and lists of browsers as values
+               example: {'ubuntu-14': {'browsers': {'chrome': '52'}}}
+        :return: generator of ((browser, version), platform) in SeleniumMatcher matching order
+        """
+        for platform, details in platforms.items():
+            for browser, version in details.get('browsers', {}).items():
+                yield (constants.ANY, constants.ANY), platform
+                if browser == constants.ANY:
+                    continue
+
+                yield (browser, constants.ANY), platform
+                if version != constants.ANY:
+                    yield (browser, version), platform
+
+                major_version = version.split('.')[0] if isinstance(version, basestring) else version
+                if major_version != version:
+                    yield (browser, major_version), platform
+
+    def build(self, providers, fingerprint=None):
+        """
+        :param providers: list of (provider, platform names) of active providers
+        :param fingerprint: state of providers the index is built for
+        """
+        limits, configured, matches, fallback = {}, {}, {}, {}
+
+        for provider, platform_names in providers:
+            if not provider.max_limit:
+                continue
+            limits[provider.id] = provider.max_limit
+
+            platform_types = {k.upper(): v for k, v in provider.config.items()} if provider.config else {}
+            all_platforms = {}
+            for platform_type, platforms in platform_types.items():
+                all_platforms.update(platforms)
+            platform_types[constants.ANY] = all_platforms
+
+            for platform_type, platforms in platform_types.items():
+                if not platforms:
+                    continue
+                configured.setdefault(platform_type, set()).add(provider.id)
+                for key, platform in self._browser_keys(platforms):
+                    key = (platform_type,) + key
+                    provider_matches = matches.get(key)
+                    if provider_matches is None:
+                        provider_matches = matches[key] = OrderedDict()
+                    if provider.id in provider_matches:
+                        provider_matches[provider.id].append(platform)
+                    else:
+                        provider_matches[provider.id] = [platform]
+
+            platform_names = list(platform_names)
+            if platform_names:
+                fallback.setdefault(constants.ANY, OrderedDict())[provider.id] = platform_names
+            for name in platform_names:
+                fallback.setdefault(name, OrderedDict())[provider.id] = [name]
+
+        self.limits, self._configured, self._matches, self._fallback = limits, configured, matches, fallback
+        self.fingerprint = fingerprint
+        log.info("Platforms index built for {} providers".format(len(limits)))
+
+    def get_matched_platforms(self, dc):
+        """
+        :param dc: Desired Capabilities dictionary
+        :return: dict with provider ids as a keys and matched platforms lists as values
+        """
+        desired_platform_type = dc.get('platform', constants.ANY).upper()
+        configured = self._configured.get(desired_platform_type, set())
+        matched = OrderedDict()
+
+        desired_browser = dc.get('browserName')
+        if configured and desired_browser:
+            desired_version = dc.get('version') or constants.ANY  # escape empty version
+            if desired_browser == constants.ANY:
+                desired_version = constants.ANY
+            try:
+                matched.update(self._matches.get((desired_platform_type, desired_browser, desired_version), {}))
+            except TypeError:
+                log.warning('Unexpected browser or version in DesiredCapabilities={}. Cannot match'.format(dc))
+
+        fallback_platform = desired_platform_type if desired_platform_type == constants.ANY \
+            else desired_platform_type.lower()
+        for provider_id, platforms in self._fallback.get(fallback_platform, {}).items():
+            if provider_id not in configured:
+                matched[provider_id] = platforms
+
+        return matched
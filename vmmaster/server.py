@@ -11,7 +11,7 @@ from twisted.internet.threads import deferToThread
 from prometheus_client.twisted import MetricsResource
 
 from app import create_app
-from http_proxy import ProxyResource, HTTPChannelWithClient
+from http_proxy import ProxyResource, WebDriverProxyResource, HTTPChannelWithClient
 from core.config import config
 from core.utils import RootResource
 
@@ -32,6 +32,8 @@ class VMMasterServer(object):
 
         root_resource = RootResource(wsgi_resource)
         root_resource.putChild("proxy", ProxyResource(self.app))
+        if getattr(config, "WEBDRIVER_ASYNC_PROXY", False):
+            root_resource.putChild("wd", WebDriverProxyResource(self.app, wsgi_resource))
         root_resource.putChild("metrics", MetricsResource())
         site = Site(root_resource)
         site.protocol = HTTPChannelWithClient
@@ -63,8 +63,18 @@ def before_request():
         log_request(session, request, created=g.started)
 
 
+def redacted_response_body(response):
+    """
+    Body inspected while taking screenshot is reused, other bodies are inspected here
+    """
+    body, redacted = getattr(g, "inspected_response_body", (None, None))
+    if redacted is not None and body == response.data:
+        return redacted
+    return utils.remove_base64_screenshot(response.data)
+
+
 def log_response(session, response, created=None):
-    response_data = utils.remove_base64_screenshot(response.data)
+    response_data = redacted_response_body(response)
     session.add_session_step(control_line=response.status_code,
                              body=response_data, created=created)
 
@@ -120,18 +130,9 @@ def get_session(session_id):
 
 
 def take_screenshot(status, body):
-    if not request.session.take_screenshot:
-        return
-
-    words = ["url", "click", "execute", "keys", "value"]
-    only_screenshots = ["element", "execute_async"]
-    parts = request.path.split("/")
-    if set(words) & set(parts) or parts[-1] == "session":
-        utils.to_thread(
-            helpers.take_screenshot_from_session(request.session))
-    elif set(only_screenshots) & set(parts) and status == 500:
-        utils.to_thread(
-            helpers.take_screenshot_from_response(request.session, body))
+    redacted = helpers.take_screenshot_after_command(request.session, request.path, status, body)
+    if redacted is not None:
+        g.inspected_response_body = body, redacted
 
 
 @webdriver.route(
@@ -2,7 +2,7 @@
 
 import json
 import httplib
-from functools import partial, wraps
+from functools import wraps
 import websocket
 import logging
 
@@ -107,16 +107,15 @@ def ping_endpoint_before_start_session(session, ports):
     ip = check_to_exist_ip(session)
 
     log.info("Starting ping: {ip}:{ports}".format(ip=ip, ports=str(ports)))
-    _ping = partial(network_utils.ping, ip)
 
     def check():
-        return all(map(_ping, ports))
+        return all(network_utils.ping_ports(ip, ports).values())
     for _ in generator_wait_for(check, config.PING_TIMEOUT):
         yield False
 
-    result = map(_ping, ports)
-    if not all(result):
-        fails = [port for port, res in zip(ports, result) if res is False]
+    result = network_utils.ping_ports(ip, ports)
+    if not all(result.values()):
+        fails = [port for port, res in result.items() if res is False]
         raise CreationException("Failed to ping ports %s" % str(fails))
 
     if session.closed:
@@ -178,17 +177,16 @@ def selenium_status(request, session):
 
 # TODO: make a decorator
 def replace_platform_with_any(request):
-    body = json.loads(request.data)
-    desired_capabilities = body["desiredCapabilities"]
+    body = utils.get_request_json(request)
+    # copy, desired capabilities got before are kept unchanged
+    desired_capabilities = dict(body["desiredCapabilities"], platform=constants.ANY)
+    body = dict(body, desiredCapabilities=desired_capabilities)
 
-    desired_capabilities["platform"] = constants.ANY
-    body["desiredCapabilities"] = desired_capabilities
-
-    request.data = json.dumps(body)
+    utils.set_request_json(request, body)
 
 
 def get_desired_capabilities(request):
-    return utils.get_desired_capabilities(request.data)
+    return utils.get_request_json(request).get('desiredCapabilities', {})
 
 
 def get_session_id(path):
@@ -232,8 +230,8 @@ def take_screenshot(session):
         pass
 
     if status == httplib.OK and body:
-        json_response = json.loads(body)
-        return json_response.get("screenshot", None)
+        screenshot, _ = utils.inspect_response(body)
+        return screenshot
 
 
 @connection_watcher
@@ -285,8 +283,11 @@ def run_script_through_websocket(script, session, host):
     t.daemon = True
     t.start()
 
+    watch_interval = getattr(config, "REQUEST_WATCH_INTERVAL", constants.REQUEST_WATCH_INTERVAL)
+    t.join(watch_interval)
     while t.isAlive():
         yield None, None, None
+        t.join(watch_interval)
 
     full_msg = json.dumps({"status": ws.status, "output": ws.output})
     yield status_code, {}, full_msg
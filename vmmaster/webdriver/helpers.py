@@ -1,14 +1,11 @@
 # coding: utf-8
 
-import base64
 from traceback import format_exc
 
 import commands
-import json
 import time
 import logging
 
-from PIL import Image
 from functools import wraps
 from flask import Response, request, current_app
 
@@ -59,8 +56,6 @@ def connection_watcher(func):
                 raise TimeoutException(session_timeouted)
             elif session_closed:
                 raise SessionException(session_closed)
-
-            time.sleep(0.01)
         return value
     return wrapper
 
@@ -74,25 +69,20 @@ def get_webdriver_command(proxy_request_path):
 
 def save_screenshot(session, screenshot):
     if screenshot:
-        log_step = session.current_log_step
-        path = config.SCREENSHOTS_DIR + "/" + str(session.id) + \
-            "/" + str(log_step.id) + ".png"
-        utils.write_file(path, base64.b64decode(screenshot))
-        log_step.screenshot = path
-        log_step.save()
-        make_thumbnail_for_screenshot(path)
+        current_app.screenshots.put(session.id, session.current_log_step, screenshot)
 
 
 def take_screenshot_from_response(session, body):
-    data = json.loads(body)
-    try:
-        screenshot = data.get('value', {}).get('screen', None)
-    except AttributeError:
+    """
+    :return: body without base64 screenshots
+    """
+    screenshot, redacted = utils.inspect_response(body)
+    if not screenshot:
         log.debug('Screenshot not found in webdriver '
                   'response for session %s' % session.id)
-        screenshot = None
 
     save_screenshot(session, screenshot)
+    return redacted
 
 
 def take_screenshot_from_session(session):
@@ -101,34 +91,23 @@ def take_screenshot_from_session(session):
         save_screenshot(session, screenshot)
 
 
-def make_thumbnail_for_screenshot(screenshot_path):
-    screenshot_resize(screenshot_path, 128, postfix="_thumb")
-
-
-def screenshot_resize(screenshot_path, width, height=None, postfix=None):
-    try:
-        img = Image.open(screenshot_path)
-
-        if height:
-            size = width, height
-        else:
-            wpercent = (width / float(img.size[0]))
-            size = width, int((float(img.size[1]) * float(wpercent)))
-
-        if postfix:
-            postfix = "%s.png" % postfix
-        else:
-            postfix = "%sx%s.png" % size
+def take_screenshot_after_command(session, path, status, body):
+    """
+    :return: body without base64 screenshots if it was inspected, None otherwise
+    """
+    if not session.take_screenshot:
+        return
 
-        new_file_path = screenshot_path.split('.png')[0] + postfix
-        img = img.resize(size, Image.ANTIALIAS)
-        img.save(new_file_path, "PNG")
-    except IOError:
-        log.debug("Can\'t resize image '%s'" % screenshot_path)
+    words = ["url", "click", "execute", "keys", "value"]
+    only_screenshots = ["element", "execute_async"]
+    parts = path.split("/")
+    if set(words) & set(parts) or parts[-1] == "session":
+        take_screenshot_from_session(session)
+    elif set(only_screenshots) & set(parts) and status == 500:
+        return take_screenshot_from_response(session, body)
 
 
-def form_response(code=500, headers=None, body=None, selenium_code=13):
-    """ Send reply to client. """
+def prepare_response(code=500, headers=None, body=None, selenium_code=13):
     if not body:
         body = "Something ugly happened. No real reply formed."
 
@@ -145,6 +124,12 @@ def form_response(code=500, headers=None, body=None, selenium_code=13):
                 "message": body
             }
         })
+    return code, headers, body
+
+
+def form_response(code=500, headers=None, body=None, selenium_code=13):
+    """ Send reply to client. """
+    code, headers, body = prepare_response(code, headers, body, selenium_code)
     return Response(response=body, status=code, headers=headers.iteritems())
 
 
@@ -153,6 +138,15 @@ def swap_session(req, desired_session):
     req.path = commands.set_path_session_id(req.path, desired_session)
 
 
+def endpoint_timeout_response(session, tb):
+    """
+    Response for command timed out on endpoint, shared by threaded and reactor proxies
+    """
+    if not session.endpoint.ping_vm():
+        raise EndpointUnreachableError("Endpoint {} unreachable".format(session.endpoint))
+    return 500, None, tb
+
+
 @connection_watcher
 def transparent():
     status, headers, body = None, None, None
@@ -168,9 +162,7 @@ def transparent():
         ):
             yield status, headers, body
     except RequestTimeoutException:
-        if not request.session.endpoint.ping_vm():
-            raise EndpointUnreachableError("Endpoint {} unreachable".format(request.session.endpoint))
-        status, headers, body = 500, None, format_exc()
+        status, headers, body = endpoint_timeout_response(request.session, format_exc())
     finally:
         swap_session(request, str(request.session.id))
 
@@ -1,7 +1,11 @@
 # coding: utf-8
 
+import time
 import logging
+from threading import Thread, Lock
+from multiprocessing.pool import ThreadPool
 
+from core import constants
 from core.config import config
 from core.utils import openstack_utils, exception_handler
 from core.clients.docker_client import DockerManageClient
@@ -88,38 +92,165 @@ class PlatformsInterface(object):
         raise NotImplementedError
 
 
+class ImagePullProgress(object):
+    """
+    Progress of image pull by layers, it's logged every DOCKER_PULL_PROGRESS_INTERVAL seconds
+    """
+    def __init__(self, image_name):
+        self.image_name = image_name
+        self.interval = getattr(config, "DOCKER_PULL_PROGRESS_INTERVAL", constants.DOCKER_PULL_PROGRESS_INTERVAL)
+        self.layers = {}
+        self.done = set()
+        self.logged = time.time()
+
+    def __call__(self, status):
+        layer = status.get("id")
+        if layer and "progressDetail" in status:
+            detail = status["progressDetail"] or {}
+            if detail.get("total"):
+                self.layers[layer] = (detail.get("current", 0), detail["total"])
+            if status.get("status") in ("Pull complete", "Already exists"):
+                self.done.add(layer)
+
+        if time.time() - self.logged >= self.interval:
+            self.logged = time.time()
+            log.info("Pull image {}: {}".format(self.image_name, self))
+
+    def __str__(self):
+        current = sum(current for current, total in self.layers.values())
+        total = sum(total for current, total in self.layers.values())
+        return "{} layers pulled, {:.1f}/{:.1f} MB downloaded".format(
+            len(self.done), current / 1048576.0, total / 1048576.0
+        )
+
+
+class ImagesWatcher(Thread):
+    """
+    Refreshes images of DockerPlatforms on docker image events,
+    events stream is reopened every DOCKER_IMAGES_REFRESH_INTERVAL seconds
+    """
+    ACTIONS = ("pull", "tag", "untag", "delete", "import", "load")
+
+    def __init__(self, docker_platforms, on_refresh=None):
+        super(ImagesWatcher, self).__init__()
+        self.daemon = True
+        self.running = True
+        self.docker_platforms = docker_platforms
+        self.on_refresh = on_refresh
+        self.interval = getattr(
+            config, "DOCKER_IMAGES_REFRESH_INTERVAL", constants.DOCKER_IMAGES_REFRESH_INTERVAL
+        )
+
+    def refresh(self):
+        images = self.docker_platforms.refresh_images()
+        if self.on_refresh:
+            self.on_refresh(images)
+
+    def run(self):
+        log.info("ImagesWatcher started...")
+        since = int(time.time())
+        while self.running:
+            until = since + self.interval
+            try:
+                for event in self.docker_platforms.client.image_events(since=since, until=until):
+                    if event.get("Action", event.get("status")) in self.ACTIONS:
+                        self.refresh()
+            except Exception as e:
+                log.exception("Exception in ImagesWatcher: %s", e)
+                time.sleep(self.interval)
+                self.refresh()
+            since = until
+
+    def stop(self):
+        self.running = False
+        self.join(1)
+        log.info("ImagesWatcher stopped")
+
+
 class DockerPlatforms(PlatformsInterface):
+    """
+    Images are listed once and kept by short name, they are refreshed
+    by ImagesWatcher on docker image events
+    """
     client = DockerManageClient()
 
     def __init__(self, database):
         self.database = database
+        self.images = None
+        self.images_lock = Lock()
+        self.images_watcher = None
 
         from core.db.models import DockerClone
         self.clone_class = DockerClone
 
-    @classmethod
-    def get(cls, platform):
-        return cls.client.get_image(name=platform)
+    def refresh_images(self):
+        """
+        :return: images by short name, last ones if images can't be listed
+        """
+        images = self.client.images()
+        if images is None:
+            log.warning("Docker images can't be listed, last ones are used")
+            with self.images_lock:
+                return self.images or {}
+
+        images = {image.short_name: image for image in images if config.DOCKER_IMAGE_NAME_PREFIX in image.name}
+        with self.images_lock:
+            self.images = images
+        log.info("Docker images refreshed: {}".format(images.keys()))
+        return images
+
+    def get_images(self):
+        with self.images_lock:
+            images = self.images
+        return images if images is not None else self.refresh_images()
+
+    def get(self, platform):
+        return self.get_images().get(platform)
+
+    def watch_images(self, on_refresh=None):
+        self.images_watcher = ImagesWatcher(self, on_refresh)
+        self.images_watcher.start()
+
+    def stop_watching_images(self):
+        watcher, self.images_watcher = self.images_watcher, None
+        if watcher:
+            watcher.stop()
+
+    def pull_image(self, platform_name):
+        try:
+            image_name, image_tag = platform_name.split(":")
+        except ValueError:
+            log.warning("Wrong platform name {} (must be: image_name:tag)".format(platform_name))
+            return
+        name = "{}{}".format(config.DOCKER_IMAGE_NAME_PREFIX, image_name)
+        log.info("Pull image: {}{}".format(config.DOCKER_IMAGE_NAME_PREFIX, platform_name))
+        progress = ImagePullProgress("{}:{}".format(name, image_tag))
+        start = time.time()
+        self.client.pull_image(name=name, tag=image_tag, progress=progress)
+        log.info("Image {}{} was pulled in {:.1f} seconds: {}".format(
+            config.DOCKER_IMAGE_NAME_PREFIX, platform_name, time.time() - start, progress
+        ))
 
     def prepare_platforms(self):
-        for platform_type in config.PLATFORMS.values():
-            for platform_name in platform_type:
-                try:
-                    image_name, image_tag = platform_name.split(":")
-                except ValueError:
-                    log.warning("Wrong platform name {} (must be: image_name:tag)".format(platform_name))
-                    continue
-                log.info("Pull image: {}{}".format(
-                    config.DOCKER_IMAGE_NAME_PREFIX,
-                    platform_name))
-                self.client.pull_image(
-                    name="{}{}".format(config.DOCKER_IMAGE_NAME_PREFIX, image_name),
-                    tag=image_tag
-                )
+        """
+        Images of all platforms are pulled by DOCKER_PULL_CONCURRENCY workers
+        """
+        platform_names = [
+            platform_name for platform_type in config.PLATFORMS.values() for platform_name in platform_type
+        ]
+        if platform_names:
+            workers = ThreadPool(min(
+                len(platform_names), getattr(config, "DOCKER_PULL_CONCURRENCY", constants.DOCKER_PULL_CONCURRENCY)
+            ))
+            try:
+                workers.map(self.pull_image, platform_names)
+            finally:
+                workers.close()
+        self.refresh_images()
 
     @property
     def platforms(self):
-        return [image for image in self.client.images() if config.DOCKER_IMAGE_NAME_PREFIX in image.name]
+        return self.get_images().values()
 
     @staticmethod
     def max_count():
@@ -181,6 +312,7 @@ class Platforms(object):
         log.info("Loading platforms...")
 
         self.db = database
+        self.docker_platforms_lock = Lock()
         self.openstack = OpenstackPlatforms(database)
         self.docker = DockerPlatforms(database)
 
@@ -191,12 +323,29 @@ class Platforms(object):
             )
         if config.USE_DOCKER:
             self.docker.prepare_platforms()
-            self.docker_platforms = {vm.short_name: vm for vm in self.docker.platforms}
+            self.docker_platforms = dict(self.docker.get_images())
             log.info("Docker platforms: {}".format(
                 self.docker_platforms.keys())
             )
+            self.docker.watch_images(self.update_docker_platforms)
         self._load_platforms()
 
+    def update_docker_platforms(self, images):
+        """
+        Refreshed docker images replace docker platforms, platforms
+        which have gone are removed. Platforms of registered provider
+        are updated in DB, vmmaster routes sessions by them
+        """
+        with self.docker_platforms_lock:
+            if not self.docker.images_watcher:
+                return
+            for platform in set(self.docker_platforms) - set(images):
+                self.platforms.pop(platform, None)
+            self.docker_platforms = dict(images)
+            self.platforms.update(self.docker_platforms)
+            if self.provider_id:
+                self.db.update_platforms(self.provider_id, self.info())
+
     def _load_platforms(self):
         if bool(self.openstack_platforms):
             self.platforms.update(self.openstack_platforms)
@@ -262,11 +411,14 @@ class Platforms(object):
         return list(self.platforms.keys())
 
     def cleanup(self):
+        # watcher is stopped first, so refresh doesn't bring docker platforms back
+        self.docker.stop_watching_images()
         if bool(self.openstack_platforms):
             for platform in self.openstack_platforms:
                 del self.platforms[platform]
             self.openstack_platforms = {}
-        if bool(self.docker_platforms):
-            for platform in self.docker_platforms:
-                del self.platforms[platform]
-            self.docker_platforms = {}
+        with self.docker_platforms_lock:
+            if bool(self.docker_platforms):
+                for platform in self.docker_platforms:
+                    del self.platforms[platform]
+                self.docker_platforms = {}
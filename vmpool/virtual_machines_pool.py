@@ -1,10 +1,14 @@
 # coding: utf-8
 
 import time
+import heapq
 import logging
-from threading import Thread, Lock
-from collections import defaultdict
+from datetime import datetime
+from threading import Thread, Lock, RLock
+from collections import defaultdict, deque
+from multiprocessing.pool import ThreadPool
 
+from core import constants
 from core.config import config
 from core.profiler import profiler
 from core.utils import get_environment_variables_from_dc
@@ -17,50 +21,225 @@ log = logging.getLogger(__name__)
 
 
 class VirtualMachinesPoolPreloader(Thread):
+    """
+    Keeps preloaded endpoints of every platform at target: deficit of all platforms
+    is computed every PRELOADER_FREQUENCY seconds and endpoints are created in
+    parallel by PRELOADER_CONCURRENCY workers.
+    With PRELOADER_DEMAND_WINDOW target of platform is raised to amount of get_vm
+    calls for it during the window, up to PRELOADER_DEMAND_MAX_TARGET.
+    Paused docker containers of DOCKER_PAUSED are kept the same way
+    """
+    PREFIXES = ("preloaded", "paused")
+
     def __init__(self, pool):
         Thread.__init__(self)
         self.app = pool.app
         self.running = True
         self.daemon = True
         self.pool = pool
+        self.concurrency = getattr(config, "PRELOADER_CONCURRENCY", constants.PRELOADER_CONCURRENCY)
+        self.demand_window = getattr(config, "PRELOADER_DEMAND_WINDOW", constants.PRELOADER_DEMAND_WINDOW)
+        self.demand_max_target = getattr(
+            config, "PRELOADER_DEMAND_MAX_TARGET", constants.PRELOADER_DEMAND_MAX_TARGET
+        )
+        self.workers = None
+        # preloads which are queued or in progress by prefix
+        self.pending = {prefix: defaultdict(int) for prefix in self.PREFIXES}
+        self.pending_lock = Lock()
+        # get_vm calls times by platform
+        self.demand = defaultdict(deque)
+        self.demand_lock = Lock()
 
     def run(self):
         log.info("Preloader started...")
+        self.workers = ThreadPool(self.concurrency)
         with self.app.app_context():
             while self.running:
                 try:
-                    platform_name = self.need_load()
-                    if platform_name is not None:
-                        self.pool.preload(platform_name, "preloaded")
+                    for prefix in self.PREFIXES:
+                        for platform_name, deficit in self.need_load(prefix).iteritems():
+                            for _ in range(deficit):
+                                self.submit(platform_name, prefix)
                 except Exception as e:
                     log.exception('Exception in preloader: %s', e.message)
 
                 time.sleep(config.PRELOADER_FREQUENCY)
 
-    def need_load(self):
-        preloaded = [vm for vm in self.pool.active_endpoints if vm.is_preloaded()]
-        already_have = self.pool.count_virtual_machines(preloaded)
-        platforms = {}
+    def submit(self, platform_name, prefix="preloaded"):
+        with self.pending_lock:
+            self.pending[prefix][platform_name] += 1
+        self.workers.apply_async(self.preload, (platform_name, prefix))
 
+    def preload(self, platform_name, prefix="preloaded"):
+        result = "failed"
+        try:
+            if not self.running:
+                # queued before stop, endpoint wouldn't be deleted by anyone
+                return
+            with self.app.app_context(), profiler.preload_duration(platform_name):
+                endpoint = self.pool.preload(platform_name, prefix)
+            if endpoint is None:
+                result = "rejected"
+            elif getattr(endpoint, "ready", False) or (prefix == "paused" and not endpoint.deleted):
+                result = "created"
+        except Exception as e:
+            log.exception('Exception in preloader: %s', e.message)
+        finally:
+            with self.pending_lock:
+                self.pending[prefix][platform_name] -= 1
+        profiler.register_preload(platform_name, result)
+
+    def register_demand(self, platform_name):
+        if not self.demand_window:
+            return
+        with self.demand_lock:
+            self.demand[platform_name].append(time.time())
+
+    def recent_demand(self):
+        """
+        :return: dict of platform name and amount of get_vm calls during demand window
+        """
+        window_start = time.time() - self.demand_window
+        with self.demand_lock:
+            for calls in self.demand.values():
+                while calls and calls[0] < window_start:
+                    calls.popleft()
+            return {platform_name: len(calls) for platform_name, calls in self.demand.items() if calls}
+
+    def targets(self, prefix="preloaded"):
+        if prefix == "paused":
+            return dict(getattr(config, "DOCKER_PAUSED", constants.DOCKER_PAUSED)) if config.USE_DOCKER else {}
+
+        platforms = {}
         if config.USE_OPENSTACK:
             platforms.update(config.OPENSTACK_PRELOADED)
         if config.USE_DOCKER:
             platforms.update(config.DOCKER_PRELOADED)
 
-        for platform_name, need in platforms.iteritems():
+        if self.demand_window:
+            for platform_name, demand in self.recent_demand().iteritems():
+                if self.pool.check_platform(platform_name):
+                    platforms[platform_name] = max(
+                        platforms.get(platform_name, 0), min(demand, self.demand_max_target)
+                    )
+        return platforms
+
+    def need_load(self, prefix="preloaded"):
+        """
+        :return: dict of platform name and amount of endpoints to preload with prefix
+        """
+        if prefix == "paused":
+            already_have = self.pool.count_paused()
+        else:
+            already_have = self.pool.count_virtual_machines(
+                vm for vm in self.pool.active_endpoints if vm.is_preloaded()
+            )
+        with self.pending_lock:
+            pending = dict(self.pending[prefix])
+
+        deficits = {}
+        for platform_name, need in self.targets(prefix).iteritems():
             have = already_have.get(platform_name, 0)
-            if need > have:
-                return platform_name
+            if prefix == "preloaded":
+                profiler.register_preload_fill(platform_name, need, have)
+            # endpoints in progress are counted twice here, so it's never preloaded too much
+            deficit = need - have - pending.get(platform_name, 0)
+            if deficit > 0:
+                deficits[platform_name] = deficit
+        return deficits
 
     def stop(self):
         self.running = False
         self.join(1)
+        if self.workers:
+            # queued preloads are dropped, preloads in progress are waited for
+            self.workers.terminate()
+            self.workers.join()
         log.info("Preloader stopped")
 
 
+class FreeEndpoints(object):
+    """
+    Ready endpoints which are not in use, by platform, the newest is taken first.
+    It's updated on set_ready, set_in_use and delete of endpoints, db is the source
+    of truth still: taken endpoint has to be checked in db and free endpoints are
+    reloaded from db every FREE_ENDPOINTS_RECONCILE_INTERVAL seconds
+    """
+    EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, reconcile_interval=None):
+        self.reconcile_interval = reconcile_interval if reconcile_interval is not None else getattr(
+            config, "FREE_ENDPOINTS_RECONCILE_INTERVAL", constants.FREE_ENDPOINTS_RECONCILE_INTERVAL
+        )
+        self.reconciled = 0
+        # heap of (-created time, endpoint id), entries of taken endpoints are skipped on pop
+        self._heaps = defaultdict(list)
+        self._free = defaultdict(dict)
+        self._locks = defaultdict(RLock)
+        self._locks_lock = Lock()
+
+    def lock(self, platform_name):
+        with self._locks_lock:
+            return self._locks[platform_name]
+
+    def _key(self, endpoint):
+        if not endpoint.created_time:
+            return 0.0
+        return -(endpoint.created_time - self.EPOCH).total_seconds()
+
+    def __len__(self):
+        return sum(len(free) for free in self._free.values())
+
+    def update(self, endpoint):
+        platform_name = endpoint.platform_name
+        with self.lock(platform_name):
+            free = self._free[platform_name]
+            if endpoint.ready and endpoint.in_use is False and not endpoint.deleted:
+                key = self._key(endpoint)
+                if free.get(endpoint.id) != key:
+                    free[endpoint.id] = key
+                    heapq.heappush(self._heaps[platform_name], (key, endpoint.id))
+            elif free.pop(endpoint.id, None) is not None and len(self._heaps[platform_name]) > 2 * len(free) + 16:
+                self._heaps[platform_name] = [(key, endpoint_id) for endpoint_id, key in free.items()]
+                heapq.heapify(self._heaps[platform_name])
+
+    def pop(self, platform_name):
+        """
+        :return: id of the newest free endpoint or None
+        """
+        with self.lock(platform_name):
+            heap, free = self._heaps[platform_name], self._free[platform_name]
+            while heap:
+                key, endpoint_id = heapq.heappop(heap)
+                if free.get(endpoint_id) == key:
+                    del free[endpoint_id]
+                    return endpoint_id
+
+    def reconcile(self, endpoints):
+        """
+        Replace free endpoints with ready ones of endpoints which are not deleted and not in use
+        """
+        free = defaultdict(dict)
+        for endpoint in endpoints:
+            if endpoint.ready and endpoint.in_use is False and not endpoint.deleted:
+                free[endpoint.platform_name][endpoint.id] = self._key(endpoint)
+
+        for platform_name in set(self._free.keys()) | set(free.keys()):
+            with self.lock(platform_name):
+                self._free[platform_name] = free[platform_name]
+                self._heaps[platform_name] = [(key, endpoint_id) for endpoint_id, key in free[platform_name].items()]
+                heapq.heapify(self._heaps[platform_name])
+        self.reconciled = time.time()
+
+    @property
+    def expired(self):
+        return time.time() - self.reconciled > self.reconcile_interval
+
+
 class VirtualMachinesPool(object):
     provider = None
     lock = Lock()
+    paused_lock = Lock()
 
     def __str__(self):
         return str(self.active_endpoints)
@@ -75,6 +254,9 @@ class VirtualMachinesPool(object):
         self.platforms = platforms_class(self.app.database)
         self.register()
 
+        self.free_endpoints = FreeEndpoints()
+        # ids of paused docker endpoints which are not taken yet by platform
+        self.paused = defaultdict(deque)
         self.preloader = preloader_class(self)
         self.artifact_collector = artifact_collector_class(self.app.database)
         self.endpoint_remover = endpoint_remover_class(
@@ -143,8 +325,8 @@ class VirtualMachinesPool(object):
             self.artifact_collector.stop()
         if self.endpoint_remover:
             self.endpoint_remover.stop()
-        self.unregister()
         self.platforms.cleanup()
+        self.unregister()
 
     def count(self):
         return len(self.active_endpoints)
@@ -179,18 +361,23 @@ class VirtualMachinesPool(object):
 
     def get_by_platform(self, platform_name):
         """
-        Get preloaded platform from endpoint pool
+        Get preloaded platform from endpoint pool, the newest free endpoint
+        is taken from free endpoints and checked in db
         :param platform_name:
         :return:
         """
-        res = None
-
-        with self.lock:
-            if not self.has(platform_name):
-                return None
+        if self.free_endpoints.expired:
+            self.free_endpoints.reconcile(self.pool)
 
-            for vm in sorted(self.pool, key=lambda v: v.created_time, reverse=True):
-                if vm.platform_name == platform_name and vm.ready:
+        res = None
+        with self.free_endpoints.lock(platform_name):
+            while True:
+                endpoint_id = self.free_endpoints.pop(platform_name)
+                if endpoint_id is None:
+                    return None
+
+                vm = self.get_by_id(endpoint_id)
+                if vm and vm.ready and vm.in_use is False and not vm.deleted:
                     log.info(
                         "Got VM %s (ip=%s, ready=%s)" %
                         (vm.name, vm.ip, vm.ready)
@@ -199,9 +386,6 @@ class VirtualMachinesPool(object):
                     vm.set_in_use(True)
                     break
 
-        if not res:
-            return None
-
         if res.ping_vm():
             return res
         else:
@@ -227,11 +411,68 @@ class VirtualMachinesPool(object):
 
         return result
 
+    def count_paused(self):
+        """
+        Paused endpoints which were deleted meanwhile are forgotten
+        :return: dict of platform name and amount of paused endpoints
+        """
+        active = {vm.id for vm in self.active_endpoints}
+        with self.paused_lock:
+            for ids in self.paused.values():
+                for endpoint_id in [endpoint_id for endpoint_id in ids if endpoint_id not in active]:
+                    ids.remove(endpoint_id)
+            return {platform_name: len(ids) for platform_name, ids in self.paused.items() if ids}
+
+    def take_paused(self, platform_name):
+        """
+        Paused endpoint id is taken from paused endpoints under lock, so it isn't taken twice
+        """
+        while True:
+            with self.paused_lock:
+                paused = self.paused.get(platform_name)
+                if not paused:
+                    return None
+                endpoint_id = paused.popleft()
+
+            vm = self.get_by_id(endpoint_id)
+            if vm and not vm.deleted and not vm.in_use:
+                return vm
+
+    def add_from_paused(self, platform_name):
+        """
+        :return: unpaused ready endpoint or None if there is no paused endpoint of platform
+        """
+        start = time.time()
+        clone = self.take_paused(platform_name)
+        if not clone:
+            return None
+
+        try:
+            clone.set_in_use(True)
+            clone.unpause()
+        except Exception as e:
+            log.exception("Error unpausing vm: %s" % e.message)
+            clone.delete()
+            return None
+
+        if clone.ready:
+            profiler.register_endpoint_startup(platform_name, "unpaused", time.time() - start)
+            return clone
+        clone.delete()
+
     def add(self, platform_name, prefix="ondemand", environment_variables=None):
         # TODO: remove all app_context usages, use direct link to app/database objects
         if prefix == "preloaded":
             log.info("Preloading {}".format(platform_name))
 
+        # paused endpoints are for endpoints requested by get_vm only,
+        # environment variables of paused container can't be changed
+        if prefix == "ondemand" and not environment_variables:
+            clone = self.add_from_paused(platform_name)
+            if clone:
+                return clone
+
+        start = time.time()
         with self.lock:
             if not self.can_produce(platform_name):
                 return None
@@ -241,7 +482,7 @@ class VirtualMachinesPool(object):
                 clone = origin.make_clone(origin, prefix, self)
                 if environment_variables:
                     clone.set_env_vars(environment_variables)
-                if not clone.is_preloaded():
+                if not clone.is_preloaded() and prefix != "paused":
                     clone.set_in_use(True)
             except Exception as e:
                 log.exception(
@@ -251,6 +492,11 @@ class VirtualMachinesPool(object):
 
         try:
             clone.create()
+            profiler.register_endpoint_startup(platform_name, "ready", time.time() - start)
+            if prefix == "paused" and clone.ready:
+                clone.pause()
+                with self.paused_lock:
+                    self.paused[platform_name].append(clone.id)
         except Exception as e:
             log.exception("Error creating vm: %s" % e.message)
             clone.delete()
@@ -259,6 +505,7 @@ class VirtualMachinesPool(object):
 
     def get_vm(self, platform_name, dc):
         timer = profiler.functions_duration_manual(self.get_vm.__name__)
+        self.preloader.register_demand(platform_name)
         env_vars = get_environment_variables_from_dc(dc)
 
         if not env_vars: